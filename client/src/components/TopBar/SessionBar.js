@@ -109,7 +109,7 @@ const SessionBar = props => {
                         name="files[]"
                         type="file"
                         hidden
-                        accept=".csv,.npy,.h5"
+                        accept=".csv,.npy,.h5,.parquet,.arrow,.feather"
                         onChange={e => {
                             if (e.target.files.length) fileLoad(e.target.files);
                         }}
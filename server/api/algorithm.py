@@ -58,6 +58,20 @@ class algorithm():
 
     def run(self):
 
+        for result in self.stream():
+            pass
+        return result
+
+    def stream(self, rows=0):
+        '''
+        Inputs:
+            rows (int)  - rows per block of the result fields sent while
+                          the algorithm runs, 0 to send none
+
+        Outputs:
+            generator of the RowBlocks (see api.sub.frames) fit_blocks sends
+            as it computes the result fields, and then of the result
+        '''
         self.cache = get_cache(self.session, timeout=None)
 
         startTime = time.time()
@@ -76,18 +90,21 @@ class algorithm():
                 "WARNING"] = "Input hash not found: {inputHash}".format(
                     inputHash=self.inputHash)
             self.result['message'] = "failure"
-            return self.result
+            yield self.result
+            return
 
         self.X = returnHash['data']
         if self.X is None:
             self.result['message'] = "failure"
             logging.warning("X returned None")
-            return self.result
+            yield self.result
+            return
 
         ret = self.check_valid()
         if not ret:
             self.result['message'] = "failure"
-            return self.result
+            yield self.result
+            return
 
         if self.X.ndim == 1:
             full_samples = self.X.shape[0]
@@ -108,7 +125,8 @@ class algorithm():
                 logging.warning("Subset hash not found: {subsetHash}".format(
                     subsetHash=self.subsetHashName))
                 self.result['message'] = "failure"
-                return self.result
+                yield self.result
+                return
 
         if self.downsampled is not False:
             self.X = downsample(
@@ -126,7 +144,8 @@ class algorithm():
                 logging.warning("Label hash not found: {labelHash}".format(
                     self.labelHash))
                 self.result['message'] = "failure"
-                return self.result
+                yield self.result
+                return
             else:
                 self.y = labelHash_dict['data']
                 self.result['y'] = self.y.tolist()
@@ -138,16 +157,17 @@ class algorithm():
             computed_samples, computed_features = self.X.shape
 
         self.X = impute(self.X)
-        self.result['data'] = self.X.tolist()
+        self.result['data'] = self.X
 
         self.algorithm = self.get_algorithm()
         if self.algorithm == None:
             self.result['message'] = "failure"
             self.result['WARNING'] = "{alg} algorithm not supported".format(
                 alg=self.algorithmName)
-            return self.result
+            yield self.result
+            return
 
-        self.fit_algorithm()
+        yield from self.fit_blocks(rows)
 
         # TODO - The front end should specify a save name for the model
         model_name = self.algorithmName + "_" + str(random.random())
@@ -169,4 +189,16 @@ class algorithm():
                 computed_samples, computed_features)
 
         self.result['message'] = "success"
-        return self.result
+        yield self.result
+
+    def fit_blocks(self, rows):
+        '''
+        Inputs:
+            rows (int)  - rows per block, see stream
+
+        Outputs:
+            RowBlocks of the result fields as fit_algorithm computes them,
+            by default none
+        '''
+        self.fit_algorithm()
+        return ()
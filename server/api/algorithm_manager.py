@@ -31,6 +31,27 @@ from api.correlation import correlation
 
 from api.sub.system import get_featureList
 from api.sub.hash import get_cache
+from api.sub.frames import row_blocks
+from api.sub.frames import stream_rows
+
+
+def stream_clustering(pca, clusters, rows):
+    '''
+    Inputs:
+        pca (dict)              - result of the 2D PCA of the input
+        clusters (clustering)   - clustering to run
+        rows (int)              - rows per block
+
+    Outputs:
+        generator of the RowBlocks of the PCA rows, sent before the clusters
+        are fit, and then of the clustering result
+    '''
+    yield from row_blocks("data", pca.get("data"), rows)
+
+    result = clusters.run()
+    if "data" in pca:
+        result["data"] = pca["data"]
+    yield result
 
 
 def algorithm_call(msg, result):
@@ -88,8 +109,7 @@ def algorithm_call(msg, result):
 
         hashList = ch.feature2hashList(featureList)
 
-        data = ch.mergeHashResults(hashList)
-        inputHash = ch.hashArray('Merged', data, "feature")
+        inputHash = ch.mergeHashView(hashList)
 
         if (inputHash != None):
             inputHash = inputHash["hash"]
@@ -97,6 +117,9 @@ def algorithm_call(msg, result):
         if (downsampled != False):
             downsampled = int(downsampled)
 
+        # streaming requests get their row blocks as they are computed
+        rows = stream_rows(msg)
+
         if (algorithmType == "clustering"):
             pca = dimension_reduction(inputHash, activeLabels, featureList,
                                       hashList, labelHash, subsetHashName,
@@ -104,11 +127,15 @@ def algorithm_call(msg, result):
                                           "n_components": 2
                                       }, scoring, search_type, cross_val,
                                       result, ch, excludeDataSelections).run()
-            result = clustering(inputHash, activeLabels, featureList, hashList,
-                                labelHash, subsetHashName, algorithmName,
-                                downsampled, parms, scoring, search_type,
-                                cross_val, result, ch,
-                                excludeDataSelections).run()
+            clusters = clustering(inputHash, activeLabels, featureList,
+                                  hashList, labelHash, subsetHashName,
+                                  algorithmName, downsampled, parms, scoring,
+                                  search_type, cross_val, result, ch,
+                                  excludeDataSelections)
+            if rows:
+                return stream_clustering(pca, clusters, rows)
+
+            result = clusters.run()
             result['data'] = pca['data']
 
         elif (algorithmType == "dimensionality_reduction"):
@@ -133,11 +160,15 @@ def algorithm_call(msg, result):
                                     excludeDataSelections).run()
 
         elif (algorithmType == "regression"):
-            result = regression(inputHash, activeLabels, featureList, hashList,
-                                labelHash, subsetHashName, algorithmName,
-                                downsampled, parms, scoring, search_type,
-                                cross_val, result, ch,
-                                excludeDataSelections).run()
+            regressor = regression(inputHash, activeLabels, featureList,
+                                   hashList, labelHash, subsetHashName,
+                                   algorithmName, downsampled, parms, scoring,
+                                   search_type, cross_val, result, ch,
+                                   excludeDataSelections)
+            if rows:
+                return regressor.stream(rows)
+
+            result = regressor.run()
 
         elif (algorithmType == "template_scan"):
             result = template_scan(inputHash, activeLabels, featureList,
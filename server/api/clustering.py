@@ -111,7 +111,7 @@ class clustering(algorithm):
         label_hash = self.cache.hashArray(merged_hash["hash"], y_pred, "label")
 
         self.result['numClusters'] = np.unique(y_pred).size
-        self.result['clusters'] = y_pred.tolist()
+        self.result['clusters'] = y_pred
 
         try:
             centers = self.algorithm.cluster_centers_
@@ -21,6 +21,20 @@ logger = logging.getLogger(__name__)
 
 from api.sub.hash import get_cache
 from api.sub.downsample import simple_downsample
+from api.sub.read_data import read_csv_columns
+from api.sub.read_data import iter_csv_columns
+from api.sub.read_data import iter_hd5
+from api.sub.read_data import iter_npy
+from api.sub.read_data import iter_parquet
+from api.sub.read_data import iter_arrow
+from api.sub.read_data import CODEX_HD5_LAZY
+from api.sub.feature_bytes import selection_array
+from api.sub.feature_bytes import pack_batch
+from api.sub.feature_bytes import make_etag
+from api.sub.feature_bytes import etag_matches
+from api.sub.feature_bytes import compress
+from api.sub.frames import RowBlock
+from api.sub.frames import stream_rows
 
 
 def get_data_metrics(msg, result):
@@ -35,9 +49,10 @@ def get_data_metrics(msg, result):
     try:
         ch = get_cache(msg['sessionkey'], timeout=None)
 
-        for feature_name in msg['name']:
+        # fetch every feature in one round trip
+        hashLibs = ch.findHashArrays("name", msg['name'], "feature")
 
-            hashLib = ch.findHashArray("name", feature_name, "feature")
+        for feature_name, hashLib in zip(msg['name'], hashLibs):
 
             if hashLib:
                 data = hashLib['data']
@@ -60,7 +75,7 @@ def get_data_metrics(msg, result):
                 result['length'] = data.shape[0]
                 try:
                     result['downsample'] = simple_downsample(
-                        data[~np.isnan(data)], 100).tolist()
+                        data[~np.isnan(data)], 100)
                 except Exception as e:
                     import traceback
                     traceback.print_exc()
@@ -125,6 +140,52 @@ def add_data(msg, result):
     return result
 
 
+def data_rows(columns, sentinels, rows=slice(None)):
+    '''
+    Inputs:
+        columns (list)      - array of each feature
+        sentinels (tuple)   - (nan, inf, ninf) of the session
+        rows (slice)        - rows to return
+
+    Outputs:
+        (rows, features) float array of the rows, with the non-finite
+        values of the first column swapped for the session sentinels
+    '''
+    data = np.column_stack([column[rows] for column in columns])
+    data = data.astype(float)
+
+    nan, inf, ninf = sentinels
+    first = data[:, 0]
+    first[np.isnan(first)] = nan
+    first[np.isposinf(first)] = inf
+    first[np.isneginf(first)] = ninf
+
+    return data
+
+
+def stream_data(columns, sentinels, rows, result):
+    '''
+    Inputs:
+        see data_rows
+        rows (int)      - rows per block
+        result (dict)   - response, sent after the blocks
+
+    Outputs:
+        generator of the RowBlocks of "data", each built only once the one
+        before it has been sent, and then of the response
+    '''
+    total = len(columns[0])
+    for start in range(0, total, rows):
+        yield RowBlock({
+            "field": "data",
+            "offset": start,
+            "rows": total,
+            "data": data_rows(columns, sentinels, slice(start, start + rows))
+        })
+
+    yield result
+
+
 def get_data(msg, result):
     '''
     Inputs:
@@ -134,6 +195,9 @@ def get_data(msg, result):
     Notes: TODO - need to validate inf/-inf
            TODO - nested ndarray structure should be fixed.  Need to coordiante with client parser.  Commented code for future non-nested ndarray
 
+           A request that streams (see stream_rows) longer than a block
+           gets a generator, sending the rows as they are built
+
     '''
     try:
         ch = get_cache(msg['sessionkey'], timeout=None)
@@ -145,17 +209,27 @@ def get_data(msg, result):
         data = []
         status = True
 
-        for name in names:
-            if (hashType == "selection"):
-                array = ch.findHashArray("name", name, "subset")
-            elif (hashType == "feature"):
-                array = ch.findHashArray("name", name, "feature")
-            elif (hashType == "downsample"):
-                array = ch.findHashArray("name", name, "downsample")
-            elif (hashType == "label"):
-                array = ch.findHashArray("name", name, "label")
-            else:
-                result["message"] = 'failure'
+        if (hashType == "selection"):
+            cacheType = "subset"
+        elif (hashType in ["feature", "downsample", "label"]):
+            cacheType = hashType
+        else:
+            cacheType = None
+            result["message"] = 'failure'
+            status = False
+
+        if (cacheType is not None):
+            # fetch the arrays and sentinel values in one round trip
+            batch = ch.batch()
+            batch.findHashArrays("name", names, cacheType)
+            batch.get_nan()
+            batch.get_inf()
+            batch.get_ninf()
+            arrays, nan, inf, ninf = batch.execute()
+        else:
+            arrays = []
+
+        for name, array in zip(names, arrays):
 
             if not array:
                 result["message"] = 'failed to find {name} feature.'.format(
@@ -173,25 +247,18 @@ def get_data(msg, result):
                 #     array['data'] = simple_downsample(
                 #         np.array(array['data']), 5000)
 
-                data.append(array['data'])
+                data.append(np.asarray(array['data']))
 
         if (status):
-            data = np.column_stack(data)
-            x_, y_ = data.shape
-            data = data.astype(float)
-            for x in range(0, x_):
-                if (np.isnan(data[x][0])):
-                    data[x][0] = ch.get_nan()
-                elif (np.isinf(data[x][0]) and data[x][0] > 0):
-                    data[x][0] = ch.get_inf()
-                elif (np.isinf(data[x][0]) and data[x][0] < 0):
-                    data[x][0] = ch.get_ninf()
+            rows = stream_rows(msg)
+            if 0 < rows < len(data[0]):
+                return stream_data(data, (nan, inf, ninf), rows, result)
 
             #data[data == np.float64("nan")] = nan
             #data[data == np.float64("inf")] = inf
             #data[data == np.float64("-inf")] = ninf
 
-            result['data'] = data.tolist()
+            result['data'] = data_rows(data, (nan, inf, ninf))
 
     except:
         logging.warning(traceback.format_exc())
@@ -199,6 +266,92 @@ def get_data(msg, result):
     return result
 
 
+def get_feature_bytes(msg, result):
+    '''
+    Inputs:
+        msg (dict)     - request for raw feature data:
+                            selections, parsed by parse_selection
+                            batch, to pack the selections as a batch
+                            encoding, content encoding of the response
+                            etag, If-None-Match header of the HTTP request
+    Outputs:
+        result (dict)  - response:
+                            status, "success" or "failure"
+                            etag of the response
+                            not_modified, if etag matched the request
+                            data, body of the response (bytes)
+                            dtype, rows and columns of a single selection
+
+    Notes:
+        See api.sub.feature_bytes for the layout of the body. The features
+        are read straight from the cache arrays, without passing through
+        lists or JSON.
+
+    '''
+    selections = msg['selections']
+    encoding = msg.get('encoding')
+    request_etag = msg.get('etag')
+    # the request is not part of the response
+    for key in ('selections', 'etag'):
+        result.pop(key, None)
+
+    try:
+        ch = get_cache(msg['sessionkey'], timeout=None)
+        names = [name for selection in selections for name in selection['name']]
+
+        # a repeat fetch only needs the hashes to be answered
+        batch = ch.batch()
+        batch.feature2hashList(names)
+        batch.get_nan()
+        batch.get_inf()
+        batch.get_ninf()
+        hashes, *sentinels = batch.execute()
+
+        etag = make_etag(hashes, selections, sentinels, encoding)
+        if len(hashes) == len(names) and etag_matches(etag, request_etag):
+            result['status'] = 'success'
+            result['etag'] = etag
+            result['not_modified'] = True
+            return result
+
+        arrays = []
+        hashes = []
+        for selection in selections:
+            slices = ch.findHashSlices(
+                "name", selection['name'], "feature",
+                start=selection['start'],
+                stop=selection['stop'],
+                step=selection['step'],
+                samples=selection['downsample'])
+
+            for name, found in zip(selection['name'], slices):
+                if found is None:
+                    raise ValueError('failed to find {} feature.'.format(name))
+                hashes.append(found['hash'])
+
+            arrays.append(
+                selection_array([found['data'] for found in slices],
+                                selection, sentinels))
+
+        if msg.get('batch'):
+            body = pack_batch(arrays, selections)
+        else:
+            body = arrays[0].tobytes()
+            result['dtype'] = arrays[0].dtype.name
+            result['columns'], result['rows'] = arrays[0].shape
+
+        result['status'] = 'success'
+        result['etag'] = make_etag(hashes, selections, sentinels, encoding)
+        result['data'] = compress(body, encoding)
+
+    except Exception as e:
+        logging.warning(traceback.format_exc())
+        result['status'] = 'failure'
+        result['reason'] = str(e)
+
+    return result
+
+
 def delete_data(msg, result):
     '''
     Inputs:
@@ -271,3 +424,78 @@ def update_data(msg, result):
         logging.warning(traceback.format_exc())
 
     return result
+
+
+def import_data(msg, result):
+    '''
+    Inputs:
+        msg (dict)     - request to import an uploaded file:
+                            filename, path of the file on the server, and
+                            for a CSV parsed during the upload, its columns
+                            in data (see StreamingCSV), and for HDF5
+                            whether to register the datasets lazily
+                            (lazy, defaults to CODEX_HD5_LAZY), and for
+                            Parquet and Arrow files the columns to read
+                            (columns, defaults to all)
+    Outputs:
+        generator of responses, one per feature imported:
+            {status: "importing", imported, total, feature}
+        and a final one with status "complete" or "failure"
+
+    Notes:
+        Features are stored one by one as they are read, so the cache is
+        never held by a single call for the whole import.
+    '''
+    ch = get_cache(msg['sessionkey'], timeout=None)
+    path = msg['path']
+    extension = path.split(".")[-1]
+
+    featureList = []
+    try:
+        if (msg.get('data') is not None):
+            imported = iter_csv_columns(msg['data'], None, "feature", ch)
+        elif (extension == "csv"):
+            imported = iter_csv_columns(
+                read_csv_columns(path), None, "feature", ch)
+        elif (extension == "h5"):
+            imported = iter_hd5(path, None, "feature", ch,
+                                lazy=msg.get('lazy', CODEX_HD5_LAZY))
+        elif (extension == "npy"):
+            imported = iter_npy(path, "feature", ch)
+        elif (extension == "parquet"):
+            imported = iter_parquet(path, msg.get('columns'), "feature", ch)
+        elif (extension in ["arrow", "feather"]):
+            imported = iter_arrow(path, msg.get('columns'), "feature", ch)
+        else:
+            raise ValueError("Currently unsupported filetype")
+
+        for done, total, feature_name, _ in imported:
+            featureList.append(feature_name)
+            yield {
+                'routine': msg['routine'],
+                'filename': msg.get('filename'),
+                'status': 'importing',
+                'imported': done,
+                'total': total,
+                'feature': feature_name
+            }
+
+        sentinel_values = ch.getSentinelValues(featureList)
+
+    except Exception as e:
+        logging.info('Unable to save file: ' + repr(e))
+        result['status'] = 'failure'
+        result['WARNING'] = repr(e)
+
+    else:
+        result['status'] = 'complete'
+        result['feature_names'] = featureList
+        result["nan"] = sentinel_values["nan"]
+        result["inf"] = sentinel_values["inf"]
+        result["ninf"] = sentinel_values["ninf"]
+        logging.info('Finished file save.')
+
+    # the parsed columns are not part of the response
+    result.pop('data', None)
+    result.pop('path', None)
+    yield result
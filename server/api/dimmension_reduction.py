@@ -56,7 +56,7 @@ class dimension_reduction(algorithm):
         X_transformed = self.algorithm.fit_transform(self.X)
         exp_var_ratio = explained_variance_ratio(X_transformed, self.parms['n_components'])
 
-        self.result['data'] = X_transformed.tolist()
+        self.result['data'] = X_transformed
         self.result['explained_variance_ratio'] = exp_var_ratio.tolist()
         self.result['n_components'] = self.parms['n_components']
 
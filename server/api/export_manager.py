@@ -50,6 +50,9 @@ def export_contents(msg, result, savePath):
             names = []
             features = []
             for item in data['features']:
+                # merged views have no data of their own
+                if item['data'] is None:
+                    continue
                 names.append(item['name'])
                 features.append(item['data'])
             if features:
@@ -40,7 +40,7 @@ class normalize(algorithm):
 
     def fit_algorithm(self):
 
-        self.result['scaled'] = self.algorithm.fit_transform(self.X).tolist()
+        self.result['scaled'] = self.algorithm.fit_transform(self.X)
 
     def check_valid(self):
         return 1
@@ -82,6 +82,8 @@ from api.sub.time_log          import getComputeTimeEstimate
 from api.sub.time_log          import logTime
 from api.sub.hash              import get_cache
 from api.sub.downsample        import downsample
+from api.sub.frames            import RowBlock
+from api.sub.frames            import row_blocks
 from api.algorithm             import algorithm
 
 class regression(algorithm):
@@ -147,6 +149,16 @@ class regression(algorithm):
 
     def fit_algorithm(self):
 
+        for block in self.fit_blocks(0):
+            pass
+
+    def fit_blocks(self, rows):
+        '''
+        The input rows are sent before the fit, the predictions in blocks as
+        they are made
+        '''
+        yield from row_blocks("data", self.X, rows)
+
         accepted_scoring_metrics = ["explained_variance", "max_error", "neg_mean_absolute_error", "neg_mean_squared_error", "neg_mean_squared_log_error", "neg_median_absolute_error", "r2"]
         if self.scoring not in accepted_scoring_metrics:
             self.result["WARNING"] = "{scoring} not a valid scoring metric for regression.".format(scoring=self.scoring)
@@ -160,9 +172,21 @@ class regression(algorithm):
             self.algorithm = self.algorithm
 
         self.algorithm.fit(self.X, self.y)
-        y_pred = self.algorithm.predict(self.X)
+        if 0 < rows < len(self.X):
+            parts = []
+            for start in range(0, len(self.X), rows):
+                parts.append(self.algorithm.predict(self.X[start:start + rows]))
+                yield RowBlock({
+                    "field": "y_pred",
+                    "offset": start,
+                    "rows": len(self.X),
+                    "y_pred": parts[-1]
+                })
+            y_pred = np.concatenate(parts)
+        else:
+            y_pred = self.algorithm.predict(self.X)
 
-        self.result["y_pred"] = y_pred.tolist()
+        self.result["y_pred"] = y_pred
         self.result["score"] = self.algorithm.score(self.X, self.y) * 100
         self.result["explained_variance"] = explained_variance_score(self.y, y_pred) * 100
 
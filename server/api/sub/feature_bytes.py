@@ -0,0 +1,260 @@
+'''
+Brief : Raw feature data served over HTTP, see /api/feature and /api/features
+
+Notes :
+    A selection names one or more features of a session and the rows to
+    send, data[start:stop:step], optionally downsampled, as one dtype. Its
+    payload holds each column after the other (column major), in native
+    byte order. The first column has the session sentinel values in place
+    of nan, inf and -inf, as get_data returns them over /codex.
+
+    /api/feature sends the payload of a single selection as is. A batch,
+    from /api/features, is sent as:
+
+        length   uint32 little-endian, length of the JSON index
+        index    JSON list, per selection: names, dtype, rows, columns,
+                 and offset and length of its payload in bytes, counted
+                 from the end of the index padding
+        padding  to a multiple of 8 bytes
+        payloads each padded to a multiple of 8 bytes, so every payload
+                 can be viewed directly as a typed array
+
+    The body may be compressed with gzip, or zstd if zstandard is
+    installed. The ETag of a response is derived from the content hashes
+    of its features and everything else that shapes the bytes, so a
+    repeat fetch of unchanged data can be answered with 304 Not Modified.
+'''
+import os
+import gzip
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# dtypes a selection may be sent as
+DTYPES = ("float32", "float64", "int32")
+
+# compression levels, favouring speed: numeric data compresses little more
+# at higher levels
+CODEX_GZIP_LEVEL = int(os.getenv('CODEX_GZIP_LEVEL', 1))
+CODEX_ZSTD_LEVEL = int(os.getenv('CODEX_ZSTD_LEVEL', 3))
+
+
+def encodings():
+    '''
+    Outputs:
+        content encodings supported here, most preferred first
+    '''
+    if zstandard is not None:
+        return ("zstd", "gzip")
+    return ("gzip", )
+
+
+def accepted_encoding(accept):
+    '''
+    Inputs:
+        accept (string)  - Accept-Encoding header of the request
+
+    Outputs:
+        encoding to compress the response with, None to send it as is
+    '''
+    offered = {}
+    for part in accept.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        offered[name.strip().lower()] = quality
+
+    for encoding in encodings():
+        if offered.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=CODEX_GZIP_LEVEL)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=CODEX_ZSTD_LEVEL).compress(body)
+    return body
+
+
+def parse_selection(selection):
+    '''
+    Inputs:
+        selection (dict)  - name (list), and optionally start, stop, step,
+                            downsample and dtype, as strings or numbers
+
+    Outputs:
+        the selection with every field validated and converted
+
+    Notes:
+        Raises ValueError for a selection that cannot be served
+    '''
+    names = selection.get('name')
+    if isinstance(names, str):
+        names = [names]
+    if not names or not all(isinstance(name, str) for name in names):
+        raise ValueError("A selection needs the name of at least one feature")
+
+    def optional_int(key):
+        value = selection.get(key)
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError("{} must be an integer".format(key))
+
+    parsed = {
+        'name': list(names),
+        'start': optional_int('start'),
+        'stop': optional_int('stop'),
+        'step': optional_int('step'),
+        'downsample': optional_int('downsample'),
+        'dtype': selection.get('dtype') or "float32"
+    }
+
+    if parsed['step'] is not None and parsed['step'] <= 0:
+        raise ValueError("step must be positive")
+    if parsed['downsample'] is not None and parsed['downsample'] <= 0:
+        raise ValueError("downsample must be positive")
+    if parsed['dtype'] not in DTYPES:
+        raise ValueError("dtype must be one of {}".format(", ".join(DTYPES)))
+
+    return parsed
+
+
+def make_etag(hashes, selections, sentinels, encoding):
+    '''
+    Inputs:
+        hashes (list)       - content hashes of the features, in order
+        selections (list)   - parsed selections of the response
+        sentinels (tuple)   - (nan, inf, ninf) of the session
+        encoding (string)   - content encoding of the response
+
+    Outputs:
+        quoted ETag of the response
+    '''
+    tag = hashlib.sha1()
+    tag.update(json.dumps([hashes, selections, sentinels, encoding]).encode())
+    return '"{}"'.format(tag.hexdigest())
+
+
+def etag_matches(etag, header):
+    '''
+    Inputs:
+        etag (string)    - ETag of the current response
+        header (string)  - If-None-Match header of the request, or None
+    '''
+    if not header:
+        return False
+
+    tags = [tag.strip() for tag in header.split(',')]
+    return "*" in tags or any(
+        (tag[2:] if tag.startswith('W/') else tag) == etag for tag in tags)
+
+
+def selection_array(columns, selection, sentinels):
+    '''
+    Inputs:
+        columns (list)      - selected, downsampled rows of each feature
+                              (1D arrays), see CodexHash.findHashSlices
+        selection (dict)    - parsed selection
+        sentinels (tuple)   - (nan, inf, ninf) of the session
+
+    Outputs:
+        (columns, rows) array of the selection's dtype
+
+    Notes:
+        Each column is cast straight into the output, the only copy made
+        unless it holds non finite values. As in get_data, only the first
+        column has them swapped for the sentinels, a sentinel of None
+        being nan. Raises ValueError if non finite values are left for an
+        integer dtype.
+    '''
+    rows = len(columns[0]) if columns else 0
+    if any(len(column) != rows for column in columns):
+        raise ValueError("Features of a selection must have the same length")
+
+    out = np.empty((len(columns), rows), dtype=selection['dtype'])
+    for i, column in enumerate(columns):
+        if column.dtype.kind == 'f' and not np.isfinite(column).all():
+            if i == 0:
+                column = column.copy()
+                for mask, value in zip(
+                        (np.isnan, np.isposinf, np.isneginf), sentinels):
+                    column[mask(column)] = np.nan if value is None else value
+
+            if out.dtype.kind != 'f' and not np.isfinite(column).all():
+                raise ValueError(
+                    "{} holds nan or inf values, which {} cannot hold".format(
+                        selection['name'][i], out.dtype.name))
+
+        out[i] = column
+
+    return out
+
+
+def pack_batch(arrays, selections):
+    '''
+    Inputs:
+        arrays (list)      - (columns, rows) array of each selection
+        selections (list)  - parsed selections
+
+    Outputs:
+        body of a batch response, see the notes of this module
+    '''
+    index = []
+    offset = 0
+    for array, selection in zip(arrays, selections):
+        index.append({
+            'names': selection['name'],
+            'dtype': array.dtype.name,
+            'rows': array.shape[1],
+            'columns': array.shape[0],
+            'offset': offset,
+            'length': array.nbytes
+        })
+        offset += array.nbytes + (-array.nbytes % 8)
+
+    header = json.dumps(index).encode()
+    parts = [struct.pack('<I', len(header)), header]
+    parts.append(b'\0' * (-(4 + len(header)) % 8))
+    for array in arrays:
+        parts.append(array.tobytes())
+        parts.append(b'\0' * (-array.nbytes % 8))
+
+    return b''.join(parts)
+
+
+def unpack_batch(body):
+    '''
+    Inputs:
+        body (bytes)  - uncompressed body of a batch response
+
+    Outputs:
+        list of (index entry, (columns, rows) array) per selection
+    '''
+    length, = struct.unpack_from('<I', body)
+    index = json.loads(bytes(body[4:4 + length]).decode())
+    start = 4 + length
+    start += -start % 8
+
+    return [(entry,
+             np.frombuffer(body,
+                           dtype=entry['dtype'],
+                           count=entry['rows'] * entry['columns'],
+                           offset=start + entry['offset']).reshape(
+                               entry['columns'], entry['rows']))
+            for entry in index]
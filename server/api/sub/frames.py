@@ -0,0 +1,290 @@
+'''
+Brief : Encoding of responses sent to the front end over /codex
+
+Notes :
+    Responses are JSON. A client can negotiate binary mode, either by
+    offering the "codex-binary" websocket subprotocol or by setting
+    "binary": true in a request. In binary mode the large array fields of a
+    response (see BINARY_FIELDS) are sent as binary frames that follow the
+    JSON message, and the JSON carries a reference in place of each array
+    (integer arrays outside the int32 range stay in the JSON):
+
+        {"$frame": index, "dtype": "float32", "shape": [rows, cols]}
+
+    The JSON message also gets "frames": count. Each binary frame is a
+    little-endian header followed by the raw array:
+
+        magic   4 bytes   b'CDXF'
+        version uint8     FRAME_VERSION
+        dtype   uint8     1 = float32, 2 = int32
+        ndim    uint16
+        index   uint32    matches "$frame" in the JSON message
+        shape   uint32 x ndim
+        padding to a multiple of 8 bytes, so the payload can be viewed
+                directly as a typed array
+        payload
+
+    Large responses can also be sent in row blocks, as they are computed,
+    see RowStream.
+'''
+import os
+import json
+import struct
+
+import numpy as np
+
+# binary mode websocket subprotocol
+BINARY_SUBPROTOCOL = "codex-binary"
+
+# response fields sent as binary frames
+BINARY_FIELDS = ("data", "clusters", "y_pred", "scaled", "downsample")
+
+# rows per block when a request asks for "stream": true without "chunk_rows"
+CODEX_STREAM_ROWS = int(os.getenv('CODEX_STREAM_ROWS', 100000))
+
+# request fields copied into every streamed block
+STREAM_KEYS = ("routine", "activity", "identification", "message")
+
+FRAME_MAGIC = b'CDXF'
+FRAME_VERSION = 1
+FRAME_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<i4')}
+
+
+def to_json(obj):
+    '''
+    json.dumps default, converting numpy values to their python equivalent
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("{} is not JSON serializable".format(type(obj).__name__))
+
+
+def encode_json(result):
+    '''
+    Inputs:
+        result (dict)  - response, possibly holding numpy arrays
+
+    Outputs:
+        JSON string of the response
+    '''
+    return json.dumps(result, default=to_json)
+
+
+def frame_array(value):
+    '''
+    Inputs:
+        value  - array field of a response
+
+    Outputs:
+        (dtype code, array) to send, or None if the value is not a numeric array
+        or holds integers outside the int32 range, which are left as JSON
+    '''
+    if isinstance(value, (list, tuple)):
+        try:
+            value = np.asarray(value)
+        except ValueError:
+            return None
+
+    if not isinstance(value, np.ndarray) or value.dtype.kind not in 'biuf':
+        return None
+
+    if value.dtype.kind in 'iu' and value.size:
+        limits = np.iinfo(FRAME_DTYPES[2])
+        if value.min() < limits.min or value.max() > limits.max:
+            return None
+
+    code = 2 if value.dtype.kind in 'biu' else 1
+    return code, np.ascontiguousarray(value, dtype=FRAME_DTYPES[code])
+
+
+def pack_frame(index, code, array):
+    header = struct.pack('<4sBBHI', FRAME_MAGIC, FRAME_VERSION, code,
+                         array.ndim, index)
+    header += struct.pack('<{}I'.format(array.ndim), *array.shape)
+    header += b'\0' * (-len(header) % 8)
+
+    return header + array.tobytes()
+
+
+def unpack_frame(frame):
+    '''
+    Inputs:
+        frame (bytes)  - binary frame
+
+    Outputs:
+        (index, array) held by the frame
+    '''
+    magic, version, code, ndim, index = struct.unpack_from('<4sBBHI', frame)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError("Not a CODEX binary frame")
+
+    shape = struct.unpack_from('<{}I'.format(ndim), frame, 12)
+    offset = 12 + 4 * ndim
+    offset += -offset % 8
+
+    array = np.frombuffer(frame, dtype=FRAME_DTYPES[code], offset=offset)
+    return index, array.reshape(shape)
+
+
+def encode_binary(result):
+    '''
+    Inputs:
+        result (dict)  - response, possibly holding numpy arrays
+
+    Outputs:
+        (JSON string, list of binary frames) for the response
+    '''
+    message = dict(result)
+    frames = []
+
+    for field in BINARY_FIELDS:
+        framed = frame_array(message.get(field))
+        if framed is None:
+            continue
+
+        code, array = framed
+        message[field] = {
+            "$frame": len(frames),
+            "dtype": FRAME_DTYPES[code].name,
+            "shape": list(array.shape)
+        }
+        frames.append(pack_frame(len(frames), code, array))
+
+    message["frames"] = len(frames)
+    return encode_json(message), frames
+
+
+def stream_rows(msg):
+    '''
+    Inputs:
+        msg (dict)  - request from the front end
+
+    Outputs:
+        rows per streamed block the request asked for, 0 to not stream
+    '''
+    rows = msg.get("chunk_rows")
+    if rows is None and msg.get("stream"):
+        rows = CODEX_STREAM_ROWS
+
+    return max(int(rows or 0), 0)
+
+
+class RowBlock(dict):
+    '''
+    Block of rows of an array field, yielded by a handler while it computes
+    the field, see row_blocks and RowStream
+    '''
+
+
+def row_blocks(field, values, rows):
+    '''
+    Inputs:
+        field (str)  - array field of the response, see BINARY_FIELDS
+        values       - array, or list, of the field
+        rows (int)   - rows per block
+
+    Outputs:
+        generator of the RowBlocks of the field, none if it fits in one block
+    '''
+    if values is None or rows <= 0 or len(values) <= rows:
+        return
+
+    for start in range(0, len(values), rows):
+        yield RowBlock({
+            "field": field,
+            "offset": start,
+            "rows": len(values),
+            field: values[start:start + rows]
+        })
+
+
+class RowStream:
+    '''
+    Inputs:
+        rows (int)      - rows per block, 0 to send responses whole
+        request (dict)  - request the responses answer, its STREAM_KEYS are
+                          copied into every block
+
+    Notes:
+        messages turns each chunk a handler yields into the messages to
+        send. A handler of a streaming request (see stream_rows) may yield
+        RowBlocks as it computes them, and each is sent right away as:
+
+            {"seq": n, "field": name, "offset": first row, "rows": total rows,
+             name: block, ...STREAM_KEYS}
+
+        Array fields (see BINARY_FIELDS) of a response that are longer than
+        rows are split into such blocks once the response is complete. The
+        response then follows as a summary of the blocks before it: without
+        the streamed fields, with "seq", "chunks" (number of blocks),
+        "streamed" (field names) and "final": true. The next blocks are
+        numbered from 0 again.
+    '''
+
+    def __init__(self, rows, request=None):
+        self.rows = rows
+        self.header = {
+            key: request[key] for key in STREAM_KEYS if key in (request or {})
+        }
+        self.__seq = 0
+        self.__streamed = []
+
+    def messages(self, chunk):
+        '''
+        Inputs:
+            chunk (dict)  - RowBlock or response yielded by a handler
+
+        Outputs:
+            generator of the messages to send
+        '''
+        header = dict(self.header)
+        header.update(
+            (key, chunk[key]) for key in STREAM_KEYS if key in chunk)
+
+        if isinstance(chunk, RowBlock):
+            yield self.__block(header, chunk)
+            return
+
+        for field in BINARY_FIELDS:
+            if field not in self.__streamed and \
+                    isinstance(chunk.get(field), (np.ndarray, list)):
+                for block in row_blocks(field, chunk[field], self.rows):
+                    yield self.__block(header, block)
+
+        if not self.__streamed:
+            yield chunk
+            return
+
+        summary = {k: v for k, v in chunk.items() if k not in self.__streamed}
+        summary.update({
+            "seq": self.__seq,
+            "chunks": self.__seq,
+            "streamed": self.__streamed,
+            "final": True
+        })
+        self.__seq = 0
+        self.__streamed = []
+        yield summary
+
+    def __block(self, header, block):
+        message = dict(header)
+        message.update(block)
+        message["seq"] = self.__seq
+        self.__seq += 1
+        if block["field"] not in self.__streamed:
+            self.__streamed.append(block["field"])
+        return message
+
+
+def stream_result(result, rows):
+    '''
+    Inputs:
+        result (dict)  - complete response, possibly holding numpy arrays
+        rows (int)     - rows per block, 0 to send the response whole
+
+    Outputs:
+        generator of the messages to send, see RowStream
+    '''
+    return RowStream(rows).messages(result)
@@ -13,11 +13,14 @@ Notes :
 The components of a hash object are as follows:
     name    :  String name of the hash for easy lookup
     data    :  Data array to be hashed for quick storage
-    hash    :  sha1 hash of the data array
+    hash    :  hash of the data array and name (see CODEX_HASH_ALGORITHM)
     samples :  Number of data points in the hash array
-    memory  :  Not currently used.  Eventually used for
-                    tracking RAM/memory usage.  Might be algorithm
-                    specific
+    source  :  Where the data of a lazy entry is read from, see registerHD5
+    categories : Strings of a tokenized feature, indexed by token, or None
+    memory  :  Size, in bytes, of the cached data (or pickled model)
+    time    :  Creation time
+    access  :  Time of the most recent lookup
+    hits    :  Number of lookups
     z-order :
     color   :
 
@@ -35,37 +38,519 @@ import functools
 import logging
 import inspect
 import json
+import mmap
 import os.path
+import shutil
+import tempfile
+import threading
 
 import numpy as np
 
+from collections import OrderedDict
+
 from types import ModuleType
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 sys.path.insert(1, os.getenv('CODEX_ROOT'))
 
 logger = logging.getLogger(__name__)
 
 # IPC support
+from api.sub.ntangle.client import Batch
 from api.sub.ntangle.client import Client
+from api.sub.ntangle.client import ClientPool
 from api.sub.ntangle.server import Server
 from api.sub.ntangle.server import expose
 
 # CODEX Support
 from api.sub.system import string2token
+from api.sub.hd5 import dataset_source
+from api.sub.hd5 import keep_file
+from api.sub.hd5 import read_rows
+from api.sub.hd5 import remove_kept
 
 DEFAULT_CODEX_HASH_BIND = 'tcp://127.0.0.1:42354'
 DEFAULT_CODEX_HASH_CONNECT = 'tcp://127.0.0.1:42354'
+DEFAULT_CODEX_HASH_WORKERS = int(os.getenv('CODEX_CACHE_WORKERS', 4))
 DOCTEST_SESSION = '__doctest__'
 
+# Memory budgets for cached data, in MB. The global budget covers every
+# session on the cache server; a per-session budget of 0 means no limit.
+CODEX_CACHE_MEMORY_MB = float(os.getenv('CODEX_CACHE_MEMORY_MB', 4096))
+CODEX_SESSION_MEMORY_MB = float(os.getenv('CODEX_SESSION_MEMORY_MB', 0))
+
+# Order derived entries are evicted in when over budget: lru or lfu
+CODEX_CACHE_EVICTION = os.getenv('CODEX_CACHE_EVICTION', 'lru')
+
+# Session keys of every cache category
+CACHE_CATEGORIES = [
+    "featureList", "subsetList", "downsampleList", "labelList",
+    "classifierList", "regressorList"
+]
+
+# Session key of the cache category for each hash type
+HASH_TYPE_CATEGORIES = {
+    "feature": "featureList",
+    "subset": "subsetList",
+    "downsample": "downsampleList",
+    "label": "labelList",
+    "classifier": "classifierList",
+    "regressor": "regressorList"
+}
+
+# Categories whose arrays can be spilled to disk instead of evicted
+SPILL_CATEGORIES = ["featureList", "subsetList", "labelList"]
+
+# Directory cold arrays are spilled to when over budget. Set CODEX_SPILL_DIR
+# to an empty string to disable spilling.
+CODEX_SPILL_DIR = os.getenv('CODEX_SPILL_DIR',
+                            os.path.join(tempfile.gettempdir(), 'codex_spill'))
+
+# Directory, next to a registered HDF5 file, its hard links are kept in
+HD5_KEEP_DIR = '.codex_registered'
+
+# Digest used for array hashes {sha1, blake2b, xxhash}. Changing it changes
+# every hash, so sessions saved under another algorithm will not match.
+CODEX_HASH_ALGORITHM = os.getenv('CODEX_HASH_ALGORITHM', 'sha1')
+
+# Arrays are fed to the digest in chunks of this many bytes
+HASH_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Names of features that are derived from others and can be recomputed
+DERIVED_FEATURE_NAMES = ["Merged", "temporary"]
+
+# Directory (ideally a tmpfs) used to hand large arrays between the cache
+# server and its clients without pickling them. Set CODEX_SHM_DIR to an
+# empty string to always send arrays over the socket.
+CODEX_SHM_DIR = os.getenv('CODEX_SHM_DIR', '/dev/shm')
+
+# Bytes of a memory mapped .npy file transposed at once, see column_major
+CODEX_NPY_BLOCK_BYTES = int(os.getenv('CODEX_NPY_BLOCK_BYTES', 64 << 20))
+
 
 class NoSessionSpecifiedError(Exception):
     pass
 
 
+def session_locked(func):
+    '''
+    Serialize calls that touch the same session, while calls for other
+    sessions run in parallel on the cache server's handler threads.
+    '''
+
+    @functools.wraps(func)
+    def locked_func(self, *args, **kwargs):
+        with self._session_lock(kwargs.get('session')):
+            return func(self, *args, **kwargs)
+
+    return locked_func
+
+
+def record_memory(record):
+    '''
+    Inputs:
+        record (dict)  - hash record
+
+    Outputs:
+        size, in bytes, of the data or model held by the record
+    '''
+    data = record.get('data')
+    if isinstance(data, np.ndarray):
+        return int(data.nbytes)
+
+    model = record.get('model')
+    if isinstance(model, bytes):
+        return len(model)
+
+    return 0
+
+
+class HashIndex:
+    '''
+    Ordered collection of hash records for a single cache category.
+
+    Records are kept in insertion order, so iteration matches the old
+    list-based storage, and are also indexed on their "hash" and "name"
+    fields so lookups, inserts and deletes do not scan the category.
+    Records must not have an indexed field changed while they are stored;
+    remove, modify and re-append them instead (see CodexHash.hashUpdate).
+
+    The bytes held by the stored records are tracked in nbytes, and the
+    part of those held in the shared BlobStore in shared_nbytes.
+    '''
+    INDEXED_FIELDS = ('hash', 'name')
+
+    def __init__(self, records=None):
+        self.__records = OrderedDict()
+        self.__index = {field: {} for field in self.INDEXED_FIELDS}
+        self.nbytes = 0
+        self.shared_nbytes = 0
+
+        if records is not None:
+            for record in records:
+                self.append(record)
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __iter__(self):
+        return iter(self.__records.values())
+
+    def __repr__(self):
+        return '<HashIndex of {} records>'.format(len(self))
+
+    def __account(self, record, sign):
+        self.nbytes += sign * record['memory']
+        if record.get('blob') is not None:
+            self.shared_nbytes += sign * record['memory']
+
+    def append(self, record):
+        key = id(record)
+        record['memory'] = record_memory(record)
+        self.__account(record, 1)
+        self.__records[key] = record
+        for field in self.INDEXED_FIELDS:
+            bucket = self.__index[field].setdefault(record.get(field),
+                                                    OrderedDict())
+            bucket[key] = record
+
+    def remove(self, record):
+        key = id(record)
+        if key not in self.__records:
+            return False
+
+        del self.__records[key]
+        self.__account(record, -1)
+        for field in self.INDEXED_FIELDS:
+            value = record.get(field)
+            bucket = self.__index[field][value]
+            del bucket[key]
+            if not bucket:
+                del self.__index[field][value]
+
+        return True
+
+    def update(self, record, **fields):
+        '''
+        Change the non-indexed fields of a stored record, such as its data,
+        keeping the byte counts right
+        '''
+        self.__account(record, -1)
+        record.update(fields)
+        record['memory'] = record_memory(record)
+        self.__account(record, 1)
+
+    def find_all(self, field, value):
+        '''
+        Inputs:
+            field (string)  - indexed record field to match on
+            value           - value the field must equal
+
+        Outputs:
+            list of matching records, oldest first
+        '''
+        bucket = self.__index[field].get(value)
+        return list(bucket.values()) if bucket else []
+
+    def contains(self, field, value):
+        return self.find(field, value) is not None
+
+    def find(self, field, value, last=False):
+        '''
+        Inputs:
+            field (string)  - record field to match on
+            value           - value the field must equal
+            last (bool)     - return the most recently added match instead of the first
+
+        Outputs:
+            matching record, or None
+        '''
+        if field not in self.__index:
+            matches = [r for r in self if r.get(field) == value]
+            if not matches:
+                return None
+            return matches[-1] if last else matches[0]
+
+        try:
+            bucket = self.__index[field].get(value)
+        except TypeError:
+            # unhashable lookup values can never match a stored key
+            return None
+
+        if not bucket:
+            return None
+
+        if last:
+            return next(reversed(bucket.values()))
+        return next(iter(bucket.values()))
+
+    def to_list(self):
+        return list(self.__records.values())
+
+
+class BlobStore:
+    '''
+    Content addressed, reference counted store of cached arrays.
+
+    Identical arrays cached under different names or by different sessions
+    are held once; hash records keep a reference to the shared array and
+    its key in their "blob" field. Shared arrays must not be modified.
+    '''
+
+    def __init__(self):
+        self.__blobs = {}
+        self.__lock = threading.Lock()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.__blobs)
+
+    def acquire(self, key, array):
+        '''
+        Inputs:
+            key (string)      - content key of the array
+            array (np array)  - array to store if the key is new
+
+        Outputs:
+            the stored array for the key
+        '''
+        with self.__lock:
+            blob = self.__blobs.get(key)
+            if blob is None:
+                blob = self.__blobs[key] = {'data': array, 'refs': 0}
+                self.nbytes += int(array.nbytes)
+            blob['refs'] += 1
+            return blob['data']
+
+    def release(self, key):
+        with self.__lock:
+            blob = self.__blobs.get(key)
+            if blob is None:
+                return
+
+            blob['refs'] -= 1
+            if (blob['refs'] <= 0):
+                del self.__blobs[key]
+                self.nbytes -= int(blob['data'].nbytes)
+
+    def refs(self, key):
+        blob = self.__blobs.get(key)
+        return blob['refs'] if blob else 0
+
+
+def new_hasher(algorithm=None):
+    '''
+    Inputs:
+        algorithm (string)  - {sha1, blake2b, xxhash}, defaults to CODEX_HASH_ALGORITHM
+
+    Outputs:
+        empty hash object with update, copy and hexdigest
+    '''
+    if algorithm is None:
+        algorithm = CODEX_HASH_ALGORITHM
+
+    if (algorithm == "xxhash"):
+        if xxhash is not None:
+            return xxhash.xxh3_128() if hasattr(xxhash, "xxh3_128") else xxhash.xxh64()
+        logging.warning("xxhash is not installed, hashing with sha1")
+    elif (algorithm == "blake2b"):
+        return hashlib.blake2b(digest_size=20)
+    elif (algorithm != "sha1"):
+        logging.warning(
+            "Unknown hash algorithm {}, hashing with sha1".format(algorithm))
+
+    return hashlib.sha1()
+
+
+def hash_array(array, hasher=None):
+    '''
+    Inputs:
+        array (np array)           - C contiguous array to hash
+        hasher (hashlib object)    - hash to update, a new one by default
+
+    Outputs:
+        the hash object, updated with the raw bytes of the array
+
+    Notes:
+        The array buffer is read through a memoryview in HASH_CHUNK_BYTES
+        pieces, so no bytes copy of the array is made.
+    '''
+    if hasher is None:
+        hasher = new_hasher()
+
+    buffer = memoryview(array.reshape(-1)).cast('B')
+    for start in range(0, len(buffer), HASH_CHUNK_BYTES):
+        hasher.update(buffer[start:start + HASH_CHUNK_BYTES])
+
+    return hasher
+
+
+def content_key(hasher, array):
+    '''
+    Inputs:
+        hasher (hashlib object)  - hash already updated with the array bytes
+        array (np array)         - the hashed array
+
+    Outputs:
+        key identifying the array contents, independent of its name
+    '''
+    content = hasher.copy()
+    content.update("{}{}".format(array.dtype.str, array.shape).encode('utf-8'))
+    return content.hexdigest()
+
+
+def merge_columns(arrays):
+    '''
+    Inputs:
+        arrays (list)  - 1-D or 2-D arrays with the same number of samples
+
+    Outputs:
+        2-D array with the columns of every input, in order
+
+    Notes:
+        The output is allocated once and filled in a single pass
+    '''
+    columns = [array.reshape(len(array), -1) for array in arrays]
+    merged = np.empty((len(columns[0]), sum(c.shape[1] for c in columns)),
+                      dtype=np.result_type(*columns))
+
+    start = 0
+    for column in columns:
+        merged[:, start:start + column.shape[1]] = column
+        start += column.shape[1]
+
+    return merged
+
+
+def column_major(matrix, start, stop, block_bytes=None):
+    '''
+    Inputs:
+        matrix (np array)  - 2-D numeric array, samples by features, usually
+                             memory mapped from a file
+        start, stop (int)  - range of the features wanted
+
+    Outputs:
+        (features, samples) float64 array, each row a C contiguous column
+
+    Notes:
+        Float64 columns that are already contiguous, as in a Fortran ordered
+        file, are returned as views of matrix. Otherwise the output is
+        allocated once and filled from about block_bytes of rows at a time,
+        so a memory mapped matrix is read sequentially, once, and the pages
+        of the file already read are dropped as it goes.
+    '''
+    columns = matrix.T[start:stop]
+    if columns.dtype == np.float64 and columns.flags.c_contiguous:
+        return columns
+
+    if block_bytes is None:
+        block_bytes = CODEX_NPY_BLOCK_BYTES
+
+    samples = len(matrix)
+    out = np.empty(columns.shape, dtype=np.float64)
+    rows = max(1, block_bytes // max(1, matrix.strides[0]))
+    for first in range(0, samples, rows):
+        out[:, first:first + rows] = matrix[first:first + rows, start:stop].T
+        release_rows(matrix, first, first + rows)
+
+    return out
+
+
+def release_rows(matrix, start, stop):
+    '''
+    Inputs:
+        matrix (np array)  - array returned by np.load(..., mmap_mode='r')
+        start, stop (int)  - rows that will not be read again
+
+    Notes:
+        Lets the kernel drop the resident pages of those rows now, rather
+        than when memory runs short. The data is read from the file again
+        if it is accessed after all.
+    '''
+    if not isinstance(matrix, np.memmap) or not hasattr(mmap, 'MADV_DONTNEED'):
+        return
+
+    # the mapping starts at the allocation boundary before the data
+    data = matrix.offset % mmap.ALLOCATIONGRANULARITY
+    first = data + start * matrix.strides[0]
+    first -= first % mmap.PAGESIZE
+    end = data + min(stop, len(matrix)) * matrix.strides[0]
+    end -= end % mmap.PAGESIZE
+    if end > first:
+        matrix._mmap.madvise(mmap.MADV_DONTNEED, first, end - first)
+
+
+def downsample_rows(rows, length, samples):
+    '''
+    Inputs:
+        rows (slice)    - rows of an array
+        length (int)    - length of the array
+        samples (int)   - rows wanted, None for all of them
+
+    Outputs:
+        slice of at most samples of the rows, picked as simple_downsample
+        picks them
+    '''
+    start, stop, step = rows.indices(length)
+    count = len(range(start, stop, step))
+    if not samples or count < samples:
+        return slice(start, stop, step)
+
+    step *= count // samples
+    return slice(start, min(stop, start + step * samples), step)
+
+
 class CodexHash:
     # current hashes stored here
     sessions = {}
 
+    # array data shared by every session
+    blobs = BlobStore()
+
+    # per-session locks, see session_locked
+    session_locks = {}
+    session_locks_guard = threading.Lock()
+
+    def __init__(self, memory_budget=None, session_budget=None,
+                 eviction=None, spill_dir=None):
+        '''
+        Inputs:
+            memory_budget  (float)   - MB of cached data allowed across all sessions, 0 for no limit
+            session_budget (float)   - MB of cached data allowed per session, 0 for no limit
+            eviction       (string)  - order entries are reclaimed in when over budget {lru, lfu}
+            spill_dir      (string)  - directory cold arrays are spilled to, empty to disable
+
+        Notes:
+            Defaults come from CODEX_CACHE_MEMORY_MB, CODEX_SESSION_MEMORY_MB,
+            CODEX_CACHE_EVICTION and CODEX_SPILL_DIR
+        '''
+        if memory_budget is None:
+            memory_budget = CODEX_CACHE_MEMORY_MB
+        if session_budget is None:
+            session_budget = CODEX_SESSION_MEMORY_MB
+        if eviction is None:
+            eviction = CODEX_CACHE_EVICTION
+        if spill_dir is None:
+            spill_dir = CODEX_SPILL_DIR
+
+        self.memory_budget = int(memory_budget * 1024 * 1024)
+        self.session_budget = int(session_budget * 1024 * 1024)
+        self.eviction = eviction
+        self.spill_dir = spill_dir if spill_dir else None
+
+    def _session_lock(self, sessionKey):
+        with self.session_locks_guard:
+            lock = self.session_locks.get(sessionKey)
+            if lock is None:
+                # re-entrant, as exposed methods call each other
+                lock = threading.RLock()
+                self.session_locks[sessionKey] = lock
+        return lock
+
     def __has_session(self, sessionKey):
         return sessionKey in self.sessions
 
@@ -74,12 +559,12 @@ class CodexHash:
             raise NoSessionSpecifiedError()
         if not self.__has_session(sessionKey):
             self.sessions[sessionKey] = {
-                "featureList": [],
-                "subsetList": [],
-                "downsampleList": [],
-                "labelList": [],
-                "classifierList": [],
-                "regressorList": [],
+                "featureList": HashIndex(),
+                "subsetList": HashIndex(),
+                "downsampleList": HashIndex(),
+                "labelList": HashIndex(),
+                "classifierList": HashIndex(),
+                "regressorList": HashIndex(),
                 "returnCode": [],
                 "nan": None,
                 "inf": None,
@@ -87,7 +572,311 @@ class CodexHash:
             }
         return sessionKey
 
+    def __session_memory(self, session):
+        return sum(self.sessions[session][c].nbytes for c in CACHE_CATEGORIES)
+
+    def __total_memory(self):
+        # shared arrays are only counted once
+        unshared = sum(
+            self.sessions[s][c].nbytes - self.sessions[s][c].shared_nbytes
+            for s in list(self.sessions) for c in CACHE_CATEGORIES)
+        return unshared + self.blobs.nbytes
+
+    def __eviction_key(self, point):
+        if (self.eviction == "lfu"):
+            return (point.get("hits", 0), point.get("access", point["time"]))
+        return point.get("access", point["time"])
+
+    def __eviction_candidates(self, session, keep=None):
+        '''
+        Outputs:
+            list of (key, category, point) for the entries that can be reclaimed, coldest has the lowest key
+
+        Notes:
+            Derived entries, which can be recomputed, are evicted first.
+            Only once there are none left are source arrays spilled to disk.
+            Arrays another record still shares are not spilled, as that frees
+            no memory. Models are never reclaimed.
+        '''
+        candidates = [("downsampleList", point)
+                      for point in self.sessions[session]["downsampleList"]]
+        # data read from a registered file can be read again
+        candidates += [("featureList", point)
+                       for point in self.sessions[session]["featureList"]
+                       if point.get("source") and point.get("data") is not None]
+        for name in DERIVED_FEATURE_NAMES:
+            candidates += [("featureList", point)
+                           for point in self.sessions[session]["featureList"]
+                           .find_all("name", name)
+                           if point.get("data") is not None]
+        tier = 0
+
+        if not [c for c in candidates if c[1] is not keep]:
+            if self.spill_dir is None:
+                return []
+
+            candidates = [(category, point)
+                          for category in SPILL_CATEGORIES
+                          for point in self.sessions[session][category]
+                          if isinstance(point.get("data"), np.ndarray)
+                          and not point["data"].dtype.hasobject
+                          and self.__freed_bytes(point)]
+            tier = 1
+
+        return [((tier, self.__eviction_key(point)), category, point)
+                for category, point in candidates if point is not keep]
+
+    def __freed_bytes(self, point):
+        '''
+        Bytes freed by dropping the data of a record, none while another
+        record still holds its shared array
+        '''
+        blob = point.get("blob")
+        if blob is not None and self.blobs.refs(blob) > 1:
+            return 0
+        return point["memory"]
+
+    def __spill_path(self, session, category, point):
+        directory = os.path.join(
+            self.spill_dir,
+            hashlib.sha1(str(session).encode('utf-8')).hexdigest())
+        os.makedirs(directory, exist_ok=True)
+
+        return os.path.join(directory, "{category}-{hash}.npy".format(
+            category=category, hash=point["hash"]))
+
+    def __spill(self, session, category, point):
+        path = self.__spill_path(session, category, point)
+        np.save(path, point["data"], allow_pickle=False)
+
+        blob = point.get("blob")
+        self.sessions[session][category].update(
+            point, data=None, blob=None, spilled=path)
+        if blob is not None:
+            self.blobs.release(blob)
+
+    def __page_in(self, session, category, point):
+        path = point.pop("spilled")
+        data = np.load(path, allow_pickle=False)
+        os.remove(path)
+
+        # rejoins the shared copy if another session still holds one
+        blob = content_key(hash_array(data), data)
+        self.sessions[session][category].update(
+            point, data=self.blobs.acquire(blob, data), blob=blob)
+        logging.info("Paged {name} back in from disk".format(name=point["name"]))
+        self.__enforce_budget(session, keep=point)
+
+    def __materialize(self, session, point):
+        arrays = []
+        for memberHash in point["members"]:
+            member = self.findHashArray(
+                "hash", memberHash, "feature", session=session)
+            if (member is None):
+                logging.warning(
+                    "Merged feature {hash} is no longer cached".format(
+                        hash=memberHash))
+                return
+            arrays.append(member["data"])
+
+        data = arrays[0] if len(arrays) == 1 else merge_columns(arrays)
+        self.sessions[session]["featureList"].update(point, data=data)
+        self.__enforce_budget(session, keep=point)
+
+    def __read_source(self, session, category, point):
+        '''
+        Read the data of a lazy entry, see registerHD5
+
+        Outputs:
+            True if the data could be read
+        '''
+        try:
+            data = np.ascontiguousarray(read_rows(point["source"]),
+                                        dtype=np.float64)
+        except (OSError, KeyError) as e:
+            logging.warning("Cannot read {name}: {e}".format(
+                name=point["name"], e=e))
+            return False
+
+        blob = content_key(hash_array(data), data)
+        self.sessions[session][category].update(
+            point, data=self.blobs.acquire(blob, data), blob=blob)
+        logging.info("Read {name} from {path}".format(
+            name=point["name"], path=point["source"]["path"]))
+        self.__enforce_budget(session, keep=point)
+        return True
+
+    def __release(self, point):
+        '''
+        Free the shared or spilled data of a record that left the cache
+        '''
+        if point.get("blob") is not None:
+            self.blobs.release(point["blob"])
+
+        path = point.get("spilled")
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+        if point.get("source") is not None:
+            remove_kept(point["source"]["path"])
+
+    def __replace_index(self, session, category, records=None):
+        for point in self.sessions[session].get(category, []):
+            self.__release(point)
+
+        index = HashIndex()
+        for point in records or []:
+            point.pop("blob", None)
+            if isinstance(point.get("data"), np.ndarray) and \
+                    not point["data"].dtype.hasobject:
+                point["blob"] = content_key(
+                    hash_array(point["data"]), point["data"])
+                point["data"] = self.blobs.acquire(point["blob"], point["data"])
+            index.append(point)
+
+        self.sessions[session][category] = index
+
+    def __materialized(self, session, category):
+        '''
+        Records of a category with spilled data read back in, leaving the cache untouched
+        '''
+        records = []
+        for point in self.sessions[session][category]:
+            if point.get("spilled"):
+                point = dict(point)
+                point["data"] = np.load(point.pop("spilled"), allow_pickle=False)
+            elif point.get("source") and point.get("data") is None:
+                # saved sessions do not depend on the uploaded file
+                point = dict(point)
+                try:
+                    point["data"] = np.ascontiguousarray(
+                        read_rows(point.pop("source")), dtype=np.float64)
+                except (OSError, KeyError) as e:
+                    logging.warning("Cannot read {name}, left out: {e}".format(
+                        name=point["name"], e=e))
+                    continue
+            records.append(point)
+        return records
+
+    def __reclaim(self, session, keep=None):
+        '''
+        Inputs:
+            session (string)  - session to reclaim memory from
+            keep (dict)       - record that must not be reclaimed
+
+        Outputs:
+            number of bytes freed, or None if nothing could be reclaimed
+
+        Notes:
+            Dropping one of several references to a shared array frees
+            nothing, only the last reference does
+        '''
+        candidates = self.__eviction_candidates(session, keep)
+        if not candidates:
+            return None
+
+        key, category, point = min(candidates, key=lambda c: c[0])
+        freed = self.__freed_bytes(point)
+
+        if (key[0] == 0) and point.get("members"):
+            # merged views keep their record and are rebuilt on access
+            self.sessions[session][category].update(point, data=None)
+            logging.info("Dropped merged data ({memory} bytes)".format(
+                memory=freed))
+        elif (key[0] == 0) and point.get("source"):
+            # lazy entries keep their record and are read again on access
+            blob = point.get("blob")
+            self.sessions[session][category].update(point, data=None, blob=None)
+            if blob is not None:
+                self.blobs.release(blob)
+            logging.info("Dropped {name} ({memory} bytes), read from {path}".
+                         format(name=point["name"], memory=freed,
+                                path=point["source"]["path"]))
+        elif (key[0] == 0):
+            self.sessions[session][category].remove(point)
+            self.__release(point)
+            logging.info("Evicted {name} ({memory} bytes) from {category}".
+                         format(name=point["name"], memory=freed,
+                                category=category))
+        else:
+            self.__spill(session, category, point)
+            logging.info("Spilled {name} ({memory} bytes) from {category}".
+                         format(name=point["name"], memory=freed,
+                                category=category))
+
+        return freed
+
+    def __enforce_budget(self, session, keep=None):
+        '''
+        Reclaim entries until the session and global budgets are met.
+        Other sessions are only reclaimed from if they are not busy.
+        '''
+        if (self.session_budget > 0):
+            while (self.__session_memory(session) > self.session_budget):
+                if (self.__reclaim(session, keep) is None):
+                    logging.warning(
+                        "Session over memory budget, nothing left to reclaim")
+                    break
+
+        if (self.memory_budget > 0):
+            while (self.__total_memory() > self.memory_budget):
+
+                coldest = None
+                for other in list(self.sessions):
+                    lock = self._session_lock(other)
+                    if not lock.acquire(blocking=False):
+                        continue
+                    try:
+                        keys = [
+                            c[0] for c in self.__eviction_candidates(other, keep)
+                        ]
+                    finally:
+                        lock.release()
+
+                    if keys and (coldest is None or min(keys) < coldest[0]):
+                        coldest = (min(keys), other)
+
+                if (coldest is None):
+                    logging.warning(
+                        "Cache over memory budget, nothing left to reclaim")
+                    break
+
+                lock = self._session_lock(coldest[1])
+                if not lock.acquire(blocking=False):
+                    break
+                try:
+                    freed = self.__reclaim(coldest[1], keep)
+                finally:
+                    lock.release()
+
+                if (freed is None):
+                    break
+
+    @expose('getMemoryUsage')
+    @session_locked
+    def getMemoryUsage(self, session=None):
+        '''
+        Inputs:
+
+        Outputs:
+            Dictionary -
+                session (int)         - bytes cached by this session
+                total (int)           - bytes cached by all sessions
+                session_budget (int)  - bytes allowed per session, 0 for no limit
+                memory_budget (int)   - bytes allowed across all sessions, 0 for no limit
+
+        '''
+        session = self.__set_session(session)
+
+        return {
+            "session": self.__session_memory(session),
+            "total": self.__total_memory(),
+            "session_budget": self.session_budget,
+            "memory_budget": self.memory_budget
+        }
+
     @expose('printCacheCount')
+    @session_locked
     def printCacheCount(self, session=None):
         '''
         Inputs:
@@ -107,23 +896,29 @@ class CodexHash:
                      str(len(self.sessions[session]["regressorList"])))
         logging.info("Number of regressor models   : " +
                      str(len(self.sessions[session]["classifierList"])))
+        logging.info("Cached bytes                 : " +
+                     str(self.__session_memory(session)))
 
     @expose('get_nan')
+    @session_locked
     def get_nan(self, session=None):
         session = self.__set_session(session)
         return self.sessions[session]["nan"]
 
     @expose('get_inf')
+    @session_locked
     def get_inf(self, session=None):
         session = self.__set_session(session)
         return self.sessions[session]["inf"]
 
     @expose('get_ninf')
+    @session_locked
     def get_ninf(self, session=None):
         session = self.__set_session(session)
         return self.sessions[session]["ninf"]
 
     @expose('remove_stale_data')
+    @session_locked
     def remove_stale_data(self, verbose=False, session=None):
         '''
         Inputs:
@@ -140,32 +935,9 @@ class CodexHash:
             current_ram = process.memory_info().rss
             logging.info(current_ram)
 
-        oldestTime = time.time()
-        oldestType = "downsample"
-        oldestName = ""
-
-        for point in self.sessions[session]["featureList"]:
-            if (point["time"] < oldestTime):
-                oldestTime = point["time"]
-                oldestType = "feature"
-                oldestName = point["name"]
-
-        for point in self.sessions[session]["subsetList"]:
-            if (point["time"] < oldestTime):
-                oldestTime = point["time"]
-                oldestType = "subset"
-                oldestName = point["name"]
-
-        for point in self.sessions[session]["downsampleList"]:
-            if (point["time"] < oldestTime):
-                oldestTime = point["time"]
-                oldestType = "downsample"
-                oldestName = point["name"]
-
-        status = self.deleteHashName(oldestName, oldestType, session=session)
-        if (status != True):
-            logging.warning("Deleting hash failed")
-            return None
+        if (self.__reclaim(session) is None):
+            logging.warning("No stale data to remove")
+            return False
 
         if (verbose):
             logging.info("After clearing cache:")
@@ -174,70 +946,34 @@ class CodexHash:
             current_ram = process.memory_info().rss
             logging.info(current_ram)
 
+        return True
+
     @expose('deleteHashName')
+    @session_locked
     def deleteHashName(self, name, hashType, session=None):
         session = self.__set_session(session)
 
-        delIndex = None
-
         if (hashType == "subset"):
-
-            length = len(self.sessions[session]["subsetList"])
-            for x in range(0, length):
-                if (name == self.sessions[session]["subsetList"][x]["name"]):
-                    delIndex = x
-
-            if (delIndex is not None):
-                del self.sessions[session]["subsetList"][delIndex]
-                return True
-            else:
-                return False
-
+            hashes = self.sessions[session]["subsetList"]
         elif (hashType == "feature"):
-
-            length = len(self.sessions[session]["featureList"])
-            for x in range(0, length):
-                if (name == self.sessions[session]["featureList"][x]["name"]):
-                    delIndex = x
-
-            if (delIndex is not None):
-                del self.sessions[session]["featureList"][delIndex]
-                return True
-            else:
-                return False
-
+            hashes = self.sessions[session]["featureList"]
         elif (hashType == "downsample"):
-
-            length = len(self.sessions[session]["downsampleList"])
-            for x in range(0, length):
-                if (name == self.sessions[session]["downsampleList"][x]["name"]
-                    ):
-                    delIndex = x
-
-            if (delIndex is not None):
-                del self.sessions[session]["downsampleList"][delIndex]
-                return True
-            else:
-                return False
-
+            hashes = self.sessions[session]["downsampleList"]
         elif (hashType == "label"):
-
-            length = len(self.sessions[session]["labelList"])
-            for x in range(0, length):
-                if (name == self.sessions[session]["labelList"][x]["name"]):
-                    delIndex = x
-
-            if (delIndex is not None):
-                del self.sessions[session]["labelList"][delIndex]
-                return True
-            else:
-                return False
-
+            hashes = self.sessions[session]["labelList"]
         else:
+            return False
 
+        # historically the last record with a matching name is removed
+        point = hashes.find("name", name, last=True)
+        if (point is None):
             return False
 
+        self.__release(point)
+        return hashes.remove(point)
+
     @expose('hashUpdate')
+    @session_locked
     def hashUpdate(self, field, old, new, hashType, session=None):
         '''
         Inputs:
@@ -248,8 +984,21 @@ class CodexHash:
         session = self.__set_session(session)
 
         result = self.findHashArray(field, old, hashType, session=session)
-        status = self.deleteHashName(old, hashType, session=session)
-        #logging.info("DEBUG:", new)
+        if (result is None):
+            return False
+
+        # pull the record out before changing it so the indexes stay valid
+        if (hashType == "subset"):
+            self.sessions[session]["subsetList"].remove(result)
+        elif (hashType == "downsample"):
+            self.sessions[session]["downsampleList"].remove(result)
+        elif (hashType == "label"):
+            self.sessions[session]["labelList"].remove(result)
+        elif (hashType == "feature"):
+            self.sessions[session]["featureList"].remove(result)
+        else:
+            return False
+
         result[field] = new
 
         if (hashType == "subset"):
@@ -266,6 +1015,7 @@ class CodexHash:
         return True
 
     @expose('resetCacheList')
+    @session_locked
     def resetCacheList(self, hashType, session=None):
         '''
         Inputs:
@@ -275,34 +1025,28 @@ class CodexHash:
         '''
         session = self.__set_session(session)
 
-        if (hashType == "feature"):
-            self.sessions[session]["featureList"] = []
-        elif (hashType == "downsample"):
-            self.sessions[session]["downsampleList"] = []
-        elif (hashType == "subset"):
-            self.sessions[session]["subsetList"] = []
-        elif (hashType == "label"):
-            self.sessions[session]["labelList"] = []
-        elif (hashType == "classifier"):
-            self.sessions[session]["classifierList"] = []
-        elif (hashType == "regressor"):
-            self.sessions[session]["regressorList"] = []
+        category = HASH_TYPE_CATEGORIES.get(hashType)
+        if (category is not None):
+            self.__replace_index(session, category)
         else:
             logging.warning("Unknown hash type.  Not resetting")
 
     @expose('hashArray')
+    @session_locked
     def hashArray(self,
                   arrayName,
                   inputArray,
                   hashType,
                   virtual=False,
+                  categories=None,
                   session=None):
         '''
         Inputs:
             arrayName (string)    - Name of the data set.  Used in visalization for easy human data recognition
-            inputArray (np aray)  - Data to be hashed.  Numpy ND array.  If integers, casted to float for storage
+            inputArray (np aray)  - Data to be hashed.  Numpy ND array.  If integers, casted to float for storage.  Strings are tokenized
             hashType (string)     - Hash log to store data in {feature, subset, downsample, label}
             virtual (boolean)     - Whether or not this is a "virtual" feature
+            categories (list)     - strings of tokenized inputArray, indexed by token (see string2token)
 
         Outputs:
             Dictionary -
@@ -311,6 +1055,7 @@ class CodexHash:
                 hash (string)     - resulting hash
                 samples (int)     - number of samples in the data set
                 memory (int)      - size, in bytes, of memory being cached
+                categories (list) - categories input, or those of inputArray if it was tokenized here
 
         '''
         session = self.__set_session(session)
@@ -321,27 +1066,32 @@ class CodexHash:
         if isinstance(inputArray, range):
             inputArray = np.array(inputArray, dtype=np.float64)
 
-        # TODO - figure out why this is required and if it has any negative impacts
-        if (inputArray.flags["C_CONTIGUOUS"] == False):
-            inputArray = inputArray.copy(order='C')
-
+        # hashing reads the buffer directly, so it must be C contiguous.
+        # Contiguous float64 input is used as is, without a copy.
         try:
-            inputArray = inputArray.astype(float)
+            inputArray = np.ascontiguousarray(inputArray, dtype=np.float64)
         except BaseException:
-            inputArray = string2token(inputArray)
+            inputArray, categories = string2token(
+                inputArray, return_categories=True)
+            inputArray = np.ascontiguousarray(inputArray)
+
+        if categories is not None:
+            categories = np.asarray(categories, dtype=str).tolist()
 
         # Add feature name to hash calc in case of identical (i.e., all zero) arrays
-        hashValue = hashlib.sha1(inputArray.tostring() + arrayName.encode('utf-8')).hexdigest()
+        hasher = hash_array(inputArray)
+        blobKey = content_key(hasher, inputArray)
+        hasher.update(arrayName.encode('utf-8'))
+        hashValue = hasher.hexdigest()
         samples = len(inputArray)
-
-        # TODO - better figure out how to calculate RAM usage. Don't think static
-        # is possible
-        memoryFootprint = 0  # asizeof.asizeof(inputArray)
+        memoryFootprint = int(inputArray.nbytes)
 
         creationTime = time.time()
 
         newHash = {
             'time': creationTime,
+            'access': creationTime,
+            'hits': 0,
             'name': arrayName,
             'data': inputArray,
             'hash': hashValue,
@@ -349,36 +1099,33 @@ class CodexHash:
             "memory": memoryFootprint,
             "type": hashType,
             "virtual": virtual,
+            "categories": categories,
             "color": None,
             "z-order": None
         }
 
-        if (hashType == "feature"):
-            if not any(d['hash'] == newHash["hash"]
-                       for d in self.sessions[session]["featureList"]):
-                self.sessions[session]["featureList"].append(newHash)
-        elif (hashType == "subset"):
-            if not any(d['hash'] == newHash["hash"]
-                       for d in self.sessions[session]["subsetList"]):
-                self.sessions[session]["subsetList"].append(newHash)
-        elif (hashType == "downsample"):
-            if not any(d['hash'] == newHash["hash"]
-                       for d in self.sessions[session]["downsampleList"]):
-                self.sessions[session]["downsampleList"].append(newHash)
-        elif (hashType == "label"):
-            if not any(d['name'] == newHash["name"]
-                       for d in self.sessions[session]["labelList"]):
-                self.sessions[session]["labelList"].append(newHash)
-        elif (hashType == "NOSAVE"):
-            pass
-        else:
+        if (hashType == "NOSAVE"):
+            return newHash
+        elif hashType not in ["feature", "subset", "downsample", "label"]:
             logging.warning(
                 "ERROR: Hash type not recognized! Not logged for future use.")
             return None
 
+        hashes = self.sessions[session][HASH_TYPE_CATEGORIES[hashType]]
+
+        # labels are unique by name, everything else by hash
+        field = "name" if (hashType == "label") else "hash"
+        if not hashes.contains(field, newHash[field]):
+            # identical data from any session is stored once
+            newHash["blob"] = blobKey
+            newHash["data"] = self.blobs.acquire(blobKey, inputArray)
+            hashes.append(newHash)
+
+        self.__enforce_budget(session, keep=newHash)
         return newHash
 
     @expose('getSentinelValues')
+    @session_locked
     def getSentinelValues(self, featureList, session=None):
 
         session = self.__set_session(session)
@@ -386,11 +1133,19 @@ class CodexHash:
 
         combined = np.array([], dtype=float)
         for feature in featureList:
+            # lazy entries are left out rather than read just for this
+            point = self.sessions[session]["featureList"].find("name", feature)
+            if point and point.get("source") and point["data"] is None:
+                continue
+
             r = self.findHashArray("name", feature, "feature", session=session)
             if r:
                 r_unique = np.unique(r['data']).astype(float)
                 combined = np.concatenate((combined, r_unique))
 
+        if (combined.size == 0):
+            return sentinel_values
+
         combined_unique = np.unique(combined)
         max_val = np.nanmax(combined_unique)
 
@@ -424,7 +1179,8 @@ class CodexHash:
             for point in self.sessions[session]["featureList"]:
                 logging.info("Name: " + point['name'])
                 logging.info("Hash: " + point['hash'])
-                logging.info("Data Shape: " + str(point['data'].shape))
+                logging.info("Data Shape: " + ("spilled to disk" if point.get(
+                    "spilled") else str(point['data'].shape)))
                 logging.info("Color: " + str(point["color"]))
                 logging.info("Z-Order: " + str(point["z-order"]))
 
@@ -433,7 +1189,8 @@ class CodexHash:
             for point in self.sessions[session]["subsetList"]:
                 logging.info("Name: " + point['name'])
                 logging.info("Hash: " + point['hash'])
-                logging.info("Data Shape: " + str(point['data'].shape))
+                logging.info("Data Shape: " + ("spilled to disk" if point.get(
+                    "spilled") else str(point['data'].shape)))
                 logging.info("Color: " + str(point["color"]))
                 logging.info("Z-Order: " + str(point["z-order"]))
 
@@ -442,7 +1199,8 @@ class CodexHash:
             for point in self.sessions[session]["downsampleList"]:
                 logging.info("Name: " + point['name'])
                 logging.info("Hash: " + point['hash'])
-                logging.info("Data Shape: " + str(point['data'].shape))
+                logging.info("Data Shape: " + ("spilled to disk" if point.get(
+                    "spilled") else str(point['data'].shape)))
                 logging.info("Color: " + str(point["color"]))
                 logging.info("Z-Order: " + str(point["z-order"]))
 
@@ -451,7 +1209,8 @@ class CodexHash:
             for point in self.sessions[session]["labelList"]:
                 logging.info("Name: " + point['name'])
                 logging.info("Hash: " + point['hash'])
-                logging.info("Data Shape: " + str(point['data'].shape))
+                logging.info("Data Shape: " + ("spilled to disk" if point.get(
+                    "spilled") else str(point['data'].shape)))
                 logging.info("Color: " + str(point["color"]))
                 logging.info("Z-Order: " + str(point["z-order"]))
 
@@ -459,6 +1218,7 @@ class CodexHash:
             logging.warning("ERROR: printHashList - unknown hashType")
 
     @expose('findHashArray')
+    @session_locked
     def findHashArray(self, field, name, hashType, session=None):
         '''
         Inputs:
@@ -471,58 +1231,235 @@ class CodexHash:
         '''
         session = self.__set_session(session)
 
-        if (hashType == "feature"):
-            for point in self.sessions[session]["featureList"]:
-                if (point[field] == name):
-                    return point
+        category = HASH_TYPE_CATEGORIES.get(hashType)
+        if (category is None):
+            logging.warning("ERROR: findHashArray - hash not found")
             return None
 
-        elif (hashType == "subset"):
-            for point in self.sessions[session]["subsetList"]:
-                if (point[field] == name):
-                    return point
-            return None
+        point = self.sessions[session][category].find(field, name)
 
-        elif (hashType == "downsample"):
+        if (point is not None):
+            # usage statistics for eviction
+            point["access"] = time.time()
+            point["hits"] = point.get("hits", 0) + 1
 
-            for point in self.sessions[session]["downsampleList"]:
-                if (point[field] == name):
-                    return point
-            return None
+            if point.get("spilled"):
+                self.__page_in(session, category, point)
+            elif point.get("members") and point["data"] is None:
+                self.__materialize(session, point)
+            elif point.get("source") and point["data"] is None:
+                if not self.__read_source(session, category, point):
+                    return None
 
-        elif (hashType == "label"):
+        return point
 
-            for point in self.sessions[session]["labelList"]:
-                if (point[field] == name):
-                    return point
-            return None
+    @expose('findHashArrays')
+    @session_locked
+    def findHashArrays(self, field, names, hashType, session=None):
+        '''
+        Inputs:
+            field    (string)  - field to match on {name, hash}
+            names    (list)    - values of field for the data sets you wish to access
+            hashType (string)  - hash category of the data sets {feature, subset, downsample, label, regressor, classifier}
 
-        elif (hashType == "regressor"):
+        Outputs:
+            list of hashArray function defined dictionaries, in the order of names.
+                None for any name that was not found
 
-            for point in self.sessions[session]["regressorList"]:
-                if (point[field] == name):
-                    return point
-            return None
+        Notes:
+            Fetches several data sets in a single call to the cache server
+
+        '''
+        session = self.__set_session(session)
 
-        elif (hashType == "classifier"):
+        return [
+            self.findHashArray(field, name, hashType, session=session)
+            for name in names
+        ]
+
+    @expose('findHashSlices')
+    @session_locked
+    def findHashSlices(self,
+                       field,
+                       names,
+                       hashType,
+                       start=None,
+                       stop=None,
+                       step=None,
+                       samples=None,
+                       session=None):
+        '''
+        Inputs:
+            field    (string)  - field to match on {name, hash}
+            names    (list)    - values of field for the data sets you wish to access
+            hashType (string)  - hash category of the data sets
+            start, stop, step  - rows to return, as in data[start:stop:step]
+            samples  (int)     - downsample the rows to this many, as simple_downsample does
 
-            for point in self.sessions[session]["classifierList"]:
-                if (point[field] == name):
-                    return point
-            return None
+        Outputs:
+            list of {name, hash, samples, data} in the order of names, with
+                only the requested rows in data. None for any name that was
+                not found
+
+        Notes:
+            Only the selected rows leave the cache server, the rest of the
+            array is never copied. Lazy entries that have not been read yet
+            only read the selected rows from their file.
+
+        '''
+        session = self.__set_session(session)
+
+        category = HASH_TYPE_CATEGORIES.get(hashType)
+        if (category is None):
+            logging.warning("ERROR: findHashSlices - hash not found")
+            return [None for name in names]
+
+        slices = []
+        for name in names:
+            point = self.sessions[session][category].find(field, name)
+
+            if point is not None and point.get("source") and \
+                    point["data"] is None:
+                point["access"] = time.time()
+                rows = downsample_rows(slice(start, stop, step),
+                                       point["samples"], samples)
+                try:
+                    data = read_rows(point["source"], rows).astype(
+                        np.float64, copy=False)
+                except (OSError, KeyError) as e:
+                    logging.warning("Cannot read {name}: {e}".format(
+                        name=point["name"], e=e))
+                    point = data = None
+            else:
+                point = self.findHashArray(field, name, hashType,
+                                           session=session)
+                if point is not None:
+                    rows = downsample_rows(slice(start, stop, step),
+                                           len(point["data"]), samples)
+                    data = point["data"][rows]
+
+            if point is None:
+                slices.append(None)
+                continue
+
+            slices.append({
+                'name': point['name'],
+                'hash': point['hash'],
+                'samples': point['samples'],
+                'data': data
+            })
+        return slices
+
+    @expose('registerHD5')
+    @session_locked
+    def registerHD5(self, arrayName, filepath, dataset, session=None):
+        '''
+        Inputs:
+            arrayName (string)  - name of the feature
+            filepath (string)   - HDF5 file
+            dataset (string)    - path of a numeric dataset in the file
+
+        Outputs:
+            the feature's hash record, without data
+
+        Notes:
+            The dataset is not read: the record keeps its source (file,
+            dataset, shape, dtype) and findHashArray reads it the first time
+            the data is asked for, findHashSlices reads only the rows asked
+            for. The hash is derived from the source and the name, so
+            registering the same unchanged dataset again returns the same
+            record.
+
+            The record reads from a hard link to the file (see keep_file),
+            in a hidden directory next to it and removed with the record, so
+            replacing the file does not change the registered data.
+
+        '''
+        session = self.__set_session(session)
 
+        kept = keep_file(filepath, os.path.join(
+            os.path.dirname(os.path.abspath(filepath)), HD5_KEEP_DIR))
+        try:
+            source = dataset_source(kept, dataset)
+        except Exception:
+            remove_kept(kept)
+            raise
+
+        hasher = new_hasher()
+        hasher.update(b"hd5")
+        hasher.update(json.dumps(dict(source, path=os.path.abspath(filepath)),
+                                 sort_keys=True).encode('utf-8'))
+        hasher.update(arrayName.encode('utf-8'))
+        hashValue = hasher.hexdigest()
+
+        hashes = self.sessions[session]["featureList"]
+        point = hashes.find("hash", hashValue)
+        if (point is not None):
+            remove_kept(kept)
         else:
-            logging.warning("ERROR: findHashArray - hash not found")
-            return None
+            creationTime = time.time()
+            point = {
+                'time': creationTime,
+                'access': creationTime,
+                'hits': 0,
+                'name': arrayName,
+                'data': None,
+                'source': source,
+                'hash': hashValue,
+                "samples": source["shape"][0],
+                "memory": 0,
+                "type": "feature",
+                "virtual": False,
+                "categories": None,
+                "color": None,
+                "z-order": None
+            }
+            hashes.append(point)
+
+        return dict(point, data=None)
+
+    @expose('hashNpyColumns')
+    @session_locked
+    def hashNpyColumns(self, filepath, start, stop, hashType, session=None):
+        '''
+        Inputs:
+            filepath (string)  - .npy file of a 2-D numeric array, samples by
+                                 features
+            start, stop (int)  - range of the columns to store, named
+                                 feature_<column>
+            hashType (string)  - see hashArray
+
+        Outputs:
+            list of the columns' hash records, without data
+
+        Notes:
+            The file is memory mapped, not loaded, and the columns are
+            stored from a single column major copy (see column_major), or
+            as views of the mapping if the file is Fortran ordered float64.
+            Reading the file here, rather than in the client, spares sending
+            every column to the cache server.
+        '''
+        session = self.__set_session(session)
+
+        matrix = np.load(filepath, mmap_mode='r')
+        records = []
+        for x, column in zip(range(start, stop),
+                             column_major(matrix, start, stop)):
+            point = self.hashArray(
+                "feature_" + str(x), column, hashType, session=session)
+            records.append(dict(point, data=None))
+
+        return records
 
     @expose('mergeHashResults')
+    @session_locked
     def mergeHashResults(self, hashList, verbose=False, session=None):
         '''
         Inputs:
             hashList (list)      - list of hash strings to be merged into a new accessible data set
 
         Outputs:
-            hashArray (np array) - merged numpy nd-array of individual from hashList input
+            hashArray (np array) - merged numpy nd-array of individual from hashList input, columns in hashList order
 
         '''
         session = self.__set_session(session)
@@ -535,64 +1472,116 @@ class CodexHash:
             logging.warning("ERROR: mergeHashResults hashList is empty")
             return None
 
-        totalFeatures = len(hashList)
-
-        if (verbose):
-            logging.warning("Number of features: " + str(totalFeatures))
-
-        currentHash = hashList[0]
-        result = self.findHashArray(
-            "hash", currentHash, "feature", session=session)
-        if (result is None):
-            logging.warning("Warning, hash not found in mergeHashResults")
-            return None
-
-        returnArray = result['data']
-        returnName = result['name']
-
         if (verbose):
-            logging.info("Merging: " + returnName)
+            logging.warning("Number of features: " + str(len(hashList)))
 
-        for featureNum in range(1, totalFeatures):
-            currentHash = hashList[featureNum]
+        arrays = []
+        for currentHash in hashList:
             result = self.findHashArray(
                 "hash", currentHash, "feature", session=session)
             if (result is None):
                 logging.warning("Warning, hash not found in mergeHashResults")
                 return None
 
-            resultArray = result['data']
-            resultName = result['name']
-
             if (verbose):
-                logging.info("Merging: " + resultName)
+                logging.info("Merging: " + result['name'])
+
+            if arrays and (len(result['data']) != len(arrays[0])):
+                # TODO - long term, how do we want to handle this?
+                logging.warning(
+                    "WARNING: {resultName} does not match shape of previous features({s1}/{s2}). Exlucding."
+                    .format(resultName=result['name'], s1=len(arrays[0]),
+                            s2=len(result['data'])))
+                continue
 
-            try:
-                (s1, f1) = returnArray.shape
-            except BaseException:
-                s1 = returnArray.size
+            arrays.append(result['data'])
 
-            s2 = resultArray.size
+        if (len(arrays) == 1):
+            return arrays[0]
 
-            if (s1 == s2):
-                returnArray = np.column_stack((resultArray, returnArray))
-            else:
-                # TODO - long term, how do we want to handle this?
+        return merge_columns(arrays)
+
+    @expose('mergeHashView')
+    @session_locked
+    def mergeHashView(self, hashList, session=None):
+        '''
+        Inputs:
+            hashList (list)  - feature hashes to merge, in column order
+
+        Outputs:
+            hash record of a "Merged" feature, without its data, or None if a hash is not found
+
+        Notes:
+            The record only lists its member hashes; findHashArray builds the
+            merged array the first time it is accessed. The record hash is
+            derived from the member hashes, so merging the same features again
+            returns the same record without merging or hashing any data.
+        '''
+        session = self.__set_session(session)
+
+        if not hashList:
+            logging.warning("ERROR: mergeHashView hashList is empty")
+            return None
+
+        hashes = self.sessions[session]["featureList"]
+
+        members = []
+        samples = None
+        for memberHash in hashList:
+            member = hashes.find("hash", memberHash)
+            if (member is None):
+                logging.warning("Warning, hash not found in mergeHashView")
+                return None
+
+            if samples is None:
+                samples = member["samples"]
+            elif (member["samples"] != samples):
                 logging.warning(
-                    "WARNING: {resultName} does not match shape of previous features("
-                    + str(s1) + "/" + str(s2) +
-                    "). Exlucding.".format(resultName=resultName))
+                    "WARNING: {name} does not match shape of previous features({s1}/{s2}). Exlucding."
+                    .format(name=member["name"], s1=samples,
+                            s2=member["samples"]))
+                continue
+
+            members.append(memberHash)
+
+        hasher = new_hasher()
+        hasher.update(b"Merged")
+        for memberHash in members:
+            hasher.update(memberHash.encode('utf-8'))
+        hashValue = hasher.hexdigest()
+
+        point = hashes.find("hash", hashValue)
+        if (point is None):
+            creationTime = time.time()
+            point = {
+                'time': creationTime,
+                'access': creationTime,
+                'hits': 0,
+                'name': "Merged",
+                'data': None,
+                'members': members,
+                'hash': hashValue,
+                "samples": samples,
+                "memory": 0,
+                "type": "feature",
+                "virtual": False,
+                "color": None,
+                "z-order": None
+            }
+            hashes.append(point)
 
-        return returnArray
+        return dict(point, data=None)
 
     @expose('feature2hashList')
+    @session_locked
     def feature2hashList(self, featureList, session=None):
 
         session = self.__set_session(session)
 
         hashList = []
         for feature in featureList:
-            r = self.findHashArray("name", feature, "feature", session=session)
+            # only the hash is needed, spilled or lazy data is left alone
+            r = self.sessions[session]["featureList"].find("name", feature)
             if (r is not None):
                 hashList.append(r['hash'])
             else:
@@ -602,6 +1591,7 @@ class CodexHash:
         return hashList
 
     @expose('applySubsetMask')
+    @session_locked
     def applySubsetMask(self,
                         featureArray,
                         subsetHash,
@@ -676,6 +1666,7 @@ class CodexHash:
             return outData, returnDict['name']
 
     @expose('pickle_data')
+    @session_locked
     def pickle_data(self,
                     session_name,
                     front_end_state,
@@ -695,32 +1686,32 @@ class CodexHash:
 
         ## Save classifier models
         pickle_path = os.path.join(session_path, 'classifier_models')
-        pickle.dump(self.sessions[session]["classifierList"],
+        pickle.dump(self.__materialized(session, "classifierList"),
                     open(pickle_path, 'wb'))
 
         # Save regression models
         pickle_path = os.path.join(session_path, 'regressor_models')
-        pickle.dump(self.sessions[session]["regressorList"],
+        pickle.dump(self.__materialized(session, "regressorList"),
                     open(pickle_path, 'wb'))
 
         # Save labels
         pickle_path = os.path.join(session_path, "label_data")
-        pickle.dump(self.sessions[session]["labelList"], open(
+        pickle.dump(self.__materialized(session, "labelList"), open(
             pickle_path, 'wb'))
 
         # Save features
         pickle_path = os.path.join(session_path, "feature_data")
-        pickle.dump(self.sessions[session]["featureList"],
+        pickle.dump(self.__materialized(session, "featureList"),
                     open(pickle_path, 'wb'))
 
         # Save subsets
         pickle_path = os.path.join(session_path, "subset_data")
-        pickle.dump(self.sessions[session]["subsetList"],
+        pickle.dump(self.__materialized(session, "subsetList"),
                     open(pickle_path, 'wb'))
 
         # Save downsampled features
         pickle_path = os.path.join(session_path, "downsampled_data")
-        pickle.dump(self.sessions[session]["downsampleList"],
+        pickle.dump(self.__materialized(session, "downsampleList"),
                     open(pickle_path, 'wb'))
 
         # Save front end state
@@ -728,6 +1719,7 @@ class CodexHash:
         pickle.dump(front_end_state, open(pickle_path, 'wb'))
 
     @expose('return_data')
+    @session_locked
     def return_data(self, session=None):
         '''
         Inputs:
@@ -738,22 +1730,22 @@ class CodexHash:
         session = self.__set_session(session)
 
         ## Save classifier models
-        classifiers = self.sessions[session]["classifierList"]
+        classifiers = self.__materialized(session, "classifierList")
 
         # Save regression models
-        regressors = self.sessions[session]["regressorList"]
+        regressors = self.__materialized(session, "regressorList")
 
         # Save labels
-        labels = self.sessions[session]["labelList"]
+        labels = self.__materialized(session, "labelList")
 
         # Save features
-        features = self.sessions[session]["featureList"]
+        features = self.__materialized(session, "featureList")
 
         # Save subsets
-        subsets = self.sessions[session]["subsetList"]
+        subsets = self.__materialized(session, "subsetList")
 
         # Save downsampled features
-        downsamples = self.sessions[session]["downsampleList"]
+        downsamples = self.__materialized(session, "downsampleList")
 
         return {
             'classifiers': classifiers,
@@ -765,6 +1757,7 @@ class CodexHash:
         }
 
     @expose('unpickle_data')
+    @session_locked
     def unpickle_data(self, session_name, loadPath, session=None):
         '''
         Inputs:
@@ -784,18 +1777,18 @@ class CodexHash:
 
         ## Load classifier models
         pickle_path = os.path.join(session_path, 'classifier_models')
-        self.sessions[session]["classifierList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "classifierList",
+                             pickle.load(open(pickle_path, "rb")))
 
         # Load regression models
         pickle_path = os.path.join(session_path, 'regressor_models')
-        self.sessions[session]["regressorList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "regressorList",
+                             pickle.load(open(pickle_path, "rb")))
 
         # Load labels
         pickle_path = os.path.join(session_path, "label_data")
-        self.sessions[session]["labelList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "labelList",
+                             pickle.load(open(pickle_path, "rb")))
 
         labels = []
         for label in self.sessions[session]["labelList"]:
@@ -805,8 +1798,8 @@ class CodexHash:
 
         # Load features
         pickle_path = os.path.join(session_path, "feature_data")
-        self.sessions[session]["featureList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "featureList",
+                             pickle.load(open(pickle_path, "rb")))
 
         features = []
         for feature in self.sessions[session]["featureList"]:
@@ -816,8 +1809,8 @@ class CodexHash:
 
         # Load subsets
         pickle_path = os.path.join(session_path, "subset_data")
-        self.sessions[session]["subsetList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "subsetList",
+                             pickle.load(open(pickle_path, "rb")))
 
         subsets = []
         for subset in self.sessions[session]["subsetList"]:
@@ -827,8 +1820,8 @@ class CodexHash:
 
         # Load downsampled features
         pickle_path = os.path.join(session_path, "downsampled_data")
-        self.sessions[session]["downsampleList"] = pickle.load(
-            open(pickle_path, "rb"))
+        self.__replace_index(session, "downsampleList",
+                             pickle.load(open(pickle_path, "rb")))
 
         downsamples = []
         for downsample in self.sessions[session]["downsampleList"]:
@@ -849,6 +1842,7 @@ class CodexHash:
         }
 
     @expose('saveModel')
+    @session_locked
     def saveModel(self, modelName, inputModel, modelType, session=None):
         '''
         Inputs:
@@ -869,15 +1863,14 @@ class CodexHash:
 
         pickled_model = pickle.dumps(inputModel)
         hashValue = hashlib.sha1(pickled_model).hexdigest()
-
-        # TODO - better figure out how to calculate RAM usage. Don't think static
-        # is possible
-        memoryFootprint = 0  # asizeof.asizeof(inputArray)
+        memoryFootprint = len(pickled_model)
 
         creationTime = time.time()
 
         newHash = {
             'time': creationTime,
+            'access': creationTime,
+            'hits': 0,
             'name': modelName,
             'model': pickled_model,
             'hash': hashValue,
@@ -886,12 +1879,12 @@ class CodexHash:
         }
 
         if (modelType == "regressor"):
-            if not any(d['hash'] == newHash["hash"]
-                       for d in self.sessions[session]["regressorList"]):
+            if not self.sessions[session]["regressorList"].contains(
+                    "hash", newHash["hash"]):
                 self.sessions[session]["regressorList"].append(newHash)
         elif (modelType == "classifier"):
-            if not any(d['hash'] == newHash["hash"]
-                       for d in self.sessions[session]["classifierList"]):
+            if not self.sessions[session]["classifierList"].contains(
+                    "hash", newHash["hash"]):
                 self.sessions[session]["classifierList"].append(newHash)
         else:
             logging.warning(
@@ -899,9 +1892,11 @@ class CodexHash:
             )
             return None
 
+        self.__enforce_budget(session, keep=newHash)
         return newHash
 
     @expose('import_hd5')
+    @session_locked
     def import_hd5(self, filepath, session=None):
 
         from api.sub.read_data import codex_read_hd5
@@ -914,6 +1909,7 @@ class CodexHash:
         return hashList, featureList
 
     @expose('import_csv')
+    @session_locked
     def import_csv(self, filepath, session=None):
 
         from api.sub.read_data import codex_read_csv
@@ -926,6 +1922,7 @@ class CodexHash:
         return hashList, featureList
 
     @expose('import_npy')
+    @session_locked
     def import_npy(self, filepath, session=None):
 
         from api.sub.read_data import codex_read_npy
@@ -937,7 +1934,30 @@ class CodexHash:
 
         return hashList, featureList
 
+    @expose('import_parquet')
+    @session_locked
+    def import_parquet(self, filepath, featureList=None, session=None):
+
+        from api.sub.read_data import codex_read_parquet
+        return codex_read_parquet(
+            filepath,
+            featureList,
+            "feature",
+            session=WrappedCache(session, cache=self))
+
+    @expose('import_arrow')
+    @session_locked
+    def import_arrow(self, filepath, featureList=None, session=None):
+
+        from api.sub.read_data import codex_read_arrow
+        return codex_read_arrow(
+            filepath,
+            featureList,
+            "feature",
+            session=WrappedCache(session, cache=self))
+
     @expose('logReturnCode')
+    @session_locked
     def logReturnCode(self, frame, session=None):
         '''
         Inputs:
@@ -1030,6 +2050,7 @@ class CodexHash:
         return full_string
 
     @expose('makeReturnCode')
+    @session_locked
     def makeReturnCode(self, session=None):
         '''
         Inputs:
@@ -1078,6 +2099,7 @@ class CodexHash:
         )
 
     @expose('dump_code_to_file')
+    @session_locked
     def dump_code_to_file(self, returnedCodePath, session=None):
         '''
         Inputs:
@@ -1138,6 +2160,10 @@ def memoize(func):
     return memoized_func
 
 
+# cache clients of this process, reused across get_cache calls
+clients = ClientPool()
+
+
 class WrappedCache:
     '''
     Create a cache, and ensure that it connects to the proper bind address.
@@ -1145,6 +2171,7 @@ class WrappedCache:
     '''
     sessionKey = None
     cache = None
+    __pooled = False
 
     def __init__(self, sessionKey, timeout=5_000, cache=None):
         '''
@@ -1166,11 +2193,54 @@ class WrappedCache:
             self.cache = CodexHash()
         else:
             # TODO: connect to a remote session (spec to DEFAULT_CODEX_HASH_BIND)
-            self.cache = Client(DEFAULT_CODEX_HASH_CONNECT, timeout=timeout)
+            self.cache = clients.acquire(
+                DEFAULT_CODEX_HASH_CONNECT,
+                timeout=timeout,
+                shm_dir=CODEX_SHM_DIR)
+            self.__pooled = True
+
+    def __del__(self):
+        # the client goes back to the pool once nothing can call it anymore
+        if self.__pooled:
+            clients.release(self.cache)
 
     def __getattr__(self, name):
-        return functools.partial(
-            getattr(self.cache, name), session=self.sessionKey)
+        getattr(self.cache, name)
+        return functools.partial(self.__call_cache, name)
+
+    def __call_cache(self, name, *args, **kwargs):
+        # bound to self, so the client stays checked out while the call
+        # is pending
+        kwargs['session'] = self.sessionKey
+        return getattr(self.cache, name)(*args, **kwargs)
+
+    def __call_local(self, calls):
+        return [
+            getattr(self.cache, call['func'])(*call['args'], **call['kwargs'])
+            for call in calls
+        ]
+
+    def batch(self):
+        '''
+        Outputs:
+            Batch - queues cache calls, sending them in a single round trip on execute()
+
+        Notes:
+            batch = cache.batch()
+            batch.findHashArray("name", "x1", "feature")
+            batch.get_nan()
+            x1, nan = batch.execute()
+        '''
+        if isinstance(self.cache, Client):
+            return Batch(
+                self.__call_remote, self.cache.listing, session=self.sessionKey)
+
+        return Batch(self.__call_local, session=self.sessionKey)
+
+    def __call_remote(self, calls):
+        batch = self.cache.batch()
+        batch.calls = calls
+        return batch.execute()
 
 
 def get_cache(session, timeout=5_000):
@@ -1192,9 +2262,15 @@ def get_cache(session, timeout=5_000):
 def create_cache_server(launch=True):
 
     if launch:
-        return Server(CodexHash()).listen(DEFAULT_CODEX_HASH_BIND)
+        # anything spilled by a previous server is unreachable now
+        if CODEX_SPILL_DIR:
+            shutil.rmtree(CODEX_SPILL_DIR, ignore_errors=True)
+
+        return Server(
+            CodexHash(), shm_dir=CODEX_SHM_DIR).listen(
+                DEFAULT_CODEX_HASH_BIND, workers=DEFAULT_CODEX_HASH_WORKERS)
     else:
-        return Server(CodexHash())
+        return Server(CodexHash(), shm_dir=CODEX_SHM_DIR)
 
 
 def stop_cache_server():
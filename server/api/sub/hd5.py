@@ -0,0 +1,212 @@
+'''
+Brief : Read-only access to HDF5 datasets, for lazy cache entries
+
+Notes :
+    An imported HDF5 dataset can be registered with the cache without being
+    read (see CodexHash.registerHD5). The entry only holds where the data is,
+    and the rows are read from the file when they are first asked for.
+
+    A registered file is kept as a hard link (or a copy, see keep_file), so
+    that a later upload under the same name, which replaces the file, does
+    not take the data away from the entries registered before it.
+
+    Files are opened read-only, once per process, through the HandlePool in
+    handles, and kept open for the next read. A file replaced on disk is
+    noticed by its modification time and size and opened again.
+'''
+import os
+import uuid
+import shutil
+import threading
+import contextlib
+
+import h5py
+import numpy as np
+
+from collections import OrderedDict
+
+# HDF5 files a process keeps open
+CODEX_HD5_HANDLES = int(os.getenv('CODEX_HD5_HANDLES', 16))
+
+# rows read at once when only every few rows of a dataset are wanted
+CODEX_HD5_READ_ROWS = int(os.getenv('CODEX_HD5_READ_ROWS', 1 << 20))
+
+
+def file_stamp(path):
+    '''
+    Outputs:
+        (modification time, size) of the file, which changes if it is replaced
+    '''
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class HandlePool:
+    '''
+    Read-only h5py files of this process, by path
+
+    Inputs:
+        max_open (int)  - files kept open, the least recently used is
+                          closed first
+
+    Notes:
+        Reads hold the pool's lock, as h5py serializes them anyway, so a
+        file is never closed under a reader.
+
+        with handles.open(path) as f:
+            data = f[dataset][:10]
+    '''
+
+    def __init__(self, max_open=CODEX_HD5_HANDLES):
+        self.max_open = max(1, max_open)
+        self.__files = OrderedDict()
+        self.__lock = threading.RLock()
+        self.__pid = os.getpid()
+
+    def __len__(self):
+        self.__check_fork()
+        return len(self.__files)
+
+    @contextlib.contextmanager
+    def open(self, path):
+        path = os.path.abspath(path)
+
+        with self.__lock:
+            self.__check_fork()
+
+            stamp = file_stamp(path)
+            entry = self.__files.pop(path, None)
+            if entry is not None and entry[0] != stamp:
+                entry[1].close()
+                entry = None
+
+            if entry is None:
+                entry = (stamp, h5py.File(path, 'r'))
+
+            self.__files[path] = entry
+            while len(self.__files) > self.max_open:
+                _, (_, oldest) = self.__files.popitem(last=False)
+                oldest.close()
+
+            yield entry[1]
+
+    def discard(self, path):
+        '''
+        Close the file, if it is open, before it is written to
+        '''
+        with self.__lock:
+            self.__check_fork()
+            entry = self.__files.pop(os.path.abspath(path), None)
+            if entry is not None:
+                entry[1].close()
+
+    def close(self):
+        with self.__lock:
+            while self.__files:
+                _, (_, f) = self.__files.popitem()
+                f.close()
+
+    def __check_fork(self):
+        # a forked child must not share the parent's open files
+        if os.getpid() != self.__pid:
+            self.__files = OrderedDict()
+            self.__lock = threading.RLock()
+            self.__pid = os.getpid()
+
+    def __repr__(self):
+        return '<HandlePool of {} files>'.format(len(self.__files))
+
+
+handles = HandlePool()
+
+
+def keep_file(path, directory):
+    '''
+    Inputs:
+        path (str)       - file to keep
+        directory (str)  - directory to keep it in
+
+    Outputs:
+        path of a hard link to the file, with a name of its own, or of a
+        copy if the file cannot be linked there
+    '''
+    os.makedirs(directory, exist_ok=True)
+    kept = os.path.join(directory, uuid.uuid4().hex + os.path.splitext(path)[1])
+    try:
+        os.link(path, kept)
+    except OSError:
+        shutil.copyfile(path, kept)
+    return kept
+
+
+def remove_kept(path):
+    '''
+    Close and remove a file made by keep_file
+    '''
+    handles.discard(path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def dataset_source(path, dataset):
+    '''
+    Inputs:
+        path (str)     - HDF5 file
+        dataset (str)  - path of a dataset in the file
+
+    Outputs:
+        dict of path, dataset, shape, dtype and stamp, as kept by a lazy
+        cache entry
+    '''
+    path = os.path.abspath(path)
+    with handles.open(path) as f:
+        d = f[dataset]
+        return {
+            'path': path,
+            'dataset': dataset,
+            'shape': d.shape,
+            'dtype': d.dtype.str,
+            'stamp': file_stamp(path)
+        }
+
+
+def read_rows(source, rows=slice(None)):
+    '''
+    Inputs:
+        source (dict)  - see dataset_source
+        rows (slice)   - rows to read, with a positive step
+
+    Outputs:
+        array of the rows
+
+    Notes:
+        Raises OSError if the file changed since the source was taken.
+
+        HDF5 reads a strided selection row by row, which is slow when the
+        step is smaller than a chunk: every chunk is read either way. Such
+        reads are made in contiguous blocks of about CODEX_HD5_READ_ROWS
+        rows, keeping every step-th row.
+    '''
+    with handles.open(source['path']) as f:
+        if file_stamp(source['path']) != tuple(source['stamp']):
+            raise OSError('{} changed since {} was registered'.format(
+                source['path'], source['dataset']))
+
+        d = f[source['dataset']]
+        start, stop, step = rows.indices(d.shape[0])
+
+        block = d.chunks[0] if d.chunks else CODEX_HD5_READ_ROWS
+        if step == 1 or step >= block:
+            return d[start:stop:step]
+
+        out = np.empty((len(range(start, stop, step)), ) + d.shape[1:],
+                       dtype=d.dtype)
+        span = step * -(-CODEX_HD5_READ_ROWS // step)
+
+        done = 0
+        for first in range(start, stop, span):
+            part = d[first:min(stop, first + span)][::step]
+            out[done:done + len(part)] = part
+            done += len(part)
+
+        return out
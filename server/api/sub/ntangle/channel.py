@@ -0,0 +1,142 @@
+##
+# One-way result channel from worker processes to an asyncio event loop
+#
+# The loop side binds a single PULL socket and reads it with zmq.asyncio, so
+# waiting for results neither parks a thread nor goes through a manager
+# process. Each stream of results gets a token; workers are handed a
+# picklable Sender holding the address and token, and push
+# [token, payload frames...] over a PUSH socket they keep open for the life
+# of the process. Payloads use the ntangle wire protocol, so numpy arrays are
+# sent as raw frames.
+
+import os
+import uuid
+import asyncio
+import tempfile
+import threading
+import multiprocessing.util
+
+import zmq
+import zmq.asyncio
+
+from . import protocol
+
+# ms a worker waits on exit for unsent results
+EXIT_LINGER = 1000
+
+
+# loop side of the channel
+class Receiver:
+    def __init__(self, address=None, context=None):
+        if address is None:
+            address = 'ipc://' + os.path.join(
+                tempfile.gettempdir(),
+                'ntangle-results-{}-{}'.format(os.getpid(), uuid.uuid4().hex))
+
+        self.__should_destroy_context = context is None
+        self.__context = context or zmq.asyncio.Context()
+        self.__socket = self.__context.socket(zmq.PULL)
+        # nothing queued for us is worth waiting for on exit
+        self.__socket.setsockopt(zmq.LINGER, 0)
+        self.__socket.bind(address)
+        self.address = self.__socket.getsockopt_string(zmq.LAST_ENDPOINT)
+
+        self.__queues = {}
+        self.__reader = None
+
+    # start a new stream of results
+    # returns (Sender for the worker, asyncio.Queue the results arrive on)
+    def open(self):
+        if self.__reader is None or self.__reader.done():
+            self.__reader = asyncio.ensure_future(self.__read())
+
+        token = uuid.uuid4().hex
+        queue = asyncio.Queue()
+        self.__queues[token] = queue
+        return Sender(self.address, token), queue
+
+    # stop routing results of a stream, late arrivals are dropped
+    def close(self, sender):
+        self.__queues.pop(sender.token, None)
+
+    # stop reading and release the socket
+    def stop(self):
+        if self.__reader is not None:
+            self.__reader.cancel()
+            self.__reader = None
+
+        self.__queues.clear()
+        self.__socket.close(linger=0)
+        if self.__should_destroy_context:
+            self.__context.term()
+
+    async def __read(self):
+        while True:
+            frames = await self.__socket.recv_multipart(copy=False)
+            queue = self.__queues.get(bytes(frames[0]).decode('ascii'))
+            if queue is not None:
+                queue.put_nowait(protocol.loads(frames[1:]))
+
+    def __len__(self):
+        return len(self.__queues)
+
+    def __repr__(self):
+        return '<ntangle receiver @ {}>'.format(self.address)
+
+
+# per-process PUSH sockets, by address
+_sockets = {}
+_sockets_pid = None
+_sockets_lock = threading.Lock()
+_context = None
+
+
+# flush unsent results before the process exits
+def _close_sockets():
+    for socket in _sockets.values():
+        socket.close(linger=EXIT_LINGER)
+    _sockets.clear()
+    _context.term()
+
+
+def _push_socket(address):
+    global _sockets_pid, _context
+
+    with _sockets_lock:
+        # sockets inherited over a fork belong to the parent
+        if _sockets_pid != os.getpid():
+            _sockets.clear()
+            _context = zmq.Context()
+            _sockets_pid = os.getpid()
+            # multiprocessing children skip atexit, but run these
+            multiprocessing.util.Finalize(None, _close_sockets, exitpriority=10)
+
+        socket = _sockets.get(address)
+        if socket is None:
+            socket = _sockets[address] = _context.socket(zmq.PUSH)
+            socket.connect(address)
+        return socket
+
+
+# worker side of the channel, with the put_nowait interface of a queue
+class Sender:
+    __slots__ = ('address', 'token')
+
+    def __init__(self, address, token):
+        self.address = address
+        self.token = token
+
+    def __getstate__(self):
+        return (self.address, self.token)
+
+    def __setstate__(self, state):
+        self.address, self.token = state
+
+    def put_nowait(self, obj):
+        frames = [self.token.encode('ascii')] + protocol.dumps(obj)
+        _push_socket(self.address).send_multipart(frames, copy=False)
+
+    put = put_nowait
+
+    def __repr__(self):
+        return '<ntangle sender {} @ {}>'.format(self.token, self.address)
@@ -1,29 +1,79 @@
 
 # ntangle client
 
+import os
 import zmq
 import msgpack
 import functools
+import threading
 import sys
 
+from . import shm
+from . import protocol
+
 
 # something happened on the remote
 class RemoteError(Exception):
     pass
 
+# queue up several calls and send them off together
+# e.g. batch = client.batch(); batch.foo(1); batch.bar(x=2); a, b = batch.execute()
+class Batch:
+    def __init__(self, send, listing=None, **defaults):
+        self.__send = send
+        self.__names = None if listing is None else set(fn['name'] for fn in listing)
+        self.__defaults = defaults
+        self.calls = []
+
+    def __queue(self, func, *args, **kwargs):
+        merged = dict(self.__defaults)
+        merged.update(kwargs)
+        self.calls.append({'func': func, 'args': args, 'kwargs': merged})
+        # position of this call's result in execute()
+        return len(self.calls) - 1
+
+    # send every queued call, returning their results in order
+    def execute(self):
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+        return self.__send(calls)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or (self.__names is not None and name not in self.__names):
+            raise AttributeError(name)
+        return functools.partial(self.__queue, name)
+
 # client class to proxy a remote object
 class Client:
     remote = ""
     listing = []
     timeout = None
+    shm_dir = None
+    shm_threshold = shm.DEFAULT_THRESHOLD
+    # set while a call is waiting on the socket; a REQ socket left waiting
+    # (e.g. after a timeout) cannot send again
+    broken = False
+    # process the client was created in
+    pid = None
     __socket = None
     __context = None
     __should_destroy_context = False
 
     # set up the object
-    def __init__(self, remote, context=None, timeout=None):
+    # large arrays are passed through shm_dir (a tmpfs directory shared with
+    # the server) instead of being pickled, if the directory is usable
+    def __init__(self, remote, context=None, timeout=None, shm_dir=None,
+                 shm_threshold=shm.DEFAULT_THRESHOLD):
         self.remote = remote
         self.timeout = timeout
+        self.pid = os.getpid()
+        self.shm_threshold = shm_threshold
+        if shm.usable_directory(shm_dir):
+            self.shm_dir = shm_dir
 
         # if we don't have a zmq context, create a new one
         if context is None:
@@ -43,6 +93,10 @@ class Client:
         self.__refresh_remote()
 
     def __del__(self):
+        # sockets inherited over a fork belong to the parent
+        if self.pid != os.getpid():
+            return
+
         self.__socket.close()
 
         # clean up the socket so we don't hang the program
@@ -58,20 +112,35 @@ class Client:
         if kwargs is not None:
             payload['kwargs'] = kwargs
 
+        # move large arrays into shared memory, and ask for the same back
+        exported = []
+        if self.shm_dir is not None:
+            payload['shm'] = True
+            payload['args'], exported = shm.pack(
+                payload.get('args', ()), self.shm_dir, self.shm_threshold)
+            payload['kwargs'], more = shm.pack(
+                payload.get('kwargs', {}), self.shm_dir, self.shm_threshold)
+            exported += more
+
         # send off
-        self.__socket.send_pyobj(payload)
+        self.broken = True
+        protocol.send(self.__socket, payload)
 
         msg = {}
         if self.timeout is None:
             # wait back from the server
-            msg = self.__socket.recv_pyobj()
+            msg = protocol.recv(self.__socket)
         else:
             poller = zmq.Poller()
             poller.register(self.__socket, zmq.POLLIN)
             if poller.poll(self.timeout):
-                msg = self.__socket.recv_pyobj()
+                msg = protocol.recv(self.__socket)
             else:
+                # the server may never pick these up
+                for desc in exported:
+                    shm.discard(desc)
                 raise IOError('Connection to codex_hash dropped')
+        self.broken = False
 
         if msg['success']:
             if 'stdout' in msg:
@@ -80,6 +149,8 @@ class Client:
                 #sys.stdout.flush()
             if 'exception' in msg and msg['exception'] is not None:
                 raise msg['exception']
+            if msg.get('shm', False):
+                return shm.unpack(msg['return'], self.shm_dir)
             return msg['return']
         else:
             raise RemoteError(msg['error'])
@@ -95,6 +166,11 @@ class Client:
     def _shutdown(self):
         return self.__call('#shutdown')
 
+    # start a batch of calls that go out in a single round trip.
+    # keyword arguments are passed to every call in the batch
+    def batch(self, **defaults):
+        return Batch(functools.partial(self.__call, '#batch'), self.listing, **defaults)
+
     # make this more easily debuggable
     def __repr__(self):
         return '<ntangle client object @ {}>'.format(self.remote)
@@ -104,3 +180,59 @@ class Client:
             if fn['name'] == name:
                 return functools.partial(self.__call, name)
         raise AttributeError(name)
+
+
+# idle clients of this process, by endpoint, handed out to one user at a time
+# clients = ClientPool(); client = clients.acquire(remote); ...; clients.release(client)
+class ClientPool:
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self.__idle = {}
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+
+    # a connected client, reused if one is idle
+    def acquire(self, remote, timeout=None, shm_dir=None):
+        self.__check_fork()
+
+        key = (remote, timeout, shm_dir)
+        with self.__lock:
+            idle = self.__idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+
+        # connecting waits on the listing, so not under the lock
+        client = Client(remote, timeout=timeout, shm_dir=shm_dir)
+        client.pool_key = key
+        return client
+
+    # hand a client back once its user is done with it
+    def release(self, client):
+        self.__check_fork()
+        if client.broken or client.pid != os.getpid():
+            return
+
+        with self.__lock:
+            idle = self.__idle.setdefault(client.pool_key, [])
+            if len(idle) < self.max_idle:
+                idle.append(client)
+
+    # idle clients, over every endpoint
+    def __len__(self):
+        self.__check_fork()
+        return sum(len(idle) for idle in self.__idle.values())
+
+    # clients inherited over a fork share their sockets with the parent,
+    # so the child starts over (the lock may have been held at the fork too)
+    def __check_fork(self):
+        if self.__pid != os.getpid():
+            self.__idle = {}
+            self.__lock = threading.Lock()
+            self.__pid = os.getpid()
+
+    def __repr__(self):
+        return '<ntangle client pool, {} idle>'.format(len(self))
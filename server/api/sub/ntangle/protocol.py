@@ -0,0 +1,97 @@
+##
+# Wire protocol for ntangle messages
+#
+# A message is a list of ZMQ frames. The first frame is the msgpack encoded
+# payload; every numpy array in the payload is replaced by a reference to a
+# following frame that holds the raw array buffer, so arrays are neither
+# pickled nor copied into the header (send with copy=False). Objects msgpack
+# can't represent (exceptions, sklearn models, sets...) fall back to pickle.
+
+import pickle
+import msgpack
+
+import numpy as np
+
+from .shm import SharedArray
+
+# extension type codes
+ARRAY_EXT = 1    # [frame index, dtype, shape]
+SCALAR_EXT = 2   # [dtype, raw bytes]
+TUPLE_EXT = 3    # packed list of items
+SHARED_EXT = 4   # [path, dtype, shape] of a shm.SharedArray
+PICKLE_EXT = 5   # pickled object
+
+
+def _plain_array(obj):
+    return (isinstance(obj, np.ndarray) and not obj.dtype.hasobject
+            and obj.dtype.fields is None)
+
+
+# encode a payload into a list of frames
+def dumps(obj):
+    frames = [None]
+
+    def packb(o):
+        # strict types so tuples and numpy scalars reach default()
+        return msgpack.packb(
+            o, default=default, use_bin_type=True, strict_types=True)
+
+    def default(o):
+        if _plain_array(o):
+            arr = np.ascontiguousarray(o)
+            frames.append(arr)
+            return msgpack.ExtType(
+                ARRAY_EXT, packb([len(frames) - 1, arr.dtype.str, list(arr.shape)]))
+        if isinstance(o, np.generic) and not o.dtype.hasobject and o.dtype.fields is None:
+            return msgpack.ExtType(SCALAR_EXT, packb([o.dtype.str, o.tobytes()]))
+        if type(o) is tuple:
+            return msgpack.ExtType(TUPLE_EXT, packb(list(o)))
+        if isinstance(o, SharedArray):
+            return msgpack.ExtType(
+                SHARED_EXT, packb([o.path, o.dtype, list(o.shape)]))
+        return msgpack.ExtType(
+            PICKLE_EXT, pickle.dumps(o, protocol=pickle.HIGHEST_PROTOCOL))
+
+    frames[0] = packb(obj)
+    return frames
+
+
+# decode a list of frames (bytes or zmq.Frame) into a payload
+def loads(frames):
+    buffers = [f.buffer if hasattr(f, 'buffer') else memoryview(f) for f in frames]
+
+    def unpackb(data):
+        return msgpack.unpackb(
+            data, ext_hook=ext_hook, raw=False, strict_map_key=False)
+
+    def ext_hook(code, data):
+        if code == ARRAY_EXT:
+            index, dtype, shape = unpackb(data)
+            dtype = np.dtype(dtype)
+            if 0 in shape:
+                return np.empty(shape, dtype=dtype)
+            # read-only view onto the received frame
+            return np.frombuffer(buffers[index], dtype=dtype).reshape(shape)
+        if code == SCALAR_EXT:
+            dtype, raw = unpackb(data)
+            return np.frombuffer(raw, dtype=np.dtype(dtype))[0]
+        if code == TUPLE_EXT:
+            return tuple(unpackb(data))
+        if code == SHARED_EXT:
+            path, dtype, shape = unpackb(data)
+            return SharedArray(path, dtype, tuple(shape))
+        if code == PICKLE_EXT:
+            return pickle.loads(data)
+        return msgpack.ExtType(code, data)
+
+    return unpackb(buffers[0])
+
+
+# send a payload over a zmq socket
+def send(socket, obj):
+    return socket.send_multipart(dumps(obj), copy=False)
+
+
+# receive a payload from a zmq socket
+def recv(socket):
+    return loads(socket.recv_multipart(copy=False))
@@ -3,12 +3,18 @@
 # @author Patrick Kage
 
 import zmq
+import sys
+import collections
 import msgpack
+import threading
 from termcolor import colored
-from contextlib import redirect_stdout
+from contextlib import contextmanager
 from io import StringIO
 import traceback
 
+from . import shm
+from . import protocol
+
 # function decorator to expose methods
 # use @expose('func name')
 def expose(name, desc=None):
@@ -20,6 +26,9 @@ def expose(name, desc=None):
         return func
     return register_wrapper
 
+# first message of a handler thread to the broker, see Server.listen
+READY = b'READY'
+
 # convert a connect uri to a bind uri
 def convert_uri_to_bind(connect):
     return connect.replace('localhost', '*')
@@ -55,21 +64,66 @@ class Logger:
         self.log(text, level="warn")
 
 
+# stdout replacement that can capture per thread, since redirect_stdout
+# swaps sys.stdout for every handler thread at once
+class ThreadStdout:
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def __target(self):
+        stream = getattr(self.local, 'stream', None)
+        return stream if stream is not None else self.fallback
+
+    def write(self, text):
+        return self.__target().write(text)
+
+    def flush(self):
+        return self.__target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+# capture anything the current thread prints into stream
+@contextmanager
+def capture_stdout(stream):
+    if not isinstance(sys.stdout, ThreadStdout):
+        sys.stdout = ThreadStdout(sys.stdout)
+    proxy = sys.stdout
+    proxy.local.stream = stream
+    try:
+        yield stream
+    finally:
+        proxy.local.stream = None
+
 # server class
 class Server:
     module = ""
     methods = {}
     wrapped = None
+    shm_dir = None
+    shm_threshold = shm.DEFAULT_THRESHOLD
+    __replies = None
     __context = None
     __socket = None
     __log = None
     __debug = False
+    __stopping = None
 
     # construct the server
-    def __init__(self, wrapped, context=None, logging=True, debug=True):
+    def __init__(self, wrapped, context=None, logging=True, debug=True,
+                 shm_dir=None, shm_threshold=shm.DEFAULT_THRESHOLD,
+                 shm_ttl=shm.DEFAULT_TTL):
         # logging!
         self.__log = Logger(logging)
 
+        # large array replies go through shared memory for clients that ask.
+        # Those a client never collects are removed after shm_ttl seconds
+        self.shm_threshold = shm_threshold
+        if shm.usable_directory(shm_dir):
+            self.shm_dir = shm_dir
+        self.__replies = shm.ReplySegments(shm_ttl)
+
         # debug mode?
         self.__debug = debug
 
@@ -94,8 +148,10 @@ class Server:
         else:
             self.__context = zmq.Context()
 
-        # create the socket
-        self.__socket = self.__context.socket(zmq.REP)
+        # create the socket. requests are routed to a pool of handler
+        # threads, see listen()
+        self.__socket = self.__context.socket(zmq.ROUTER)
+        self.__stopping = threading.Event()
         self.__log('created socket')
 
     def __del__(self):
@@ -103,6 +159,10 @@ class Server:
         self.__socket.close()
 
     def __shorten_repr(self, obj, limit=10):
+        # repr of a large array can take seconds (see np.set_printoptions)
+        if hasattr(obj, 'shape') and hasattr(obj, 'dtype'):
+            return '<{} array {}>'.format(obj.dtype, obj.shape)
+
         text = repr(obj)
         if len(text) < limit:
             return text
@@ -134,7 +194,7 @@ class Server:
         rv = None
 
         # make the wrapped call
-        with redirect_stdout(stdout):
+        with capture_stdout(stdout):
             try:
                 rv = getattr(self.wrapped, desc['field'])(*args, **kwargs)
             except Exception as e:
@@ -147,45 +207,157 @@ class Server:
         desc = [{"name": key} for key in self.methods]
         return desc
 
-    def listen(self, bind_addr):
-        # bind the socket
-        self.__socket.bind(bind_addr)
-        self.__log('serving on {}'.format(bind_addr))
-
-        shouldStop = False
-
-        # listen for requests
-        while not shouldStop:
-            # wait for message
-            message = self.__socket.recv_pyobj()
-
-            # unpack the request
-            reply = {'success': False}
-
-            try:
-                # check if the message is reserved, otherwise call the underlying object
-                if message['func'] == '#listing':
-                    self.__log('serving listing')
-                    reply['return'] = self.get_listing()
-                elif message['func'] == '#shutdown':
-                    self.__log('shutting down the server', level='warn')
-                    shouldStop = True
-                    reply['return'] = True
-                else:
+    # handle a single request, returning the reply
+    def handle(self, message):
+        reply = {'success': False}
+
+        try:
+            # check if the message is reserved, otherwise call the underlying object
+            if message['func'] == '#listing':
+                self.__log('serving listing')
+                reply['return'] = self.get_listing()
+            elif message['func'] == '#shutdown':
+                self.__log('shutting down the server', level='warn')
+                self.__stopping.set()
+                reply['return'] = True
+            elif message['func'] == '#batch':
+                if message.get('shm', False):
+                    message['args'] = shm.unpack(message['args'], self.shm_dir)
+
+                calls = message['args'][0]
+                self.__log('serving batch of {} calls'.format(len(calls)))
+
+                # stop at the first failure, like the calls would one by one
+                results = []
+                stdout = []
+                excep = None
+                for call in calls:
+                    rv, excep, out = self.call(call['func'], call['args'], call['kwargs'])
+                    stdout.append(out)
+                    if excep is not None:
+                        break
+                    results.append(rv)
+
+                reply['return'], reply['exception'], reply['stdout'] = results, excep, ''.join(stdout)
+
+                if message.get('shm', False) and self.shm_dir is not None:
+                    reply['return'], exported = shm.pack(reply['return'], self.shm_dir, self.shm_threshold)
+                    self.__replies.add(exported)
+                    reply['shm'] = True
+            else:
+                if message.get('shm', False):
+                    message['args'] = shm.unpack(message['args'], self.shm_dir)
+                    message['kwargs'] = shm.unpack(message['kwargs'], self.shm_dir)
+
+                if self.__log.logging:
                     self.__log('serving {}({}, {})'.format(
                         message['func'],
                         ', '.join([self.__shorten_repr(a) for a in message['args']]),
                         ', '.join('{}={}'.format(k, self.__shorten_repr(message['kwargs'][k])) for k in message['kwargs'])
                     ))
 
-                    reply['return'], reply['exception'], reply['stdout'] = self.call(message['func'], message['args'], message['kwargs'])
-                reply['success'] = True
-            except Exception as e:
-                if not self.__debug:
-                    reply['error'] = str(e)
-                    self.__log('failed {}'.format(str(e)), level='error')
-                else:
-                    raise
-
-            # pow! reply
-            self.__socket.send_pyobj(reply)
+                reply['return'], reply['exception'], reply['stdout'] = self.call(message['func'], message['args'], message['kwargs'])
+
+                if message.get('shm', False) and self.shm_dir is not None:
+                    reply['return'], exported = shm.pack(reply['return'], self.shm_dir, self.shm_threshold)
+                    self.__replies.add(exported)
+                    reply['shm'] = True
+            reply['success'] = True
+        except Exception as e:
+            reply['error'] = str(e)
+            self.__log('failed {}'.format(str(e)), level='error')
+            if self.__debug:
+                # a handler thread can't take the whole server down, so
+                # just make noise about it
+                traceback.print_exc()
+
+        return reply
+
+    # handler thread: tell the broker it is ready, then answer the requests
+    # it is handed, see listen()
+    def __serve(self, backend_addr):
+        socket = self.__context.socket(zmq.REQ)
+        socket.connect(backend_addr)
+        socket.send(READY)
+
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+
+        try:
+            while not self.__stopping.is_set():
+                if not poller.poll(100):
+                    continue
+
+                # [client address, empty frame, message frames...]
+                frames = socket.recv_multipart(copy=False)
+                message = protocol.loads(frames[2:])
+
+                # pow! reply, which also marks this worker ready again
+                socket.send_multipart(
+                    frames[:2] + protocol.dumps(self.handle(message)),
+                    copy=False)
+        finally:
+            socket.close()
+
+    def listen(self, bind_addr, workers=1):
+        # bind the socket
+        self.__socket.bind(bind_addr)
+        self.__log('serving on {} with {} workers'.format(bind_addr, workers))
+
+        # segments of a previous server, or of clients, that are gone
+        if self.shm_dir is not None:
+            removed = shm.remove_stale(self.shm_dir)
+            if removed:
+                self.__log('removed {} stale shared memory segments'.format(removed))
+
+        # each request goes to a worker that is idle, the one idle longest
+        # first, so a slow call only holds up its own worker. Requests
+        # wait in the client socket while every worker is busy.
+        backend_addr = 'inproc://ntangle-workers-{}'.format(id(self))
+        backend = self.__context.socket(zmq.ROUTER)
+        backend.bind(backend_addr)
+
+        self.__stopping.clear()
+        threads = []
+        for _ in range(max(1, workers)):
+            thread = threading.Thread(target=self.__serve, args=(backend_addr, ))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        idle = collections.deque()
+
+        busy_poller = zmq.Poller()
+        busy_poller.register(backend, zmq.POLLIN)
+        poller = zmq.Poller()
+        poller.register(backend, zmq.POLLIN)
+        poller.register(self.__socket, zmq.POLLIN)
+
+        # [worker address, empty frame, READY] when a worker starts,
+        # [worker address, empty frame, client address, empty frame,
+        # reply frames...] when it answers
+        def from_worker():
+            frames = backend.recv_multipart(copy=False)
+            idle.append(frames[0].bytes)
+            if len(frames) > 3:
+                self.__socket.send_multipart(frames[2:], copy=False)
+
+        try:
+            while not self.__stopping.is_set():
+                events = dict((poller if idle else busy_poller).poll(100))
+                if backend in events:
+                    from_worker()
+                if self.__socket in events:
+                    request = self.__socket.recv_multipart(copy=False)
+                    backend.send_multipart(
+                        [idle.popleft(), b''] + request, copy=False)
+
+                self.__replies.sweep()
+
+            # make sure the shutdown acknowledgement goes out
+            for thread in threads:
+                thread.join()
+            while backend.poll(100):
+                from_worker()
+        finally:
+            backend.close()
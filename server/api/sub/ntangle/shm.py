@@ -0,0 +1,209 @@
+##
+# Shared memory transport for large numpy arrays
+#
+# Instead of pickling array payloads through the socket, the sender writes
+# each large array into a file under a tmpfs directory (e.g. /dev/shm) and
+# sends a small SharedArray descriptor in its place. The receiver maps the
+# file read-only, unlinks it, and hands back an ndarray view of the mapping,
+# so the payload is never serialized and is copied only once.
+#
+# A segment whose receiver gave up on it (a client that timed out) is never
+# unlinked by the receiver: the server sweeps the reply segments it wrote
+# once they are older than DEFAULT_TTL (see ReplySegments), and removes the
+# segments of processes that are gone when it starts (remove_stale).
+
+import os
+import mmap
+import time
+import uuid
+import threading
+import collections
+
+import numpy as np
+
+# arrays smaller than this are cheaper to pickle inline
+DEFAULT_THRESHOLD = 64 * 1024
+
+# seconds a reply segment may wait for its receiver before it is removed
+DEFAULT_TTL = 60
+
+PREFIX = 'ntangle-'
+
+
+# descriptor for an array that was placed in shared memory
+class SharedArray:
+    __slots__ = ('path', 'dtype', 'shape')
+
+    def __init__(self, path, dtype, shape):
+        self.path = path
+        self.dtype = dtype
+        self.shape = shape
+
+    def __getstate__(self):
+        return (self.path, self.dtype, self.shape)
+
+    def __setstate__(self, state):
+        self.path, self.dtype, self.shape = state
+
+    def __repr__(self):
+        return '<SharedArray {} {} @ {}>'.format(self.dtype, self.shape,
+                                                 self.path)
+
+
+# check that a directory can be used for shared memory segments
+def usable_directory(directory):
+    return directory is not None and os.path.isdir(directory) and os.access(
+        directory, os.W_OK)
+
+
+def should_share(obj, threshold=DEFAULT_THRESHOLD):
+    return (isinstance(obj, np.ndarray) and not obj.dtype.hasobject
+            and obj.nbytes >= max(threshold, 1))
+
+
+# copy an array into a new segment and describe it
+def export_array(arr, directory):
+    arr = np.ascontiguousarray(arr)
+    path = os.path.join(directory, '{}{}-{}'.format(
+        PREFIX, os.getpid(), uuid.uuid4().hex))
+
+    with open(path, 'xb') as f:
+        f.write(memoryview(arr.reshape(-1)).cast('B'))
+
+    return SharedArray(path, arr.dtype.str, arr.shape)
+
+
+# check that a descriptor names a segment within directory, as a peer could
+# otherwise have any file unlinked
+def check_path(desc, directory):
+    if directory is None or not isinstance(desc.path, str):
+        raise ValueError('no shared memory directory for {}'.format(desc))
+
+    parent, name = os.path.split(os.path.realpath(desc.path))
+    if parent != os.path.realpath(directory) or not name.startswith(PREFIX):
+        raise ValueError('{} is not a segment of {}'.format(desc.path,
+                                                            directory))
+
+
+# map a segment as a read-only array, removing its name from the directory
+def import_array(desc, directory):
+    check_path(desc, directory)
+    dtype = np.dtype(desc.dtype)
+    nbytes = dtype.itemsize * int(np.prod(desc.shape, dtype=np.int64))
+
+    fd = os.open(desc.path, os.O_RDONLY)
+    try:
+        # the mapping keeps the pages alive after the unlink
+        buf = mmap.mmap(fd, nbytes, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+        os.unlink(desc.path)
+
+    return np.frombuffer(buf, dtype=dtype).reshape(desc.shape)
+
+
+# release a segment that will never be received
+def discard(desc):
+    try:
+        os.unlink(desc.path)
+    except FileNotFoundError:
+        pass
+
+
+# replace large arrays within a payload by descriptors
+# returns the new payload and the list of descriptors that were created
+def pack(obj, directory, threshold=DEFAULT_THRESHOLD):
+    exported = []
+
+    def walk(o):
+        if should_share(o, threshold):
+            desc = export_array(o, directory)
+            exported.append(desc)
+            return desc
+        # containers are rebuilt so cached objects are never modified
+        if type(o) is dict:
+            return {k: walk(v) for k, v in o.items()}
+        if type(o) is list:
+            return [walk(v) for v in o]
+        if type(o) is tuple:
+            return tuple(walk(v) for v in o)
+        return o
+
+    try:
+        return walk(obj), exported
+    except BaseException:
+        for desc in exported:
+            discard(desc)
+        raise
+
+
+# replace descriptors within a payload by array views, refusing any
+# segment outside directory
+def unpack(obj, directory):
+    if isinstance(obj, SharedArray):
+        return import_array(obj, directory)
+    if type(obj) is dict:
+        return {k: unpack(v, directory) for k, v in obj.items()}
+    if type(obj) is list:
+        return [unpack(v, directory) for v in obj]
+    if type(obj) is tuple:
+        return tuple(unpack(v, directory) for v in obj)
+    return obj
+
+
+# remove the segments in directory left by processes that are gone
+def remove_stale(directory):
+    removed = 0
+    for name in os.listdir(directory):
+        if not name.startswith(PREFIX):
+            continue
+        try:
+            pid = int(name[len(PREFIX):].split('-')[0])
+        except ValueError:
+            continue
+        if pid == os.getpid() or process_alive(pid):
+            continue
+        try:
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# segments written for replies, removed if still there after ttl seconds
+class ReplySegments:
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.__pending = collections.deque()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def add(self, exported):
+        if exported:
+            with self.__lock:
+                self.__pending.append((time.monotonic(), exported))
+
+    # unlink the expired segments that were never received
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.__lock:
+            while self.__pending and now - self.__pending[0][0] >= self.ttl:
+                expired.extend(self.__pending.popleft()[1])
+
+        for desc in expired:
+            discard(desc)
+        return len(expired)
@@ -6,6 +6,7 @@ Brief : Read/write and file management for CODEX
 
 Notes :
 '''
+import io
 import os
 import errno
 import h5py
@@ -16,8 +17,16 @@ import logging
 import inspect
 
 import numpy as np
+import pandas as pd
 
-from collections import defaultdict
+from collections import OrderedDict
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 sys.path.insert(1, os.getenv('CODEX_ROOT'))
 
@@ -26,6 +35,17 @@ logger = logging.getLogger(__name__)
 # CODEX Support
 from api.sub.system import string2token
 from api.sub.hash import get_cache
+from api.sub.hd5 import handles
+
+# uploaded HDF5 datasets are registered with the cache, not read, see iter_hd5
+CODEX_HD5_LAZY = os.getenv('CODEX_HD5_LAZY', '1') == '1'
+
+# parsed values held at once while reading CSV, in bytes
+CODEX_CSV_CHUNK_BYTES = int(os.getenv('CODEX_CSV_CHUNK_BYTES', 16 << 20))
+
+# only empty CSV cells are missing, text such as 'NA' or 'null' is kept, as
+# csv.DictReader kept it
+CSV_NA = {'keep_default_na': False, 'na_values': ['']}
 
 
 def codex_read_csv(file, featureList, hashType, session=None):
@@ -38,49 +58,464 @@ def codex_read_csv(file, featureList, hashType, session=None):
     cache = get_cache(session, timeout=None)
     #cache.logReturnCode(inspect.currentframe())
 
-    hashList = []
-    columns = defaultdict(list)
-
     try:
-        with open(file) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                for (k, v) in row.items():
-                    columns[k].append(v)
-        f.close()
+        columns = read_csv_columns(file)
     except BaseException:
         logging.warning("codex_read_csv - cannot open file")
         return None
 
+    return hash_csv_columns(columns, featureList, hashType, cache)
+
+
+def read_csv_columns(file, chunksize=True):
+    '''
+    Inputs:
+        file (str)  - path of a CSV file with a header row
+        chunksize   - see read_csv_blocks
+
+    Outputs:
+        OrderedDict of column name to array, see CSVColumns
+
+    Notes:
+        The file is parsed by pandas in blocks of rows. The lines are
+        counted first so that the column arrays are allocated once.
+    '''
+    with open(file, 'rb') as f:
+        header = read_csv_header(f.readline())
+        if not header:
+            return OrderedDict()
+
+        start = f.tell()
+        columns = CSVColumns(header, capacity=count_lines(f))
+        f.seek(start)
+
+        for frame in read_csv_blocks(f, header, chunksize=chunksize):
+            columns.append(frame)
+
+        if columns.mixed:
+            f.seek(start)
+            columns.read_text(f)
+
+    return columns.close()
+
+
+def read_csv_header(line):
+    '''
+    Inputs:
+        line (bytes)  - first line of a CSV file
+
+    Outputs:
+        list of column names
+    '''
+    return next(csv.reader([line.decode('utf-8-sig')]), [])
+
+
+def read_csv_blocks(f, header, chunksize=True, columns=None, text=False):
+    '''
+    Inputs:
+        f               - binary file positioned after the header
+        header (list)   - column names
+        chunksize       - parse in blocks of this many rows, True to size
+                          them by CODEX_CSV_CHUNK_BYTES, False for one block
+        columns (list)  - positions of the columns to read, None for all
+        text (bool)     - keep the values as strings, missing values as nan
+
+    Outputs:
+        iterable of DataFrames, with the column positions as names
+
+    Notes:
+        Only empty cells are missing (see CSV_NA), so a column with 'NaN' or
+        'inf' is read as text, see as_numbers
+    '''
+    if chunksize is True:
+        chunksize = max(1024, CODEX_CSV_CHUNK_BYTES // (8 * len(header)))
+
+    frames = pd.read_csv(f,
+                         header=None,
+                         names=list(range(len(header))),
+                         usecols=columns,
+                         dtype=str if text else None,
+                         index_col=False,
+                         encoding='utf-8',
+                         chunksize=chunksize or None,
+                         **CSV_NA)
+    return frames if chunksize else [frames]
+
+
+def as_numbers(values):
+    '''
+    Inputs:
+        values (np array)  - column of a parsed block
+
+    Outputs:
+        the values as floats if every one is a number to float(), as 'NaN'
+        and 'inf' are, otherwise the values unchanged
+    '''
+    if values.dtype.kind != 'O':
+        return values
+
+    try:
+        return values.astype(float)
+    except (TypeError, ValueError):
+        return values
+
+
+def count_lines(f, block=1 << 24):
+    '''
+    Inputs:
+        f  - binary file, read to its end
+
+    Outputs:
+        number of lines left in the file, an upper bound on its rows
+    '''
+    lines = 0
+    last = b'\n'
+    for data in iter(lambda: f.read(block), b''):
+        lines += data.count(b'\n')
+        last = data[-1:]
+
+    return lines + (last != b'\n')
+
+
+class CSVColumns:
+    '''
+    Typed columns built from blocks of parsed CSV rows
+
+    Inputs:
+        header (list)    - column names
+        capacity (int)   - rows to allocate for up front
+
+    Notes:
+        Numeric columns are written straight into one float64 array each,
+        grown in place if capacity runs out, so reading holds little more
+        than the final arrays. A column that holds anything but numbers is
+        kept as int32 codes into the distinct values seen, rather than a
+        Python object per cell.
+
+        pandas infers the type of each block on its own, so a column with
+        text in some blocks can have numbers in others, where its original
+        text ('0', '1.50', '1e3') is lost. Such columns are listed in mixed
+        and must be read again as text with read_text, so the values do not
+        depend on where the blocks happen to split.
+
+        columns = CSVColumns(header)
+        for frame in frames:
+            columns.append(frame)
+        if columns.mixed:
+            columns.read_text(f)
+        arrays = columns.close()
+    '''
+
+    def __init__(self, header, capacity=0):
+        self.header = header
+        self.rows = 0
+        self.__capacity = capacity
+        self.__arrays = [np.empty(capacity) for _ in header]
+        # for non numeric columns, value to code and values by code
+        self.__codes = [None for _ in header]
+        self.__values = [None for _ in header]
+        # positions of the non numeric columns with numbers in some blocks
+        self.mixed = set()
+
+    def append(self, frame):
+        '''
+        Inputs:
+            frame (DataFrame)  - parsed rows, see read_csv_blocks
+        '''
+        start, stop = self.rows, self.rows + len(frame)
+        if stop > self.__capacity:
+            self.__grow(max(stop, int(self.__capacity * 1.5)))
+
+        for i in range(len(self.header)):
+            values = as_numbers(frame[i].to_numpy())
+            numeric = values.dtype.kind in 'iuf'
+
+            if self.__codes[i] is None and numeric:
+                self.__arrays[i][start:stop] = values
+                continue
+
+            if self.__codes[i] is None:
+                # blocks read so far were numbers, or all missing
+                self.__codes[i] = {}
+                self.__values[i] = []
+                numbers = self.__arrays[i][:start]
+                self.__arrays[i] = np.empty(self.__capacity, dtype=np.int32)
+                self.__encode(i, 0, numbers)
+                numeric = not np.isnan(numbers).all()
+            elif numeric:
+                numeric = not np.isnan(values.astype(float)).all()
+
+            if numeric:
+                self.mixed.add(i)
+            self.__encode(i, start, values)
+
+        self.rows = stop
+
+    def read_text(self, f, chunksize=True):
+        '''
+        Inputs:
+            f  - binary file of the rows appended, positioned after the
+                 header
+
+        Notes:
+            Reads the mixed columns again as strings, in place of the
+            values appended for them
+        '''
+        columns = sorted(self.mixed)
+        for i in columns:
+            self.__codes[i] = {}
+            self.__values[i] = []
+
+        start = 0
+        for frame in read_csv_blocks(f, self.header, chunksize=chunksize,
+                                     columns=columns, text=True):
+            for i in columns:
+                self.__encode(i, start, frame[i].to_numpy())
+            start += len(frame)
+
+        self.mixed = set()
+
+    def close(self):
+        '''
+        Outputs:
+            OrderedDict of column name to float64 array for numeric
+            columns, or object array for the others
+        '''
+        arrays = []
+        for array, values in zip(self.__arrays, self.__values):
+            array.resize(self.rows, refcheck=False)
+            if values is not None:
+                # the last entry stands for missing values, code -1
+                array = np.array(values + [np.nan], dtype=object)[array]
+            arrays.append(array)
+
+        # a repeated name keeps its last column, as csv.DictReader does
+        columns = OrderedDict((name, None) for name in self.header)
+        columns.update(zip(self.header, arrays))
+        return columns
+
+    def __encode(self, i, start, values):
+        codes, distinct = pd.factorize(values.astype(object))
+
+        known, seen = self.__codes[i], self.__values[i]
+        for value in distinct:
+            if value not in known:
+                known[value] = len(seen)
+                seen.append(value)
+
+        mapping = np.array([known[value] for value in distinct] + [-1],
+                           dtype=np.int32)
+        self.__arrays[i][start:start + len(values)] = mapping[codes]
+
+    def __grow(self, capacity):
+        for array in self.__arrays:
+            array.resize(capacity, refcheck=False)
+        self.__capacity = capacity
+
+
+def hash_csv_columns(columns, featureList, hashType, cache):
+    '''
+    Inputs:
+        columns (dict)      - column name to values, as read from CSV
+        featureList (list)  - columns to hash, None for every column
+        hashType (str)      - hash type to store the columns as
+        cache               - cache to store them in
+
+    Outputs:
+        (hashList, featureList), or None if a feature is not a column
+    '''
+    try:
+        return collect_features(
+            iter_csv_columns(columns, featureList, hashType, cache))
+    except KeyError:
+        logging.warning("codex_read_csv: Feature not found.")
+        return None
+
+
+def iter_csv_columns(columns, featureList, hashType, cache):
+    '''
+    Inputs:
+        see hash_csv_columns
+
+    Outputs:
+        generator of (done, total, name, hash) as each column is stored
+    '''
     if (featureList is None):
-        featureList = columns.keys()
+        featureList = list(columns.keys())
 
-    for feature_name in featureList:
+    for done, feature_name in enumerate(featureList, 1):
+        feature_data = np.asarray(columns[feature_name])
 
-        try:
-            feature_data = columns[feature_name][:]  # shouldn't be necessary?
-        except BaseException:
-            logging.warning("codex_read_csv: Feature not found.")
-            return None
+        # CSVColumns only returns columns it could not read as numbers as
+        # objects, there is no point trying to cast them
+        if feature_data.dtype.kind == 'O':
+            logging.info("Tokenizing {f}.".format(f=feature_name))
+            feature_data, categories = string2token(
+                feature_data, return_categories=True)
+        else:
+            feature_data, categories = as_feature(
+                feature_name, feature_data, return_categories=True)
+
+        name = feature_name.strip()
+        feature_hash = cache.hashArray(
+            name, feature_data, hashType, categories=categories)
+        yield done, len(featureList), name, feature_hash['hash']
 
-        if (isinstance(feature_data, list)):
-            feature_data = np.asarray(feature_data)
+
+def as_feature(feature_name, feature_data, return_categories=False):
+    '''
+    Inputs:
+        feature_name (str)          - name of the feature, for the log
+        feature_data (np array)     - values read from a file
+        return_categories (bool)    - also return the category table
+
+    Outputs:
+        feature_data as floats, tokenized if it holds strings, and with
+        return_categories its category table, None unless it was tokenized
+        (see string2token)
+    '''
+    categories = None
+    try:
+        feature_data = feature_data.astype(float, copy=False)
+    except BaseException:
+        logging.info("Tokenizing {f}.".format(f=feature_name))
+        feature_data, categories = string2token(
+            feature_data, return_categories=True)
+
+    if return_categories:
+        return feature_data, categories
+    return feature_data
+
+
+def collect_features(imported):
+    '''
+    Inputs:
+        imported - generator of (done, total, name, hash), see iter_csv_columns
+
+    Outputs:
+        (hashList, featureList) of every feature imported
+    '''
+    hashList = []
+    featureList = []
+    for _, _, feature_name, feature_hash in imported:
+        featureList.append(feature_name)
+        hashList.append(feature_hash)
+
+    return hashList, featureList
+
+
+class StreamingCSV:
+    '''
+    Parses CSV into columns as the bytes of the file arrive
+
+    Notes:
+        Each block fed in is parsed up to its last complete row, the rest is
+        kept for the next block. A newline inside a quoted field does not
+        end a row, so such rows are held back, as a list of the blocks,
+        until their closing quote.
+
+        Columns with text in some blocks and numbers in others (see
+        CSVColumns) are read again from the whole file on close.
+
+        parser = StreamingCSV()
+        for chunk in chunks:
+            parser.feed(chunk)
+        columns = parser.close(path)
+    '''
+
+    def __init__(self):
+        self.header = None
+        self.__columns = None
+        # blocks after the last complete row, and the quotes they hold
+        self.__tail = []
+        self.__quotes = 0
+
+    @property
+    def rows(self):
+        return self.__columns.rows if self.__columns is not None else 0
+
+    def feed(self, data):
+        end = row_end(data, data.rfind(b'\n'), quotes=self.__quotes)
+        if end < 0:
+            self.__tail.append(data)
+            self.__quotes += data.count(b'"')
+            return
+
+        block = b''.join(self.__tail + [data[:end + 1]])
+        rest = data[end + 1:]
+        self.__tail = [rest] if rest else []
+        self.__quotes = rest.count(b'"')
+        self.__parse(block)
+
+    def close(self, path=None):
+        '''
+        Inputs:
+            path (str)  - the whole file fed in, to read mixed columns from
+
+        Outputs:
+            OrderedDict of column name to array, as read_csv_columns
+            reads them, or None if columns need reading again and there is
+            no path
+        '''
+        if self.__tail:
+            self.__parse(b''.join(self.__tail))
+            self.__tail = []
+            self.__quotes = 0
+
+        if self.__columns is None:
+            return OrderedDict()
+
+        if self.__columns.mixed:
+            if path is None:
+                return None
+            with open(path, 'rb') as f:
+                read_csv_header(f.readline())
+                self.__columns.read_text(f)
+
+        return self.__columns.close()
+
+    def __parse(self, block):
+        if self.header is None:
+            end = row_end(block, block.find(b'\n'), first=True)
+            self.header = read_csv_header(block[:end + 1 if end >= 0 else None])
+            block = block[end + 1:] if end >= 0 else b''
+            if not self.header:
+                self.header = None
+                return
+            self.__columns = CSVColumns(self.header)
+
+        if not block.strip():
+            return
 
         try:
-            feature_data = feature_data.astype(np.float)
-        except BaseException as e:
-            logging.info("Tokenizing {f}.".format(f=feature_name))
-            sys.stderr.write('{}, {}\n'.format(
-                feature_name,
-                feature_data[1] if len(feature_data) > 1 else feature_data))
-            sys.stderr.flush()
-            feature_data = string2token(feature_data)
+            frame, = read_csv_blocks(io.BytesIO(block), self.header,
+                                     chunksize=False)
+        except pd.errors.ParserError:
+            # pandas refuses a block where every row is short, like the
+            # last row of a file can be, unless it counts the fields itself
+            frame = pd.read_csv(io.BytesIO(block), header=None,
+                                encoding='utf-8', **CSV_NA).reindex(
+                                    columns=range(len(self.header)))
 
-        feature_hash = cache.hashArray(feature_name.strip(), feature_data,
-                                       hashType)
-        hashList.append(feature_hash['hash'])
+        self.__columns.append(frame)
 
-    return hashList, list(map(lambda f: f.strip(), list(featureList)))
+
+def row_end(data, end, first=False, quotes=0):
+    '''
+    Inputs:
+        data (bytes)   - CSV
+        end (int)      - position of a newline in data, or -1
+        first (bool)   - search forward for the first row end instead of
+                         backward for the last
+        quotes (int)   - quotes since the last row end before data
+
+    Outputs:
+        position of the nearest newline outside of quotes, or -1
+    '''
+    while end >= 0 and (quotes + data.count(b'"', 0, end)) % 2:
+        end = data.find(b'\n', end + 1) if first else data.rfind(b'\n', 0, end)
+
+    return end
 
 
 def traverse_datasets(hdf_file):
@@ -118,37 +553,46 @@ def codex_read_hd5(file, featureList, hashType, session=None):
     '''
     cache = get_cache(session, timeout=None)
 
-    hashList = []
-
     try:
-        f = h5py.File(file, 'r+')
-    except BaseException:
+        return collect_features(iter_hd5(file, featureList, hashType, cache))
+    except OSError:
         logging.warning("ERROR: codex_read_hd5 - cannot open file")
         return None
+    except KeyError:
+        logging.warning("Error: codex_read_hd5: Feature not found.")
+        return None
 
-    if (featureList is None):
-        featureList = list(traverse_datasets(file))
 
-    for feature_name in featureList:
-        feature_name = feature_name.strip()
+def iter_hd5(file, featureList, hashType, cache, lazy=False):
+    '''
+    Inputs:
+        see codex_read_hd5
+        lazy (bool)  - register numeric datasets with the cache instead of
+                       reading them, see CodexHash.registerHD5
 
-        try:
-            feature_data = f[feature_name][:]
-        except BaseException:
-            logging.warning("Error: codex_read_hd5: Feature not found.")
-            return
+    Outputs:
+        generator of (done, total, name, hash) as each dataset is stored
+    '''
+    with h5py.File(file, 'r') as f:
+        if (featureList is None):
+            featureList = list(traverse_datasets(file))
 
-        try:
-            feature_data = feature_data.astype(float)
-        except BaseException:
-            feature_data = string2token(feature_data)
-            logging.info("Log: codex_read_hd5: Tokenized " + feature_name)
+        for done, feature_name in enumerate(featureList, 1):
+            feature_name = feature_name.strip()
+            dataset = f[feature_name]
 
-        feature_hash = cache.hashArray(feature_name, feature_data, hashType)
-        hashList.append(feature_hash['hash'])
+            if lazy and hashType == "feature" and dataset.ndim > 0 and \
+                    dataset.dtype.kind in 'biuf':
+                feature_hash = cache.registerHD5(feature_name, file,
+                                                 feature_name)
+            else:
+                feature_data, categories = as_feature(
+                    feature_name, dataset[:], return_categories=True)
+                feature_hash = cache.hashArray(
+                    feature_name, feature_data, hashType,
+                    categories=categories)
 
-    f.close()
-    return hashList, list(featureList)
+            yield done, len(featureList), feature_name, feature_hash['hash']
 
 
 def codex_read_npy(file, featureList, hashType, session=None):
@@ -162,30 +606,208 @@ def codex_read_npy(file, featureList, hashType, session=None):
     '''
     cache = get_cache(session, timeout=None)
 
-    hashList = []
-
     try:
-        data = np.load(file)
-    except BaseException:
+        return collect_features(iter_npy(file, hashType, cache))
+    except (OSError, ValueError):
         logging.warning("ERROR: codex_read_npy - cannot open file")
         return None
 
+
+def iter_npy(file, hashType, cache):
+    '''
+    Inputs:
+        see codex_read_npy
+
+    Outputs:
+        generator of (done, total, name, hash) as each column is stored
+
+    Notes:
+        Only the header is read here. Numeric files are handed to the cache
+        by path and stored in one pass over the file, see
+        CodexHash.hashNpyColumns.
+    '''
+    data = np.load(file, mmap_mode='r')
+
     samples, features = data.shape
-    featureList = []
-    for x in range(0, features):
+    if data.dtype.kind not in 'biuf':
+        for x in range(0, features):
+            feature_name = "feature_" + str(x)
+            feature_data, categories = as_feature(
+                feature_name, data[:, x], return_categories=True)
+
+            feature_hash = cache.hashArray(
+                feature_name, feature_data, hashType, categories=categories)
+            yield x + 1, features, feature_name, feature_hash['hash']
+        return
 
-        try:
-            feature_data = data[:, x].astype(float)
-        except BaseException:
-            feature_data = string2token(data[:, x])
-            logging.info("Log: codex_read_npy: Tokenized " + feature_name)
+    records = cache.hashNpyColumns(
+        os.path.abspath(file), 0, features, hashType)
+    for x, feature_hash in enumerate(records):
+        yield x + 1, features, feature_hash['name'], feature_hash['hash']
 
-        feature_name = "feature_" + str(x)
-        featureList.append(feature_name)
-        feature_hash = cache.hashArray(feature_name, feature_data, hashType)
-        hashList.append(feature_hash['hash'])
 
-    return hashList, featureList
+def codex_read_parquet(file, featureList, hashType, session=None):
+    '''
+    Inputs:
+        file (str)          - Parquet file
+        featureList (list)  - names of the columns to read, None for all
+        hashType (str)      - hash log to store the columns in
+
+    Outputs:
+        (hashList, featureList) of the columns read, None on failure
+    '''
+    cache = get_cache(session, timeout=None)
+
+    try:
+        return collect_features(
+            iter_parquet(file, featureList, hashType, cache))
+    except ImportError:
+        logging.warning("ERROR: codex_read_parquet - pyarrow is not installed")
+        return None
+    except (OSError, ValueError):
+        logging.warning("ERROR: codex_read_parquet - cannot open file")
+        return None
+    except KeyError:
+        logging.warning("Error: codex_read_parquet: Feature not found.")
+        return None
+
+
+def iter_parquet(file, featureList, hashType, cache):
+    '''
+    Inputs:
+        see codex_read_parquet
+
+    Outputs:
+        generator of (done, total, name, hash) as each column is stored
+
+    Notes:
+        Only the columns in featureList are read, and their row groups are
+        decoded in parallel on pyarrow's thread pool.
+    '''
+    if pyarrow is None:
+        raise ImportError("pyarrow is needed to read Parquet files")
+
+    table = pyarrow.parquet.read_table(
+        file, columns=featureList, use_threads=True)
+
+    return iter_arrow_table(table, hashType, cache)
+
+
+def codex_read_arrow(file, featureList, hashType, session=None):
+    '''
+    Inputs:
+        file (str)          - Arrow IPC file or stream (.arrow, .feather)
+        featureList (list)  - names of the columns to read, None for all
+        hashType (str)      - hash log to store the columns in
+
+    Outputs:
+        (hashList, featureList) of the columns read, None on failure
+    '''
+    cache = get_cache(session, timeout=None)
+
+    try:
+        return collect_features(iter_arrow(file, featureList, hashType, cache))
+    except ImportError:
+        logging.warning("ERROR: codex_read_arrow - pyarrow is not installed")
+        return None
+    except (OSError, ValueError):
+        logging.warning("ERROR: codex_read_arrow - cannot open file")
+        return None
+    except KeyError:
+        logging.warning("Error: codex_read_arrow: Feature not found.")
+        return None
+
+
+def iter_arrow(file, featureList, hashType, cache):
+    '''
+    Inputs:
+        see codex_read_arrow
+
+    Outputs:
+        generator of (done, total, name, hash) as each column is stored
+
+    Notes:
+        The file is memory mapped, so uncompressed columns are used in
+        place and columns not in featureList are never read. Compressed
+        buffers are decompressed on pyarrow's thread pool.
+    '''
+    if pyarrow is None:
+        raise ImportError("pyarrow is needed to read Arrow files")
+
+    with pyarrow.memory_map(file) as source:
+        options = pyarrow.ipc.IpcReadOptions(use_threads=True)
+        if featureList is not None:
+            names = open_arrow(source, options).schema.names
+            missing = [name for name in featureList if name not in names]
+            if missing:
+                raise KeyError(missing[0])
+
+            options = pyarrow.ipc.IpcReadOptions(
+                use_threads=True,
+                included_fields=sorted(
+                    set(names.index(name) for name in featureList)))
+            source.seek(0)
+
+        table = open_arrow(source, options).read_all()
+
+    if featureList is not None:
+        table = table.select(featureList)
+
+    return iter_arrow_table(table, hashType, cache)
+
+
+def open_arrow(source, options):
+    '''
+    Outputs:
+        reader of an Arrow IPC file, or failing that of an IPC stream
+    '''
+    try:
+        return pyarrow.ipc.open_file(source, options=options)
+    except pyarrow.ArrowInvalid:
+        source.seek(0)
+        return pyarrow.ipc.open_stream(source, options=options)
+
+
+def iter_arrow_table(table, hashType, cache):
+    '''
+    Inputs:
+        table (pyarrow.Table)  - columns to store, in order
+
+    Outputs:
+        generator of (done, total, name, hash) as each column is stored
+    '''
+    for x, feature_name in enumerate(table.column_names):
+        feature_data, categories = as_feature(
+            feature_name, arrow_values(table.column(x)),
+            return_categories=True)
+
+        feature_hash = cache.hashArray(
+            feature_name, feature_data, hashType, categories=categories)
+        yield x + 1, table.num_columns, feature_name, feature_hash['hash']
+
+
+def arrow_values(column):
+    '''
+    Inputs:
+        column (pyarrow.ChunkedArray)  - column of a Parquet or Arrow table
+
+    Outputs:
+        numpy array of the column, with nulls as nan in numeric columns and
+        as empty strings in the others
+
+    Notes:
+        A numeric column of a single chunk without nulls is a view of its
+        Arrow buffer, not a copy
+    '''
+    if column.num_chunks == 1:
+        values = column.chunk(0).to_numpy(zero_copy_only=False)
+    else:
+        values = column.to_numpy()
+
+    if values.dtype.kind == 'O' and column.null_count:
+        values = np.where(pd.isnull(values), '', values)
+
+    return values
 
 
 def save_subset(inputHash, subsetHash, saveFilePath, session=None):
@@ -214,6 +836,8 @@ def save_subset(inputHash, subsetHash, saveFilePath, session=None):
 
     newHash = cache.hashArray(newFeatureName, data, 'feature')
 
+    # a file read lazily by this process is open read-only
+    handles.discard(saveFilePath)
     h5f = h5py.File(saveFilePath, 'w')
     h5f.create_dataset(newFeatureName, data=data)
 
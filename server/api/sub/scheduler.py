@@ -0,0 +1,294 @@
+'''
+Brief : Lanes of worker processes that requests from the front end run on
+
+Notes :
+    Requests are split into lanes so that long algorithm and workflow calls
+    cannot hold every worker while interactive calls wait behind them. Each
+    lane owns a process (or thread) pool and only hands it as many tasks as it has
+    workers. Everything else waits in the lane, in one queue per session,
+    and a free worker goes to the waiting session served longest ago. A
+    session never runs more than session_limit tasks of a lane at once.
+
+    Once queue_limit tasks are waiting, submit raises Overloaded with an
+    estimate of when to retry, instead of letting the backlog grow.
+
+    Lanes are driven from the event loop: submit, cancel and the completion
+    of tasks all run on it.
+'''
+import math
+import time
+import asyncio
+import logging
+import collections
+
+from pebble import ProcessPool, ThreadPool
+
+# weight of the latest task when averaging task durations
+DURATION_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    '''
+    Raised when a lane has too many tasks waiting
+
+    Attributes:
+        lane (str)           - name of the lane
+        retry_after (int)    - seconds after which the request may be retried
+        depth (int)          - tasks waiting in the lane
+    '''
+
+    def __init__(self, lane, retry_after, depth):
+        super().__init__(
+            'Lane {} has {} tasks waiting, retry in {}s'.format(
+                lane, depth, retry_after))
+        self.lane = lane
+        self.retry_after = retry_after
+        self.depth = depth
+
+
+class Ticket:
+    '''
+    Handle on a task submitted to a lane
+
+    Notes:
+        Has the cancel/done interface of the pool future, whether or not
+        the task has been given to a worker yet.
+    '''
+
+    def __init__(self, lane, session, function):
+        self.lane = lane
+        self.session = session
+        self.function = function
+        self.future = None
+        self.cancelled = False
+        self.submitted = time.monotonic()
+        self.started = None
+
+    def cancel(self):
+        if self.done():
+            return False
+
+        self.cancelled = True
+        if self.future is None:
+            self.lane._discard(self)
+            return True
+        return self.future.cancel()
+
+    def done(self):
+        if self.future is not None:
+            return self.future.done()
+        return self.cancelled
+
+    def __repr__(self):
+        state = 'waiting' if self.future is None else 'running'
+        if self.done():
+            state = 'done'
+        return '<ticket {} {} {}>'.format(self.lane.name, self.session, state)
+
+
+class Lane:
+    '''
+    Inputs:
+        name (str)            - name used in logs and metrics
+        workers (int)         - worker processes of the lane
+        session_limit (int)   - tasks a session may run at once
+        queue_limit (int)     - tasks that may wait before submit is refused
+        max_tasks (int)       - tasks a worker runs before it is replaced,
+                                0 to keep workers for good
+        threads (bool)        - run tasks on threads of this process
+                                instead of worker processes
+    '''
+
+    def __init__(self, name, workers, session_limit, queue_limit,
+                 max_tasks=0, threads=False):
+        self.name = name
+        self.workers = max(1, workers)
+        self.session_limit = max(1, session_limit)
+        self.queue_limit = queue_limit
+
+        pool = ThreadPool if threads else ProcessPool
+        self.pool = pool(max_workers=self.workers, max_tasks=max_tasks)
+
+        self.__waiting = collections.OrderedDict()
+        self.__running = collections.Counter()
+        # order in which sessions were last given a worker
+        self.__served = {}
+        self.__dispatched = 0
+        self.__loop = None
+
+        self.depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.duration = None
+        self.wait = None
+
+    @property
+    def running(self):
+        return sum(self.__running.values())
+
+    def submit(self, session, function):
+        '''
+        Inputs:
+            session (str)       - session the task runs for
+            function (callable) - task to run on a worker
+
+        Outputs:
+            Ticket of the task
+
+        Notes:
+            Raises Overloaded if queue_limit tasks are already waiting
+        '''
+        if self.queue_limit and self.depth >= self.queue_limit:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after(), self.depth)
+
+        self.__loop = asyncio.get_event_loop()
+
+        ticket = Ticket(self, session, function)
+        self.__waiting.setdefault(session, collections.deque()).append(ticket)
+        self.depth += 1
+        self.submitted += 1
+
+        self.__dispatch()
+        return ticket
+
+    def retry_after(self):
+        '''
+        Outputs:
+            seconds until the waiting tasks should have been given a worker
+        '''
+        duration = self.duration if self.duration is not None else 1.0
+        return max(1, int(math.ceil(duration * self.depth / self.workers)))
+
+    def metrics(self):
+        '''
+        Outputs:
+            dict describing the current load of the lane
+        '''
+        return {
+            'workers': self.workers,
+            'session_limit': self.session_limit,
+            'queue_limit': self.queue_limit,
+            'running': self.running,
+            'depth': self.depth,
+            'sessions': len(set(self.__waiting) | set(+self.__running)),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'mean_duration': self.duration,
+            'mean_wait': self.wait
+        }
+
+    def close(self):
+        self.pool.stop()
+        self.pool.join()
+
+    def _discard(self, ticket):
+        waiting = self.__waiting.get(ticket.session)
+        if waiting is None or ticket not in waiting:
+            return
+
+        waiting.remove(ticket)
+        if not waiting:
+            del self.__waiting[ticket.session]
+        self.depth -= 1
+
+    def __dispatch(self):
+        # hand waiting tasks to free workers, the session served longest
+        # ago first
+        while self.running < self.workers:
+            eligible = [
+                s for s in self.__waiting
+                if self.__running[s] < self.session_limit
+            ]
+            if not eligible:
+                return
+
+            session = min(eligible, key=lambda s: self.__served.get(s, -1))
+            waiting = self.__waiting[session]
+            ticket = waiting.popleft()
+            if not waiting:
+                del self.__waiting[session]
+            self.depth -= 1
+
+            self.__served[session] = self.__dispatched
+            self.__dispatched += 1
+
+            self.__start(ticket)
+
+    def __start(self, ticket):
+        ticket.started = time.monotonic()
+        self.wait = self.__average(self.wait,
+                                   ticket.started - ticket.submitted)
+        self.__running[ticket.session] += 1
+
+        ticket.future = self.pool.schedule(ticket.function)
+        # pool futures complete on a pebble thread, or a worker thread
+        ticket.future.add_done_callback(
+            lambda future: self.__loop.call_soon_threadsafe(
+                self.__finish, ticket))
+
+    def __finish(self, ticket):
+        self.__running[ticket.session] -= 1
+        if self.__running[ticket.session] <= 0:
+            del self.__running[ticket.session]
+            if ticket.session not in self.__waiting:
+                self.__served.pop(ticket.session, None)
+
+        if not ticket.future.cancelled():
+            self.completed += 1
+            self.duration = self.__average(self.duration,
+                                           time.monotonic() - ticket.started)
+
+        self.__dispatch()
+
+    @staticmethod
+    def __average(mean, value):
+        if mean is None:
+            return value
+        return mean + DURATION_SMOOTHING * (value - mean)
+
+    def __repr__(self):
+        return '<lane {} running {}/{}, {} waiting>'.format(
+            self.name, self.running, self.workers, self.depth)
+
+
+class Scheduler:
+    '''
+    Inputs:
+        lanes (list)      - Lanes to schedule on
+        classify (func)   - maps a request (dict) to the name of its lane
+    '''
+
+    def __init__(self, lanes, classify):
+        self.lanes = collections.OrderedDict(
+            (lane.name, lane) for lane in lanes)
+        self.classify = classify
+
+    def submit(self, request, function):
+        '''
+        Inputs:
+            request (dict)      - request from the front end
+            function (callable) - task to run on a worker
+
+        Outputs:
+            Ticket of the task
+
+        Notes:
+            Raises Overloaded if the request's lane is full
+        '''
+        lane = self.lanes[self.classify(request)]
+        try:
+            return lane.submit(request.get('sessionkey'), function)
+        except Overloaded as e:
+            logging.warning('Refused {} request: {}'.format(
+                request.get('routine'), e))
+            raise
+
+    def metrics(self):
+        return {name: lane.metrics() for name, lane in self.lanes.items()}
+
+    def close(self):
+        for lane in self.lanes.values():
+            lane.close()
@@ -16,6 +16,7 @@ import psutil
 import logging
 
 import numpy as np
+import pandas as pd
 
 CODEX_ROOT = os.getenv('CODEX_ROOT')
 sys.path.insert(1, os.getenv('CODEX_ROOT'))
@@ -34,26 +35,44 @@ def get_featureList(featureList):
     return featureList
 
 
-def string2token(feature_data):
+def string2token(feature_data, return_categories=False):
     '''
     Inuputs:
         feature_data - numpy array - feature column, of strings
+        return_categories - bool - also return the category table
 
     Outputs:
          feature_data - numpy array - feature column,
             of tokenized strings, as integers
+         categories - numpy array - distinct strings in sorted order, the
+            token of each string is its index. Only if return_categories.
+
+    Notes:
+        Values are tokenized by their string form, as str() gives it, so
+        a missing value becomes 'nan' or 'None'. Columns of strings are
+        factorized by hashing (pd.factorize) and only the distinct values
+        are sorted; anything else goes through np.unique.
 
     '''
-    feature_data_str = feature_data.astype(str)
-    feature_data = np.zeros(feature_data_str.size)
-    unique = np.unique(feature_data_str)
-    tokenMap = {}
-    for x in range(0, unique.size):
-        tokenMap[str(unique[x])] = x
+    values = np.asarray(feature_data)
+
+    if pd.api.types.infer_dtype(values, skipna=True) == "string":
+        codes, uniques = pd.factorize(values)
+        names = uniques.astype(str)
+
+        missing = codes < 0
+        if missing.any():
+            names = np.concatenate([names, values[missing].astype(str)])
+            codes[missing] = len(uniques) + np.arange(missing.sum())
 
-    for x in range(0, feature_data_str.size):
-        feature_data[x] = tokenMap[str(feature_data_str[x])]
+        categories, remap = np.unique(names, return_inverse=True)
+        tokens = remap[codes]
+    else:
+        categories, tokens = np.unique(values.astype(str), return_inverse=True)
 
+    feature_data = tokens.astype(np.float64)
+    if return_categories:
+        return feature_data, categories
     return feature_data
 
 def get_codex_memory_usage():
@@ -82,10 +101,11 @@ def codex_server_memory_check(verbose=False, session=None):
         Value returned in MB
 
     '''
-    from api.sub.hash import get_cache # defer import to try to circumvent circular import
+    # defer import to try to circumvent circular import
+    from api.sub.hash import get_cache, CODEX_CACHE_MEMORY_MB
 
     cache = get_cache(session, timeout=None)
-    allowed_ram = 4096
+    allowed_ram = CODEX_CACHE_MEMORY_MB
     current_ram = get_codex_memory_usage()
 
     if(verbose):
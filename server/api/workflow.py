@@ -192,7 +192,7 @@ def explain_this(inputHash, featureNames, dataSelections, result, session=None):
         feature_weights, feature_rank = zip(*sorted(zip(best_tree.feature_importances_, featureNames), reverse=False))
         print(feature_weights)
         print(feature_rank)
-        json_tree = export_json_tree(best_tree, featureNames[::-1], ["Main Data","Isolated Data"], proportion_tree_sums)
+        json_tree = export_json_tree(best_tree, featureNames, ["Main Data","Isolated Data"], proportion_tree_sums)
         #rotate the tree here
         rotated_tree = rotate_tree(json_tree)
 
@@ -44,8 +44,7 @@ def workflow_call(msg, result):
 
             hashList = cache.feature2hashList(featureList)
 
-            data = cache.mergeHashResults(hashList)
-            inputHash = cache.hashArray('Merged', data, "feature")
+            inputHash = cache.mergeHashView(hashList)
 
             if (inputHash != None):
                 inputHash = inputHash["hash"]
@@ -60,8 +59,7 @@ def workflow_call(msg, result):
 
             hashList = cache.feature2hashList(featureList)
 
-            data = cache.mergeHashResults(hashList)
-            inputHash = cache.hashArray('Merged', data, "feature")
+            inputHash = cache.mergeHashView(hashList)
 
             if (inputHash != None):
                 inputHash = inputHash["hash"]
@@ -76,8 +74,7 @@ def workflow_call(msg, result):
 
             hashList = cache.feature2hashList(featureList)
 
-            data = cache.mergeHashResults(hashList)
-            inputHash = cache.hashArray('Merged', data, "feature")
+            inputHash = cache.mergeHashView(hashList)
 
             if (inputHash != None):
                 inputHash = inputHash["hash"]
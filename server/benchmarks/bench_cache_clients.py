@@ -0,0 +1,79 @@
+'''
+Brief : Cost of get_cache with fresh and pooled cache clients
+
+Notes :
+    A request opens the cache several times (algorithm_call, algorithm.run,
+    downsample, label_swap, ...). Each fresh connection creates a zmq
+    context and socket and fetches the server's listing before the first
+    real call. This times get_cache followed by one findHashArray, with a
+    new Client every time and with the process' ClientPool, and the same
+    for a request that opens the cache CONNECTIONS times.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_cache_clients.py
+'''
+import os
+import sys
+import time
+import timeit
+
+import numpy as np
+
+from multiprocessing import Process
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub import hash
+from api.sub.hash import get_cache, WrappedCache, create_cache_server
+from api.sub.ntangle.client import Client
+
+SESSION = '__bench_cache_clients__'
+LOOKUPS = 500
+CONNECTIONS = 4
+
+
+def fresh():
+    cache = WrappedCache(
+        SESSION,
+        cache=Client(
+            hash.DEFAULT_CODEX_HASH_CONNECT,
+            timeout=None,
+            shm_dir=hash.CODEX_SHM_DIR))
+    cache.findHashArray('name', 'x', 'feature')
+
+
+def pooled():
+    get_cache(SESSION, timeout=None).findHashArray('name', 'x', 'feature')
+
+
+def time_per_call(func, connections=1):
+    def request():
+        for _ in range(connections):
+            func()
+
+    request()
+    return timeit.timeit(request, number=LOOKUPS) / LOOKUPS * 1e3
+
+
+def main():
+    server = Process(target=create_cache_server)
+    server.start()
+    time.sleep(1)
+
+    get_cache(SESSION, timeout=None).hashArray('x', np.random.rand(100),
+                                               'feature')
+
+    for connections in (1, CONNECTIONS):
+        print('{} connection(s): fresh {:>6.3f} ms   pooled {:>6.3f} ms'.format(
+            connections, time_per_call(fresh, connections),
+            time_per_call(pooled, connections)))
+
+    print(hash.clients, 'created', hash.clients.created, 'reused',
+          hash.clients.reused)
+
+    hash.stop_cache_server()
+    server.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Brief : Load test for the cache server with concurrent sessions
+
+Notes :
+    Starts a cache server process, then fires requests from many simulated
+    sessions at once. Every session owns one large feature; each request is
+    either a large findHashArray or a tiny get_nan call. p50/p99 latencies
+    are reported for a single handler thread (the old REQ/REP behaviour)
+    and for a pool of handler threads.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_cache_server_load.py
+'''
+import os
+import sys
+import time
+import random
+
+import numpy as np
+
+from multiprocessing import Pool, Process
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.hash import CodexHash, CODEX_SHM_DIR
+from api.sub.ntangle.client import Client
+from api.sub.ntangle.server import Server
+
+ADDRESS = 'tcp://127.0.0.1:42401'
+SESSIONS = 16
+REQUESTS = 100
+FEATURE_SIZE = 2_000_000
+LARGE_FRACTION = 0.2
+
+
+def run_server(workers):
+    server = Server(CodexHash(), logging=False, shm_dir=CODEX_SHM_DIR)
+    server.listen(ADDRESS, workers=workers)
+
+
+def run_session(index):
+    session = 'load_{}'.format(index)
+    client = Client(ADDRESS, timeout=None, shm_dir=CODEX_SHM_DIR)
+    data = np.random.rand(FEATURE_SIZE)
+    feature = client.hashArray('feature', data, 'feature', session=session)
+
+    rng = random.Random(index)
+    small, large = [], []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        if rng.random() < LARGE_FRACTION:
+            client.findHashArray(
+                'hash', feature['hash'], 'feature', session=session)
+            large.append(time.perf_counter() - start)
+        else:
+            client.get_nan(session=session)
+            small.append(time.perf_counter() - start)
+
+    return small, large
+
+
+def report(label, samples):
+    samples = np.array(samples) * 1e3
+    print('    {:<8} p50 {:>9.2f} ms   p99 {:>9.2f} ms   (n={})'.format(
+        label, np.percentile(samples, 50), np.percentile(samples, 99),
+        samples.size))
+
+
+def run(workers):
+    server = Process(target=run_server, args=(workers, ))
+    server.start()
+    time.sleep(1)
+
+    start = time.perf_counter()
+    with Pool(SESSIONS) as pool:
+        results = pool.map(run_session, range(SESSIONS))
+    elapsed = time.perf_counter() - start
+
+    Client(ADDRESS)._shutdown()
+    server.join()
+
+    print('{} handler thread(s), {} sessions, {:.2f} s total'.format(
+        workers, SESSIONS, elapsed))
+    report('get_nan', [t for small, _ in results for t in small])
+    report('large', [t for _, large in results for t in large])
+    report('all', [t for r in results for part in r for t in part])
+
+
+if __name__ == "__main__":
+    for workers in [1, int(os.getenv('CODEX_CACHE_WORKERS', 4))]:
+        run(workers)
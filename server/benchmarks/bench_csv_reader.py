@@ -0,0 +1,128 @@
+'''
+Brief : Time and peak memory of reading CSV columns, csv.DictReader vs pandas blocks
+
+Notes :
+    Writes synthetic CSVs of four float columns and one label column, then
+    reads each with read_csv_columns and converts the columns to features
+    the way iter_csv_columns does. The csv.DictReader reader this replaced
+    is run as well, up to LEGACY_ROWS rows: it holds a Python string per
+    cell and needs many times the file size.
+
+    Each read runs in a fresh process, which reports its peak resident
+    memory (from /proc, so linux only) above what it held before reading. The size of the final
+    float64 arrays is printed for comparison.
+
+    Run from the server directory, optionally with the row counts:
+        CODEX_ROOT=`pwd` python benchmarks/bench_csv_reader.py [rows ...]
+'''
+import os
+import sys
+import csv
+import time
+import tempfile
+import multiprocessing
+
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.read_data import read_csv_columns
+from api.sub.read_data import as_feature
+from api.sub.system import string2token
+
+ROWS = (1_000_000, 10_000_000, 50_000_000)
+LEGACY_ROWS = 1_000_000
+BLOCK_ROWS = 1_000_000
+FLOAT_COLUMNS = 4
+
+
+def write_csv(path, rows):
+    labels = np.array(['rock', 'soil', 'dust', 'sky'])
+
+    with open(path, 'w') as f:
+        f.write(','.join(['f{}'.format(i) for i in range(FLOAT_COLUMNS)] +
+                         ['label']) + '\n')
+        for start in range(0, rows, BLOCK_ROWS):
+            n = min(BLOCK_ROWS, rows - start)
+            block = np.random.rand(n, FLOAT_COLUMNS).astype(str)
+            label = labels[np.random.randint(0, len(labels), n)]
+            lines = np.column_stack([block, label])
+            f.write('\n'.join(','.join(line) for line in lines) + '\n')
+
+
+def legacy_read(path):
+    columns = defaultdict(list)
+
+    with open(path) as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            for (k, v) in row.items():
+                columns[k].append(v)
+
+    return [as_feature(name, np.asarray(values))
+            for name, values in columns.items()]
+
+
+def vectorized_read(path):
+    return [
+        string2token(values) if values.dtype.kind == 'O' else values
+        for values in read_csv_columns(path).values()
+    ]
+
+
+def memory_status(field):
+    # bytes of the VmRSS or VmHWM (peak) line of /proc/self/status.
+    # ru_maxrss is no good here, it keeps the parent's peak across exec
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def measure(reader, path, conn):
+    before = memory_status('VmRSS')
+    start = time.perf_counter()
+    features = reader(path)
+    elapsed = time.perf_counter() - start
+
+    conn.send((elapsed, memory_status('VmHWM') - before,
+               sum(feature.nbytes for feature in features)))
+
+
+def run(reader, path):
+    parent, child = multiprocessing.Pipe()
+    worker = multiprocessing.get_context('spawn').Process(
+        target=measure, args=(reader, path, child))
+    worker.start()
+    result = parent.recv()
+    worker.join()
+    return result
+
+
+def main():
+    rows_list = [int(rows) for rows in sys.argv[1:]] or ROWS
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in rows_list:
+            path = os.path.join(directory, '{}.csv'.format(rows))
+            write_csv(path, rows)
+            size = os.path.getsize(path)
+
+            readers = [('pandas blocks', vectorized_read)]
+            if rows <= LEGACY_ROWS:
+                readers.insert(0, ('csv.DictReader', legacy_read))
+
+            for label, reader in readers:
+                elapsed, peak, final = run(reader, path)
+                print('{:>11,} rows {:>7.1f} MB  {:<15} {:>7.2f} s   '
+                      'peak {:>8.1f} MB   arrays {:>7.1f} MB'.format(
+                          rows, size / 1e6, label, elapsed, peak / 1e6,
+                          final / 1e6))
+
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
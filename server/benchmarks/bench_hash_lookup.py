@@ -0,0 +1,78 @@
+'''
+Brief : Benchmark for CodexHash lookups as a session grows
+
+Notes :
+    Fills a single session with an increasing number of feature hashes and
+    times findHashArray (by hash and by name), feature2hashList and the
+    hashArray de-duplication check. With indexed categories the per-call
+    cost should stay flat from 10 to 100k entries.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_hash_lookup.py
+'''
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.hash import CodexHash
+
+SIZES = [10, 100, 1_000, 10_000, 100_000]
+LOOKUPS = 2_000
+
+
+def fill_session(cache, session, start, stop):
+    for x in range(start, stop):
+        cache.hashArray("feature_{}".format(x), np.array([x, x + 1.0]),
+                        "feature", session=session)
+
+
+def time_per_call(func, number=LOOKUPS):
+    return timeit.timeit(func, number=number) / number * 1e6
+
+
+def run():
+    cache = CodexHash()
+    session = '__bench_hash_lookup__'
+    cache.resetCacheList("feature", session=session)
+
+    print("{:>8} {:>14} {:>14} {:>14} {:>14}".format(
+        "entries", "by hash (us)", "by name (us)", "2hashList (us)",
+        "dedup (us)"))
+
+    filled = 0
+    for size in SIZES:
+        fill_session(cache, session, filled, size)
+        filled = size
+
+        # always look up the most recently added records, the worst case for
+        # a linear scan
+        names = ["feature_{}".format(x) for x in range(size - 10, size)]
+        hashes = [
+            cache.findHashArray("name", n, "feature", session=session)['hash']
+            for n in names
+        ]
+        existing = np.array([size - 1, size * 1.0])
+
+        by_hash = time_per_call(lambda: [
+            cache.findHashArray("hash", h, "feature", session=session)
+            for h in hashes
+        ]) / len(hashes)
+        by_name = time_per_call(lambda: [
+            cache.findHashArray("name", n, "feature", session=session)
+            for n in names
+        ]) / len(names)
+        to_list = time_per_call(
+            lambda: cache.feature2hashList(names, session=session)) / len(names)
+        dedup = time_per_call(lambda: cache.hashArray(
+            "feature_{}".format(size - 1), existing, "feature", session=session))
+
+        print("{:>8} {:>14.2f} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+            size, by_hash, by_name, to_list, dedup))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,75 @@
+'''
+Brief : Microbenchmark for hashing arrays in hashArray
+
+Notes :
+    Compares the old approach (astype(float) then a tostring() bytes copy
+    fed to sha1) with hashing the array buffer in chunks through a
+    memoryview, for each available digest, at 1M, 10M and 100M float64
+    elements. The 100M case needs about 2.5 GB of memory for the old
+    approach; set BENCH_HASH_SIZES to a comma separated list to change sizes.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_hashing.py
+'''
+import os
+import sys
+import time
+import hashlib
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.hash import hash_array, new_hasher, xxhash
+
+SIZES = [
+    int(size) for size in os.getenv('BENCH_HASH_SIZES',
+                                    '1000000,10000000,100000000').split(',')
+]
+REPEAT = 3
+
+
+def best_of(func):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def old_hash(array):
+    # what hashArray did before: two full copies, then sha1
+    array = array.astype(float)
+    return hashlib.sha1(array.tobytes() + b'name').hexdigest()
+
+
+def new_hash(array, algorithm):
+    array = np.ascontiguousarray(array, dtype=np.float64)
+    hasher = hash_array(array, new_hasher(algorithm))
+    hasher.update(b'name')
+    return hasher.hexdigest()
+
+
+def run():
+    algorithms = ['sha1', 'blake2b'] + (['xxhash'] if xxhash else [])
+
+    for size in SIZES:
+        array = np.random.rand(size)
+        mb = array.nbytes / 1024 / 1024
+        print('{:,} elements ({:.0f} MB)'.format(size, mb))
+
+        elapsed = best_of(lambda: old_hash(array))
+        print('    {:<22} {:>8.1f} ms {:>8.0f} MB/s'.format(
+            'tostring + sha1', elapsed * 1e3, mb / elapsed))
+
+        for algorithm in algorithms:
+            elapsed = best_of(lambda: new_hash(array, algorithm))
+            print('    {:<22} {:>8.1f} ms {:>8.0f} MB/s'.format(
+                'memoryview + ' + algorithm, elapsed * 1e3, mb / elapsed))
+
+        del array
+
+
+if __name__ == "__main__":
+    run()
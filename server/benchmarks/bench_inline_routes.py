@@ -0,0 +1,98 @@
+'''
+Brief : Round trip latency of quick routines, inline and on a worker process
+
+Notes :
+    Sends arrange/get and get_sessions requests through execute_request,
+    once on the interactive lane (a worker process, results over the result
+    channel) and once on the inline lane (a thread of this process, results
+    straight onto the queue), and times them until the done marker is read
+    back on the event loop.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_inline_routes.py
+'''
+import os
+import sys
+import json
+import time
+import asyncio
+import functools
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+import codex
+
+from api.sub.hash import get_cache
+
+SESSION = '__bench_inline_routes__'
+REQUESTS = 200
+MESSAGES = {
+    'arrange/get': {
+        'routine': 'arrange',
+        'activity': 'get',
+        'hashType': 'feature',
+        'name': ['x'],
+        'sessionkey': SESSION
+    },
+    'get_sessions': {
+        'routine': 'get_sessions',
+        'sessionkey': SESSION
+    }
+}
+
+
+async def request(lane, message):
+    if lane == codex.INLINE:
+        queue = asyncio.Queue()
+        sender = codex.ThreadSender(queue)
+    else:
+        sender, queue = codex.result_channel().open()
+
+    codex.scheduler.lanes[lane].submit(
+        SESSION, functools.partial(codex.execute_request, sender, message))
+    while not (await queue.get())['done']:
+        pass
+    codex.close_results(sender)
+
+
+async def run(label, lane, message):
+    message = json.dumps(message)
+
+    # warm up the lane
+    for _ in range(4):
+        await request(lane, message)
+
+    times = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await request(lane, message)
+        times.append(time.perf_counter() - start)
+
+    times = np.array(times) * 1e3
+    print('{:<26} p50 {:>7.2f} ms   p99 {:>7.2f} ms'.format(
+        label, np.percentile(times, 50), np.percentile(times, 99)))
+
+
+def main():
+    server = codex.make_cache_process()
+    server.start()
+    time.sleep(1)
+
+    cache = get_cache(SESSION, timeout=None)
+    cache.hashArray('x', np.random.rand(100), 'feature')
+
+    loop = asyncio.get_event_loop()
+    for name, message in MESSAGES.items():
+        for lane in (codex.INTERACTIVE, codex.INLINE):
+            loop.run_until_complete(
+                run('{} ({})'.format(name, lane), lane, message))
+
+    codex.scheduler.close()
+    codex.stop_cache_server()
+    server.join()
+
+
+if __name__ == "__main__":
+    main()
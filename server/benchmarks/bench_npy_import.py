@@ -0,0 +1,127 @@
+'''
+Brief : Time and peak memory of storing the columns of a .npy file in the cache
+
+Notes :
+    Writes a synthetic float64 .npy file, samples by COLUMNS features, and
+    stores every column in a local CodexHash, as import_npy does: with the
+    whole file loaded and each column copied on its own, as before, and
+    memory mapped through CodexHash.hashNpyColumns. A Fortran ordered file,
+    whose columns are kept as views of the mapping, is timed as well. The
+    np.load import needs twice the file size and is only run up to
+    LEGACY_ROWS rows.
+
+    Each import runs in a fresh process, which reports its peak resident
+    memory (from /proc, so linux only) above what it held before importing.
+    Pages of the mapped file count while they are resident, although the
+    kernel can drop them at any time; the file is read once beforehand so
+    every import starts from a warm page cache.
+
+    Run from the server directory, optionally with the row counts:
+        CODEX_ROOT=`pwd` python benchmarks/bench_npy_import.py [rows ...]
+'''
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.hash import CodexHash
+from api.sub.read_data import as_feature
+
+ROWS = (1_000_000, 10_000_000, 50_000_000)
+LEGACY_ROWS = 10_000_000
+COLUMNS = 8
+BLOCK_ROWS = 1_000_000
+SESSION = '__bench_npy_import__'
+
+
+def write_npy(path, rows, fortran=False):
+    data = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float64, shape=(rows, COLUMNS),
+        fortran_order=fortran)
+    for start in range(0, rows, BLOCK_ROWS):
+        data[start:start + BLOCK_ROWS] = np.random.rand(
+            min(BLOCK_ROWS, rows - start), COLUMNS)
+    data.flush()
+    del data
+
+
+def legacy_import(path, cache):
+    data = np.load(path)
+    for x in range(data.shape[1]):
+        name = "feature_" + str(x)
+        cache.hashArray(name, as_feature(name, data[:, x]), "feature",
+                        session=SESSION)
+
+
+def mapped_import(path, cache):
+    columns = np.load(path, mmap_mode='r').shape[1]
+    cache.hashNpyColumns(path, 0, columns, "feature", session=SESSION)
+
+
+def memory_status(field):
+    # bytes of the VmRSS or VmHWM (peak) line of /proc/self/status
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def measure(importer, path, conn):
+    # budget well above the data, nothing is evicted
+    cache = CodexHash(memory_budget=1 << 20, spill_dir='')
+    cache.resetCacheList("feature", session=SESSION)
+
+    before = memory_status('VmRSS')
+    start = time.perf_counter()
+    importer(path, cache)
+    elapsed = time.perf_counter() - start
+
+    conn.send((elapsed, memory_status('VmHWM') - before,
+               cache.getMemoryUsage(session=SESSION)["session"]))
+
+
+def run(importer, path):
+    with open(path, 'rb') as f:
+        while f.read(64 << 20):
+            pass
+
+    parent, child = multiprocessing.Pipe()
+    worker = multiprocessing.get_context('spawn').Process(
+        target=measure, args=(importer, path, child))
+    worker.start()
+    result = parent.recv()
+    worker.join()
+    return result
+
+
+def main():
+    rows_list = [int(rows) for rows in sys.argv[1:]] or ROWS
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in rows_list:
+            for fortran in (False, True):
+                path = os.path.join(directory, '{}.npy'.format(rows))
+                write_npy(path, rows, fortran)
+                size = os.path.getsize(path)
+
+                importers = [('mmap', mapped_import)]
+                if not fortran and rows <= LEGACY_ROWS:
+                    importers.insert(0, ('np.load', legacy_import))
+
+                for label, importer in importers:
+                    elapsed, peak, stored = run(importer, path)
+                    print('{:>11,} rows {:>7.1f} MB  {} {:<8} {:>7.2f} s   '
+                          'peak {:>8.1f} MB   cached {:>7.1f} MB'.format(
+                              rows, size / 1e6, 'F' if fortran else 'C',
+                              label, elapsed, peak / 1e6, stored / 1e6))
+
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
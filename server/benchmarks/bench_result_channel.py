@@ -0,0 +1,113 @@
+'''
+Brief : Round trip latency of small requests through the worker pool
+
+Notes :
+    Sends small arrange/get requests through execute_request on the
+    codex process pool and times them until the done marker is read back
+    on the event loop. This is compared for the old relay (a Manager
+    queue read by a parked executor thread) and for the ntangle result
+    channel (a PUSH/PULL socket that the event loop reads directly).
+
+    The benchmark uses its own pool, created without max_tasks, so worker
+    recycling (a fork every few requests) does not drown out the relay cost.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_result_channel.py
+'''
+import os
+import sys
+import json
+import time
+import asyncio
+import functools
+
+import numpy as np
+
+from multiprocessing import Manager
+from pebble import ProcessPool
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+import codex
+
+from api.sub.hash import get_cache
+
+SESSION = '__bench_result_channel__'
+REQUESTS = 200
+CONCURRENT = 8
+MESSAGE = json.dumps({
+    'routine': 'arrange',
+    'activity': 'get',
+    'hashType': 'feature',
+    'name': ['x'],
+    'sessionkey': SESSION
+})
+
+pool = None
+
+
+async def manager_request(manager):
+    loop = asyncio.get_event_loop()
+    queue = manager.Queue()
+    pool.schedule(
+        functools.partial(codex.execute_request, queue, MESSAGE))
+    while not (await loop.run_in_executor(None, queue.get))['done']:
+        pass
+
+
+async def channel_request(_):
+    sender, queue = codex.result_channel().open()
+    pool.schedule(
+        functools.partial(codex.execute_request, sender, MESSAGE))
+    while not (await queue.get())['done']:
+        pass
+    codex.result_channel().close(sender)
+
+
+async def timed(request, arg):
+    start = time.perf_counter()
+    await request(arg)
+    return time.perf_counter() - start
+
+
+async def run(label, request, arg):
+    # warm up the pool
+    for _ in range(CONCURRENT):
+        await request(arg)
+
+    serial = [await timed(request, arg) for _ in range(REQUESTS)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request(arg) for _ in range(REQUESTS)])
+    burst = time.perf_counter() - start
+
+    serial = np.array(serial) * 1e3
+    print('{:<16} p50 {:>7.2f} ms   p99 {:>7.2f} ms   {} at once: {:>7.0f} req/s'.
+          format(label, np.percentile(serial, 50), np.percentile(serial, 99),
+                 REQUESTS, REQUESTS / burst))
+
+
+def main():
+    global pool
+    pool = ProcessPool(max_workers=codex.throttled_cpu_count())
+
+    server = codex.make_cache_process()
+    server.start()
+    time.sleep(1)
+
+    cache = get_cache(SESSION, timeout=None)
+    cache.hashArray('x', np.random.rand(100), 'feature')
+
+    loop = asyncio.get_event_loop()
+    with Manager() as manager:
+        loop.run_until_complete(run('Manager queue', manager_request, manager))
+    loop.run_until_complete(run('result channel', channel_request, None))
+
+    pool.stop()
+    codex.scheduler.close()
+    codex.stop_cache_server()
+    server.join()
+
+
+if __name__ == "__main__":
+    main()
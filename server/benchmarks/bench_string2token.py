@@ -0,0 +1,71 @@
+'''
+Brief : Microbenchmark for tokenizing string columns in string2token
+
+Notes :
+    Tokenizes object columns of ROWS strings, with few and with many
+    distinct values and with some values missing, using string2token and
+    the per-element loop it replaced, and checks both give the same tokens.
+
+    Run from the server directory:
+        CODEX_ROOT=`pwd` python benchmarks/bench_string2token.py
+'''
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.system import string2token
+
+ROWS = 1_000_000
+
+
+def legacy_string2token(feature_data):
+    # what string2token did before: a dict of np.unique, then a Python loop
+    feature_data_str = feature_data.astype(str)
+    feature_data = np.zeros(feature_data_str.size)
+    unique = np.unique(feature_data_str)
+    tokenMap = {}
+    for x in range(0, unique.size):
+        tokenMap[str(unique[x])] = x
+
+    for x in range(0, feature_data_str.size):
+        feature_data[x] = tokenMap[str(feature_data_str[x])]
+
+    return feature_data
+
+
+def columns():
+    labels = np.array(['rock', 'soil', 'dust', 'sky'], dtype=object)
+    few = labels[np.random.randint(0, len(labels), ROWS)]
+
+    many = np.array(['id{}'.format(i)
+                     for i in np.random.randint(0, ROWS, ROWS)], dtype=object)
+
+    missing = few.copy()
+    missing[::100] = np.nan
+
+    return [('4 distinct', few), ('~630k distinct', many),
+            ('4 distinct, 1% nan', missing)]
+
+
+def timed(func, values):
+    start = time.perf_counter()
+    tokens = func(values)
+    return time.perf_counter() - start, tokens
+
+
+def main():
+    for label, values in columns():
+        legacy, expected = timed(legacy_string2token, values)
+        vectorized, tokens = timed(string2token, values)
+        assert np.array_equal(tokens, expected)
+
+        print('{:,} rows {:<20} loop {:>6.2f} s   string2token {:>6.3f} s'.format(
+            ROWS, label, legacy, vectorized))
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ U.S. Government Sponsorship acknowledged.
 '''
 import ssl
 import base64
+import tempfile
 import threading
 import datetime
 import functools
@@ -23,6 +24,8 @@ import math
 import logging
 import traceback
 import asyncio
+import collections
+import concurrent.futures
 
 # TEMP: needs refactor
 import numpy as np
@@ -30,8 +33,8 @@ import numpy as np
 from tornado import web
 from tornado import ioloop
 from tornado import websocket
-from pebble import ProcessPool, ThreadPool
-from multiprocessing import Manager, Process, cpu_count
+from pebble import ThreadPool
+from multiprocessing import Process, cpu_count
 from tornado.ioloop import IOLoop
 from zmq.error import ZMQError
 
@@ -53,100 +56,431 @@ from api.data_manager import get_data
 from api.data_manager import delete_data
 from api.data_manager import update_data
 from api.data_manager import get_data_metrics
+from api.data_manager import import_data
+from api.data_manager import get_feature_bytes
 from api.export_manager import export_contents
 from api.eta_manager import get_time_estimate
 from api.sub.system import codex_server_memory_check
 from api.sub.time_log import getTimeLogDict
+from api.sub.read_data import StreamingCSV
+from api.sub.feature_bytes import parse_selection
+from api.sub.feature_bytes import accepted_encoding
 from api.sub.hash import get_cache
 from api.sub.hash import create_cache_server
 from api.sub.hash import stop_cache_server
 from api.sub.hash import NoSessionSpecifiedError
+from api.sub.ntangle.channel import Receiver
+from api.sub.scheduler import Lane, Scheduler, Overloaded
 from api.sub.audit import initialize_auditor, MessageAuditor
+from api.sub.frames import encode_json, encode_binary, BINARY_SUBPROTOCOL
+from api.sub.frames import RowStream, stream_rows
 
 
 def throttled_cpu_count():
     return max(1, math.floor(cpu_count() * 0.75))
 
 
-# create our process pools
-executor = ProcessPool(
-    max_workers=throttled_cpu_count(), max_tasks=throttled_cpu_count() * 2)
-queuemgr = Manager()
+# scheduler lanes, see api.sub.scheduler
+#   inline       quick routines, run on threads of the server process
+#   interactive  other quick routines, on a few reserved worker processes
+#   heavy        routines that may keep a worker busy for minutes
+INLINE = 'inline'
+INTERACTIVE = 'interactive'
+HEAVY = 'heavy'
+
+# handler (msg, result) -> result or iterator of results, and its lane
+Route = collections.namedtuple('Route', ['handler', 'lane'])
+
+
+def with_root(handler):
+    return lambda msg, result: handler(msg, result, CODEX_ROOT)
+
+
+# routines by name, or by (routine, activity) where activities differ
+ROUTES = {
+    'algorithm': Route(algorithm_call, HEAVY),
+    'workflow': Route(workflow_call, HEAVY),
+    'guidance': Route(with_root(get_guidance), INLINE),
+    'save_session': Route(with_root(save_session), HEAVY),
+    'load_session': Route(with_root(load_session), HEAVY),
+    'get_sessions': Route(with_root(get_sessions), INLINE),
+    'time': Route(get_time_estimate, INLINE),
+    ('arrange', 'add'): Route(add_data, INLINE),
+    ('arrange', 'get'): Route(get_data, INLINE),
+    ('arrange', 'delete'): Route(delete_data, INLINE),
+    ('arrange', 'update'): Route(update_data, INLINE),
+    ('arrange', 'metrics'): Route(get_data_metrics, INTERACTIVE),
+    ('arrange', 'bytes'): Route(get_feature_bytes, INLINE),
+    'import': Route(import_data, HEAVY),
+    ('import', 'parsed'): Route(import_data, INLINE),
+    'export': Route(with_root(export_contents), HEAVY),
+}
+
+
+def find_route(msg):
+    '''
+    Inputs:
+        msg (dict)  - request from the front end
+
+    Outputs:
+        Route of the request, or None for an unknown routine
+    '''
+    routine = msg.get('routine')
+    route = ROUTES.get((routine, msg.get('activity')))
+    if route is None and routine != 'arrange':
+        route = ROUTES.get(routine)
+    return route
+
+
+# threads serving inline routines
+CODEX_INLINE_THREADS = int(os.getenv('CODEX_INLINE_THREADS', 4))
+
+# workers kept free of heavy routines for interactive calls
+CODEX_INTERACTIVE_WORKERS = int(os.getenv('CODEX_INTERACTIVE_WORKERS', 1))
+CODEX_HEAVY_WORKERS = int(
+    os.getenv('CODEX_HEAVY_WORKERS', throttled_cpu_count()))
+
+# heavy routines a single session may run at once
+CODEX_SESSION_LIMIT = int(
+    os.getenv('CODEX_SESSION_LIMIT', max(1, CODEX_HEAVY_WORKERS // 2)))
+
+# requests that may wait in a lane before new ones are refused
+CODEX_QUEUE_LIMIT = int(os.getenv('CODEX_QUEUE_LIMIT', 64))
+
+
+def request_lane(request):
+    '''
+    Inputs:
+        request (dict)  - request from the front end
+
+    Outputs:
+        name of the scheduler lane the request runs on
+    '''
+    route = find_route(request)
+    if route is None:
+        return INTERACTIVE
+    return route.lane
+
+
+# create our worker pools
+scheduler = Scheduler([
+    Lane(INLINE,
+         workers=CODEX_INLINE_THREADS,
+         session_limit=max(1, CODEX_INLINE_THREADS // 2),
+         queue_limit=CODEX_QUEUE_LIMIT,
+         threads=True),
+    Lane(INTERACTIVE,
+         workers=CODEX_INTERACTIVE_WORKERS,
+         session_limit=CODEX_INTERACTIVE_WORKERS,
+         queue_limit=CODEX_QUEUE_LIMIT,
+         max_tasks=CODEX_INTERACTIVE_WORKERS * 2),
+    Lane(HEAVY,
+         workers=CODEX_HEAVY_WORKERS,
+         session_limit=CODEX_SESSION_LIMIT,
+         queue_limit=CODEX_QUEUE_LIMIT,
+         max_tasks=CODEX_HEAVY_WORKERS * 2)
+], request_lane)
+
+# relays results from the pool back to the event loop, see result_channel
+results = None
+
+
+def result_channel():
+    '''
+    Outputs:
+        the process wide ntangle Receiver that workers push results to
+
+    Notes:
+        Created on first use, so it binds in the process running the IOLoop
+    '''
+    global results
+    if results is None:
+        results = Receiver()
+    return results
+
+
+class ThreadSender:
+    '''
+    put_nowait interface of a queue, for requests running on a thread of
+    this process to hand results to the event loop without the channel
+    '''
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.loop = asyncio.get_event_loop()
+        self.cancelled = False
+
+    def put_nowait(self, obj):
+        # a thread cannot be stopped from outside, so a request whose
+        # results are no longer wanted stops at the next one it sends
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, obj)
+
+    put = put_nowait
 
-fileChunks = []
+
+def open_results(request):
+    '''
+    Inputs:
+        request (dict)  - request from the front end
+
+    Outputs:
+        (sender for execute_request, asyncio.Queue the results arrive on)
+    '''
+    if request_lane(request) == INLINE:
+        queue = asyncio.Queue()
+        return ThreadSender(queue), queue
+    return result_channel().open()
+
+
+def close_results(sender):
+    if isinstance(sender, ThreadSender):
+        sender.cancelled = True
+    else:
+        result_channel().close(sender)
+
+
+class Upload:
+    '''
+    A file being received over an UploadSocket
+
+    Notes:
+        Chunks are written to a temporary file next to the destination as
+        they arrive, and it replaces the destination once the upload is
+        done. CSV files are also parsed as they arrive (see StreamingCSV),
+        so only hashing their columns is left after the last chunk.
+
+        Writing and parsing run in order on the upload's own thread, see
+        run, rather than on the IOLoop.
+    '''
+
+    def __init__(self, filename):
+        directory = os.path.join(CODEX_ROOT, "uploads")
+
+        self.filename = os.path.basename(filename)
+        self.extension = self.filename.split(".")[-1]
+        self.path = os.path.join(directory, self.filename)
+        self.file = tempfile.NamedTemporaryFile(
+            dir=directory, prefix='.' + self.filename + '.', delete=False)
+        self.received = 0
+        self.parser = StreamingCSV() if self.extension == "csv" else None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def run(self, func, *args):
+        '''
+        Outputs:
+            awaitable result of func(*args), called on the upload's thread
+            after everything submitted before it
+        '''
+        return asyncio.wrap_future(self.executor.submit(func, *args))
+
+    def write(self, data):
+        self.file.write(data)
+        self.received += len(data)
+
+        if self.parser is not None:
+            try:
+                self.parser.feed(data)
+            except Exception as e:
+                # the file is still imported whole once it is in
+                logging.warning(
+                    'Cannot parse {} while receiving it: {}'.format(
+                        self.filename, repr(e)))
+                self.parser = None
+
+    def finish(self):
+        '''
+        Outputs:
+            columns parsed while receiving a CSV, None if it was not parsed
+        '''
+        self.file.close()
+        os.replace(self.file.name, self.path)
+
+        columns = None
+        if self.parser is not None:
+            try:
+                columns = self.parser.close(self.path)
+            except Exception as e:
+                logging.warning('Cannot parse {}: {}'.format(
+                    self.filename, repr(e)))
+
+        self.executor.shutdown(wait=False)
+        return columns
+
+    def discard(self):
+        # after any write still running
+        self.executor.submit(self.__remove)
+        self.executor.shutdown(wait=False)
+
+    def __remove(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
 
 
 class UploadSocket(tornado.websocket.WebSocketHandler):
+    upload = None
+    # (Ticket, queue) of the import in progress
+    importing = None
+
     def open(self):
         logging.info("Upload Websocket opened")
 
     def check_origin(self, origin):
         return True
 
-    def on_message(self, message):
+    def on_close(self):
+        self.discard_upload()
 
-        global fileChunks
+        # nobody is left to hear about the import
+        self.cancel_import()
 
-        msg = json.loads(message)
+    def discard_upload(self):
+        # an unfinished upload is of no use to anyone
+        if self.upload is not None:
+            self.upload.discard()
+            self.upload = None
+
+    async def on_message(self, message):
+        '''
+        Notes:
+            A file is sent as a series of messages with its "filename",
+            "done": false, and the next "chunk" of the file in base64.
+            Alternatively, after a message without a chunk, the file can
+            follow in binary frames. A final message with "done": true and
+            the "sessionkey" imports the file into the session, see
+            import_upload. {"cancel": true} cancels the import.
+        '''
         result = {}
 
-        filename = msg["filename"]
-        filepath = os.path.join(CODEX_ROOT, "uploads", filename)
+        if isinstance(message, bytes):
+            if self.upload is None:
+                result['status'] = 'failure'
+                result['message'] = 'Binary frame before the upload started'
+            else:
+                upload = self.upload
+                await upload.run(upload.write, message)
+                result['status'] = 'streaming'
+                result['received'] = upload.received
+
+            self.reply(result)
+            return
 
-        if (msg["done"] == True):
+        msg = json.loads(message)
 
-            #stop_cache_server()
-            #codex_hash_server = make_cache_process()
-            #codex_hash_server.start()
+        if msg.get("cancel"):
+            if self.cancel_import():
+                return
+            result['status'] = 'failure'
+            result['message'] = 'No import in progress'
+            self.reply(result)
+            return
 
+        filename = os.path.basename(msg["filename"])
+        if self.upload is None or self.upload.filename != filename:
+            self.discard_upload()
+            self.upload = Upload(filename)
+
+        if (msg["done"] == True):
             logging.info('Finished file transfer, initiating save...')
-            cache = get_cache(msg['sessionkey'], timeout=None)
+            await self.finish_upload(msg)
+            return
 
-            f = open(filepath, 'wb')
-            for chunk in fileChunks:
-                f.write(chunk)
-            f.close()
-            fileChunks = []
+        upload = self.upload
+        if "chunk" in msg:
+            await upload.run(upload.write,
+                             base64.decodebytes(str.encode(msg["chunk"])))
+        result['status'] = 'streaming'
+        result['received'] = upload.received
 
-            fileExtension = filename.split(".")[-1]
-            try:
-                if (fileExtension == "csv"):
-                    hashList, featureList = cache.import_csv(filepath)
+        self.reply(result)
 
-                elif (fileExtension == "h5"):
-                    hashList, featureList = cache.import_hd5(filepath)
+    async def finish_upload(self, msg):
+        upload, self.upload = self.upload, None
+        columns = await upload.run(upload.finish)
 
-                elif (fileExtension == "npy"):
-                    hashList, featureList = cache.import_npy(filepath)
+        request = {
+            'routine': 'import',
+            'sessionkey': msg['sessionkey'],
+            'filename': upload.filename,
+            'path': upload.path
+        }
 
-                else:
-                    result['message'] = "Currently unsupported filetype"
-                    stringMsg = json.dumps(result)
-                    self.write_message(stringMsg)
-            except Exception as e:
-                logging.info('Unable to save file: ' + repr(e))
-                result['status'] = 'failure'
-                result['message'] = repr(e)
-            else:
-                sentinel_values = cache.getSentinelValues(featureList)
-                nan = sentinel_values["nan"]
-                inf = sentinel_values["inf"]
-                ninf = sentinel_values["ninf"]
-
-                result['status'] = 'complete'
-                result['feature_names'] = featureList
-                result["nan"] = nan
-                result["inf"] = inf
-                result["ninf"] = ninf
-                logging.info('Finished file save.')
+        # CSV parsed during the upload is imported from this process
+        if columns is not None:
+            request['activity'] = 'parsed'
+            request['data'] = columns
 
-        else:
-            contents = base64.decodebytes(str.encode(msg["chunk"]))
-            fileChunks.append(contents)
-            result['status'] = 'streaming'
+        asyncio.ensure_future(self.import_upload(request))
+
+    async def import_upload(self, request):
+        '''
+        Notes:
+            The import runs as a background request (see import_data), so
+            neither the IOLoop nor the cache server is held while the file
+            is read. Each feature imported is reported with
+            {"status": "importing", "imported": n, "total": m}, followed by
+            a final "complete", "failure" or "cancelled".
+        '''
+        sender, queue = open_results(request)
+
+        try:
+            ticket = scheduler.submit(
+                request, functools.partial(execute_request, sender, request))
+        except Overloaded as e:
+            close_results(sender)
+            result = overloaded_response(request, e)
+            result['status'] = 'failure'
+            result['message'] = result.pop('WARNING')
+            self.reply(result)
+            return
+
+        self.cancel_import()
+        self.importing = (ticket, queue)
+
+        while True:
+            response = await queue.get()
+
+            if response['done']:
+                if response.get('cancelled'):
+                    self.reply({'status': 'cancelled'})
+                break
+
+            result = response['result']
+            result.setdefault('status', 'failure')
+            if result['status'] == 'failure':
+                result['message'] = result.pop('WARNING', 'Import failed')
+
+            try:
+                self.reply(result)
+            except tornado.websocket.WebSocketClosedError:
+                break
+
+        close_results(sender)
+        if self.importing is not None and self.importing[0] is ticket:
+            self.importing = None
 
-        stringMsg = json.dumps(result)
-        self.write_message(stringMsg)
+    def cancel_import(self):
+        '''
+        Outputs:
+            True if an import was in progress
+        '''
+        if self.importing is None:
+            return False
+
+        ticket, queue = self.importing
+        self.importing = None
+        ticket.cancel()
+        queue.put_nowait({'done': True, 'cancelled': True})
+        return True
+
+    def reply(self, result):
+        if self.ws_connection is None:
+            return
+        self.write_message(encode_json(result))
 
         if result['status'] == 'failure':
             self.close()
@@ -159,41 +493,41 @@ def route_request(msg, result):
     1) just the result object, which will be directly sent to the client
     2) an iterator, which will be iterated over in the worker process and sent
        piecemeal to the client.
+
+    See ROUTES for the handler and scheduler lane of each routine.
     '''
 
-    routine = msg['routine']
-    if (routine == 'algorithm'):
-        yield algorithm_call(msg, result)
-    elif (routine == 'workflow'):
-        yield workflow_call(msg, result)
-    elif (routine == 'guidance'):
-        yield get_guidance(msg, result, CODEX_ROOT)
-    elif (routine == "save_session"):
-        yield save_session(msg, result, CODEX_ROOT)
-    elif (routine == "load_session"):
-        yield load_session(msg, result, CODEX_ROOT)
-    elif (routine == "get_sessions"):
-        yield get_sessions(msg, result, CODEX_ROOT)
-    elif (routine == 'time'):
-        yield get_time_estimate(msg, result)
-    elif (routine == 'arrange'):
-        activity = msg["activity"]
-        if (activity == "add"):
-            yield add_data(msg, result)
-        elif (activity == "get"):
-            yield get_data(msg, result)
-        elif (activity == "delete"):
-            yield delete_data(msg, result)
-        elif (activity == "update"):
-            yield update_data(msg, result)
-        elif (activity == "metrics"):
-            for metric in get_data_metrics(msg, result):
-                yield metric
-    elif (routine == 'export'):
-        yield export_contents(msg, result, CODEX_ROOT)
-    else:
+    route = find_route(msg)
+    if route is None:
         result['message'] = 'Unknown Routine'
         yield result
+        return
+
+    response = route.handler(msg, result)
+    if inspect.isgenerator(response):
+        for chunk in response:
+            yield chunk
+    else:
+        yield response
+
+
+def overloaded_response(request, error):
+    '''
+    Inputs:
+        request (dict)          - request that was refused
+        error (Overloaded)      - raised by the scheduler
+
+    Outputs:
+        response telling the front end when to retry
+    '''
+    return {
+        'routine': request.get('routine'),
+        'message': 'failure',
+        'WARNING': 'Server busy, retry in {}s'.format(error.retry_after),
+        'retry_after': error.retry_after,
+        'lane': error.lane,
+        'depth': error.depth
+    }
 
 
 def execute_request(queue, message):
@@ -203,7 +537,7 @@ def execute_request(queue, message):
     output queue.
 
     Inputs:
-        queue - Queue to write into
+        queue - Queue, or ntangle channel Sender, to write into
         message - Message from frontend
     '''
     if type(message) is str:
@@ -226,11 +560,15 @@ def execute_request(queue, message):
         with MessageAuditor(msg) as audit:
             # actually execute the function requested
             try:
+                # large responses are sent in row blocks if asked for
+                stream = RowStream(stream_rows(msg), msg)
+
                 # while the generator has more values...
                 for chunk in route_request(msg, result):
                     # ...shovel the result into a queue
                     chunk['message'] = "success"
-                    queue.put_nowait({'result': chunk, 'done': False})
+                    for part in stream.messages(chunk):
+                        queue.put_nowait({'result': part, 'done': False})
 
             except Exception as e:
                 response = {'message': 'failure'}
@@ -242,7 +580,7 @@ def execute_request(queue, message):
         sys.stderr.write('Exception caught in request: {}\n'.format(repr(e)))
         import traceback
         traceback.print_exc()
-        queue.put_nowait({result: {'message': 'failure'}, 'done': True})
+        queue.put_nowait({'result': {'message': 'failure'}, 'done': True})
 
 
 # Tornado Websocket
@@ -252,14 +590,43 @@ class CodexSocket(tornado.websocket.WebSocketHandler):
     message_handler_future = None
     future = None
     reader = None
+    binary = False
 
     def open(self):
         logging.info("{self}".format(self=self))
         logging.info("Websocket opened")
 
+        # multiplexed requests in flight, by request id
+        self.requests = {}
+
     def check_origin(self, origin):
         return True
 
+    def select_subprotocol(self, subprotocols):
+        # clients offering the binary subprotocol get array fields as binary frames
+        if BINARY_SUBPROTOCOL in subprotocols:
+            self.binary = True
+            return BINARY_SUBPROTOCOL
+        return None
+
+    def send_result(self, result, binary=False):
+        '''
+        Inputs:
+            result (dict)    - response for the front end
+            binary (bool)    - send array fields as binary frames
+
+        Notes:
+            See api.sub.frames for the binary layout
+        '''
+        if not binary:
+            self.write_message(encode_json(result))
+            return
+
+        message, frames = encode_binary(result)
+        self.write_message(message)
+        for frame in frames:
+            self.write_message(frame, binary=True)
+
     def on_response(self, response):
         self.write_message(response.result())
 
@@ -286,39 +653,121 @@ class CodexSocket(tornado.websocket.WebSocketHandler):
 
         self.queue = None
 
+        # nobody is left to read the multiplexed requests
+        for request_id in list(self.requests):
+            self.cancel_request(request_id)
+
     def on_message(self, message):
-        self.message_handler_future = asyncio.ensure_future(
-            self.handle_message(message))
+        request = json.loads(message)
+        request_id = request.get('request_id')
+
+        # requests without an id keep the one request per socket behaviour
+        if request_id is None:
+            self.message_handler_future = asyncio.ensure_future(
+                self.handle_message(message, request))
+            return
 
-    async def handle_message(self, message):
-        self.queue = queuemgr.Queue()
-        # Helpful reading about multiprocessing.Queue from Tornado: https://stackoverflow.com/a/46864186
+        if request.get('routine') == 'cancel':
+            if not self.cancel_request(request_id):
+                self.send_result({
+                    'request_id': request_id,
+                    'message': 'failure',
+                    'WARNING': 'No such request in flight',
+                    'done': True
+                })
+            return
 
-        # Essentially, the strategy is to:
-        #       1) Send a job into the process pool
-        #       2) Send another job to read the queue, as
-        #          it blocks
+        if request_id in self.requests:
+            self.send_result({
+                'request_id': request_id,
+                'message': 'failure',
+                'WARNING': 'Request id already in flight',
+                'done': True
+            })
+            return
+
+        self.requests[request_id] = {'future': None, 'queue': None}
+        asyncio.ensure_future(self.handle_message(message, request))
+
+    def cancel_request(self, request_id):
+        '''
+        Inputs:
+            request_id  - id of a multiplexed request
+
+        Outputs:
+            True if the request was in flight
+
+        Notes:
+            The worker is cancelled and the reader is woken with a
+            cancelled marker, so the socket stays open for other requests.
+        '''
+        state = self.requests.get(request_id)
+        if state is None:
+            return False
+
+        state['cancelled'] = True
+        if state['future'] is not None and not state['future'].done():
+            state['future'].cancel()
+        if state['queue'] is not None:
+            state['queue'].put_nowait({'done': True, 'cancelled': True})
+
+        return True
+
+    async def handle_message(self, message, request):
+        # The strategy is to:
+        #       1) Send a job into its scheduler lane, along with a sender
+        #          for the result channel (or, for inline routines that run
+        #          on a thread of this process, straight for the queue)
+        #       2) Await the results it pushes back, which the IOLoop reads
+        #          off the channel socket without blocking a thread
+        sender, queue = open_results(request)
 
         # start an audit of the external message
-        audit = MessageAuditor(json.loads(message))
+        audit = MessageAuditor(request)
         audit.start()
         if audit.is_enabled():
             audit.method = 'tornado:' + audit.method
 
+        binary = self.binary or bool(request.get('binary', False))
+        request_id = request.get('request_id')
+
         # print(f'Scheduling {message}')
 
-        self.future = executor.schedule(
-            functools.partial(execute_request, self.queue, message))
+        try:
+            future = scheduler.submit(
+                request, functools.partial(execute_request, sender, message))
+        except Overloaded as e:
+            # answered here, through the queue like any other response
+            future = None
+            queue.put_nowait({
+                'result': overloaded_response(request, e),
+                'done': False
+            })
+            queue.put_nowait({'done': True, 'rejected': True})
+
+        if request_id is None:
+            self.queue = queue
+            self.future = future
+        else:
+            state = self.requests[request_id]
+            state['queue'] = queue
+            state['future'] = future
+            if state.get('cancelled'):
+                self.cancel_request(request_id)
 
         # def end_task(future):
         #     logging.info(f'task done: {future}')
         # self.future.add_done_callback(end_task)
 
-        loop = asyncio.get_event_loop()
+        status = 'success'
         while True:
-            response = await loop.run_in_executor(None, self.queue.get)
+            response = await queue.get()
 
             if response['done']:
+                if response.get('cancelled'):
+                    status = 'cancelled'
+                elif response.get('rejected'):
+                    status = 'failure'
                 break
 
             result = response['result']
@@ -331,16 +780,33 @@ class CodexSocket(tornado.websocket.WebSocketHandler):
                     for k in result
                 }))
 
+            if request_id is not None:
+                result['request_id'] = request_id
+
             try:
-                self.write_message(json.dumps(response['result']))
+                self.send_result(result, binary)
             except tornado.websocket.WebSocketClosedError:
                 break
 
         audit.finish()
+        close_results(sender)
 
-        # make sure the socket gets closed
-        self.on_close()
-        self.close()
+        if request_id is None:
+            # make sure the socket gets closed
+            self.on_close()
+            self.close()
+            return
+
+        # let the client know nothing more is coming for this request
+        self.requests.pop(request_id, None)
+        try:
+            self.send_result({
+                'request_id': request_id,
+                'message': status,
+                'done': True
+            })
+        except tornado.websocket.WebSocketClosedError:
+            pass
 
 
 class GenericAPIHandler(tornado.web.RequestHandler):
@@ -374,13 +840,7 @@ class GenericAPIHandler(tornado.web.RequestHandler):
             Eventually, this API access may be folded into it's own generic
             form and re-used.
         '''
-        self.queue = queuemgr.Queue()
-        # Helpful reading about multiprocessing.Queue from Tornado: https://stackoverflow.com/a/46864186
-
-        # Essentially, the strategy is to:
-        #       1) Send a job into the process pool
-        #       2) Send another job to read the queue, as
-        #          it blocks
+        sender, self.queue = open_results(request)
 
         # start an audit of the external message
         audit = MessageAuditor(request)
@@ -388,17 +848,17 @@ class GenericAPIHandler(tornado.web.RequestHandler):
         if audit.is_enabled():
             audit.method = 'tornado_http:' + audit.method
 
-        self.future = executor.schedule(
-            functools.partial(execute_request, self.queue, request))
+        try:
+            self.future = scheduler.submit(
+                request, functools.partial(execute_request, sender, request))
+        except Overloaded as e:
+            audit.finish()
+            close_results(sender)
+            raise
 
-        loop = asyncio.get_event_loop()
         while True:
-            # Wait on reading the queue
-            self.reader = readpool.schedule(self.queue.get)
-
-            response = await loop.run_in_executor(None, self.queue.get)
-            
-            logging.info(f'RESPONSE: {response}')
+            # Wait on reading the result channel
+            response = await self.queue.get()
 
             # if we're done, there's nothing more to be read and we can stop
             if response['done']:
@@ -415,9 +875,20 @@ class GenericAPIHandler(tornado.web.RequestHandler):
                 }))
 
         audit.finish()
+        close_results(sender)
 
         return result
 
+    def send_overloaded(self, error):
+        self.set_status(503)
+        self.set_header('Retry-After', str(error.retry_after))
+        self.write(
+            json.dumps({
+                'reason': str(error),
+                'retry_after': error.retry_after,
+                'success': False
+            }))
+
     def send_failure(self, reason=None):
         self.set_status(400)
         self.write(
@@ -430,37 +901,116 @@ class GenericAPIHandler(tornado.web.RequestHandler):
 
 
 class FeatureAPIHandler(GenericAPIHandler):
+    '''
+    GET /api/feature?session=&name=[&name=...]
+
+    Optional arguments: start, stop and step of the rows to send,
+    downsample, and dtype (float32 by default).
+
+    Notes:
+        Sends the raw bytes of the features, one column after the other,
+        see api.sub.feature_bytes. The body is compressed when the request
+        accepts gzip (or zstd, with zstandard installed).
+    '''
+
     async def get(self):
         session = self.get_argument('session', None)
-        name = self.get_argument('name', None)
-        downsample = self.get_argument('downsample', None)
-
-        if name is None or session is None:
+        if session is None:
             self.send_failure()
             return
 
-        resp = await self.make_api_call({
-            'routine': 'arrange',
-            'activity': 'get',
-            'hashType': 'feature',
-            'sessionkey': session,
-            'downsample': downsample,
-            'name': [name]
-        })
+        try:
+            selection = parse_selection({
+                'name': self.get_arguments('name'),
+                'start': self.get_argument('start', None),
+                'stop': self.get_argument('stop', None),
+                'step': self.get_argument('step', None),
+                'downsample': self.get_argument('downsample', None),
+                'dtype': self.get_argument('dtype', None)
+            })
+        except ValueError as e:
+            self.send_failure(str(e))
+            return
 
-        if not 'data' in resp:
-            self.send_failure()
+        await self.send_features(session, [selection], batch=False)
+
+    async def send_features(self, session, selections, batch):
+        encoding = accepted_encoding(
+            self.request.headers.get('Accept-Encoding', ''))
+
+        try:
+            resp = await self.make_api_call({
+                'routine': 'arrange',
+                'activity': 'bytes',
+                'sessionkey': session,
+                'selections': selections,
+                'batch': batch,
+                'encoding': encoding,
+                'etag': self.request.headers.get('If-None-Match')
+            })
+        except Overloaded as e:
+            self.send_overloaded(e)
+            return
+
+        if resp.get('status') != 'success':
+            self.send_failure(resp.get('reason'))
             return
 
-        # we need to reconstruct the numpy array
-        # even though it's a column vector, it's still contiguous in memory
-        # so we can just swap here
-        arr = np.asarray(resp['data'], dtype=np.float32)
+        # the data may change under the same name, so caches revalidate
+        self.set_header('Etag', resp['etag'])
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('Vary', 'Accept-Encoding')
+
+        if resp.get('not_modified'):
+            self.set_status(304)
+            self.clear_header('Content-Type')
+            return
 
         self.set_header('X-Endianness', sys.byteorder)
-        self.set_header('X-Data-Type', 'float32')
+        if not batch:
+            self.set_header('X-Data-Type', resp['dtype'])
+            self.set_header('X-Rows', resp['rows'])
+            self.set_header('X-Columns', resp['columns'])
         self.set_header('Content-Type', 'application/octet-stream')
-        self.write(bytes(arr.data))
+        if encoding is not None:
+            self.set_header('Content-Encoding', encoding)
+        self.write(resp['data'])
+
+
+class FeaturesAPIHandler(FeatureAPIHandler):
+    '''
+    POST /api/features
+
+    Body: {"session": ..., "features": [selection, ...]} with selections
+    taking the arguments of /api/feature, "name" being a list.
+
+    Notes:
+        Sends every selection in one response, see api.sub.feature_bytes
+        for the layout.
+    '''
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body)
+            session = body['session']
+            selections = [
+                parse_selection(selection) for selection in body['features']
+            ]
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_failure(str(e))
+            return
+
+        if not selections:
+            self.send_failure('No features requested')
+            return
+
+        await self.send_features(session, selections, batch=True)
+
+
+class SchedulerAPIHandler(GenericAPIHandler):
+    def get(self):
+        # load of each lane, including the number of waiting requests
+        self.write(json.dumps(scheduler.metrics()))
 
 
 class MainHandler(tornado.web.RequestHandler):
@@ -478,6 +1028,8 @@ def make_app():
     return web.Application([
         (r"/", MainHandler),
         (r"/api/feature", FeatureAPIHandler),
+        (r"/api/features", FeaturesAPIHandler),
+        (r"/api/scheduler", SchedulerAPIHandler),
         (r"/codex", CodexSocket),
         (r"/upload", UploadSocket),
     ], **settings)
@@ -526,6 +1078,7 @@ if __name__ == '__main__':
     app.listen(8888)
     tornado.ioloop.IOLoop.instance().start()
 
-    # gracefully shut down cache server
+    # gracefully shut down the workers and cache server
+    scheduler.close()
     stop_cache_server()
     codex_hash_server.join()  # wait for process shutdown
@@ -43,10 +43,8 @@ def testData(session=None):
     hashList, featureList = codex_read_csv(CODEX_ROOT + '/uploads/doctest.csv', featureList, "feature", session=cache)
     
     # merge 1d arrays to nd-array
-    data = cache.mergeHashResults(hashList)
-    samples, features = data.shape
-
-    inputHash = cache.hashArray('Merged', data, "feature")
+    inputHash = cache.mergeHashView(hashList)
+    samples = inputHash['samples']
 
     template = np.zeros(samples)
     templateHashDictionary = cache.hashArray("template", template, "feature")
@@ -9,11 +9,16 @@ import os
 import pytest
 import sys
 
+import numpy as np
+
 sys.path.insert(1, os.getenv('CODEX_ROOT'))
 
 from api.sub.hash       import get_cache
 from api.sub.hash       import DOCTEST_SESSION
 from api.clustering     import *
+from api.algorithm_manager import algorithm_call
+from api.algorithm_manager import stream_clustering
+from api.sub.frames     import RowStream
 from fixtures           import testData
 
 def test_clustering(capsys, testData):
@@ -48,5 +53,30 @@ def test_clustering(capsys, testData):
     result = clustering(testData['inputHash'], None, testData['featureNames'], testData['hashList'], None, False, "affinity_propagation", False, {'k': 3, 'eps': 0.7, 'n_neighbors': 10, 'quantile': 0.5, 'damping': 0.9}, None, "direct", None, {}, ch).run()
     assert result['message'] == 'success'
 
+def test_clustering_stream(capsys, testData):
 
+    ch = get_cache(DOCTEST_SESSION, timeout=None)
 
+    msg = {'routine': 'algorithm', 'sessionkey': DOCTEST_SESSION, 'algorithmType': 'clustering', 'algorithmName': 'kmeans', 'parameters': {'k': 3}, 'downsampled': False, 'dataFeatures': testData['featureNames'], 'dataSelections': [], 'chunk_rows': 1000}
+    parts = algorithm_call(msg, dict(msg))
+    stream = RowStream(1000, msg)
+    messages = [m for chunk in parts for m in stream.messages(chunk)]
+
+    summary = messages[-1]
+    assert summary['final'] and summary['message'] == 'success'
+    assert summary['streamed'] == ['data', 'clusters']
+    assert [m['seq'] for m in messages] == list(range(len(messages)))
+    assert all(m['routine'] == 'algorithm' for m in messages[:-1])
+    data = np.concatenate([m['data'] for m in messages if m.get('field') == 'data'])
+    clusters = np.concatenate([m['clusters'] for m in messages if m.get('field') == 'clusters'])
+    assert data.shape[1] == 2 and len(data) == len(clusters)
+
+    # the PCA rows are sent before the clusters are fit
+    pca = {'data': data}
+    clusterer = clustering(testData['inputHash'], None, testData['featureNames'], testData['hashList'], None, False, "kmeans", False, {'k': 3}, None, "direct", None, {}, ch, False)
+    blocks = stream_clustering(pca, clusterer, 1000)
+    assert next(blocks)['offset'] == 0
+    assert not hasattr(clusterer, 'algorithm')
+    *rest, result = blocks
+    assert len(rest) == -(-len(data) // 1000) - 1
+    assert result['data'] is data and len(result['clusters']) == len(data)
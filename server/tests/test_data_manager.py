@@ -7,6 +7,7 @@ U.S. Government Sponsorship acknowledged.
 '''
 import os
 import pytest
+import numpy as np
 import sys
 
 CODEX_ROOT = os.getenv('CODEX_ROOT')
@@ -23,6 +24,33 @@ def test_get_data(capsys, testData):
 
     message = {'routine': 'arrange', 'hashType': 'feature', 'activity': 'get', 'name': ['TiO2','FeOT'], 'cid': '8vrjn', 'sessionkey': DOCTEST_SESSION}
     result = get_data(message, {})
+    tio2 = cache.findHashArray("name", "TiO2", "feature")['data']
+    assert len(result['data']) == len(tio2)
+    assert len(result['data'][0]) == 2
+
+def test_get_data_stream(capsys, testData, monkeypatch):
+
+    import api.data_manager
+    built = []
+    def counted_rows(columns, sentinels, rows=slice(None)):
+        built.append(rows)
+        return data_rows(columns, sentinels, rows)
+    monkeypatch.setattr(api.data_manager, 'data_rows', counted_rows)
+
+    message = {'routine': 'arrange', 'hashType': 'feature', 'activity': 'get', 'name': ['TiO2','FeOT'], 'sessionkey': DOCTEST_SESSION}
+    whole = get_data(message, {})['data']
+
+    # each block is built only once the one before it has been sent
+    built.clear()
+    parts = get_data(dict(message, chunk_rows=1000), {})
+    first = next(parts)
+    assert (first['field'], first['offset'], first['rows']) == ('data', 0, len(whole))
+    assert len(built) == 1
+
+    *blocks, result = [first] + list(parts)
+    assert len(built) == len(blocks) == -(-len(whole) // 1000)
+    assert 'data' not in result
+    assert np.array_equal(np.concatenate([b['data'] for b in blocks]), whole)
 
 def test_add_data(capsys, testData):
 
@@ -44,4 +72,52 @@ def test_update_data(capsys, testData):
 
     message = {'routine': 'arrange', 'hashType': 'feature', 'field': 'name', 'old': 'TiO2', 'new':'updated_name', 'cid': '8vrjn', 'sessionkey': DOCTEST_SESSION}
     result = update_data(message, {})
-    #assert result['message'] == 'success'
\ No newline at end of file
+    #assert result['message'] == 'success'
+def test_import_data(capsys, testData):
+
+    cache = get_cache(DOCTEST_SESSION, timeout=None)
+
+    data = {'imported_a': ['1', '2', 'nan'], 'imported_b': ['x', 'y', 'x']}
+    message = {'routine': 'import', 'activity': 'parsed', 'filename': 'a.csv', 'path': 'a.csv', 'data': data, 'sessionkey': DOCTEST_SESSION}
+    results = list(import_data(message, dict(message)))
+
+    assert [r['imported'] for r in results[:-1]] == [1, 2]
+    assert results[-1]['status'] == 'complete'
+    assert results[-1]['feature_names'] == ['imported_a', 'imported_b']
+    assert 'data' not in results[-1]
+    assert len(cache.findHashArray("name", "imported_b", "feature")['data']) == 3
+    assert cache.findHashArray("name", "imported_b", "feature")['categories'] == ['x', 'y']
+
+    message = {'routine': 'import', 'filename': 'a.txt', 'path': 'a.txt', 'sessionkey': DOCTEST_SESSION}
+    results = list(import_data(message, dict(message)))
+    assert results[-1]['status'] == 'failure'
+
+def test_get_feature_bytes(capsys, testData):
+
+    cache = get_cache(DOCTEST_SESSION, timeout=None)
+    tio2 = cache.findHashArray("name", "TiO2", "feature")['data']
+
+    selection = {'name': ['TiO2', 'FeOT'], 'start': 1, 'stop': 9, 'step': 2, 'downsample': None, 'dtype': 'float64'}
+    message = {'routine': 'arrange', 'activity': 'bytes', 'selections': [selection], 'sessionkey': DOCTEST_SESSION}
+    result = get_feature_bytes(message, dict(message))
+
+    assert result['status'] == 'success'
+    assert (result['columns'], result['rows']) == (2, 4)
+    data = np.frombuffer(result['data'], dtype=np.float64).reshape(2, 4)
+    assert np.array_equal(data[0], tio2[1:9:2])
+
+    message['etag'] = result['etag']
+    assert get_feature_bytes(message, dict(message))['not_modified']
+
+    # the same values as get_data, sentinels included
+    values = np.array([1.0, np.nan, np.inf, -np.inf])
+    cache.hashArray("nonfinite_a", values, "feature")
+    cache.hashArray("nonfinite_b", values[::-1].copy(), "feature")
+    names = ['nonfinite_a', 'nonfinite_b']
+    selection = {'name': names, 'start': None, 'stop': None, 'step': None, 'downsample': None, 'dtype': 'float64'}
+    message = {'routine': 'arrange', 'activity': 'bytes', 'selections': [selection], 'sessionkey': DOCTEST_SESSION}
+    result = get_feature_bytes(message, dict(message))
+    data = np.frombuffer(result['data'], dtype=np.float64).reshape(2, 4)
+
+    message = {'routine': 'arrange', 'hashType': 'feature', 'activity': 'get', 'name': names, 'sessionkey': DOCTEST_SESSION}
+    assert np.array_equal(data.T, get_data(message, {})['data'], equal_nan=True)
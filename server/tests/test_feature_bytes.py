@@ -0,0 +1,89 @@
+'''
+Brief : Tests for the raw feature data served over HTTP
+
+Copyright 2019 California Institute of Technology.  ALL RIGHTS RESERVED.
+U.S. Government Sponsorship acknowledged.
+'''
+import os
+import sys
+import gzip
+
+import numpy as np
+
+CODEX_ROOT = os.getenv('CODEX_ROOT')
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.feature_bytes import *
+
+
+def test_parse_selection(capsys):
+
+    selection = parse_selection({'name': 'x', 'start': '10', 'step': 2})
+    assert selection == {'name': ['x'], 'start': 10, 'stop': None, 'step': 2,
+                         'downsample': None, 'dtype': 'float32'}
+
+    for bad in ({}, {'name': ['x'], 'step': 0}, {'name': ['x'], 'stop': 'a'},
+                {'name': ['x'], 'dtype': 'complex64'}):
+        try:
+            parse_selection(bad)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_selection_array(capsys):
+
+    x = np.array([1.0, np.nan, np.inf, -np.inf])
+    selection = parse_selection({'name': ['x', 'y'], 'dtype': 'float64'})
+    array = selection_array([x, x], selection, (-1, -2, -3))
+
+    # sentinels go in the first column only, as get_data sends them
+    assert array.shape == (2, 4)
+    assert list(array[0]) == [1.0, -1, -2, -3]
+    assert array[1, 0] == 1.0 and np.isnan(array[1, 1])
+    assert list(array[1, 2:]) == [np.inf, -np.inf]
+    # the cache array is left alone
+    assert np.isnan(x[1])
+
+    # a missing sentinel is nan, which an int32 selection refuses
+    array = selection_array([x], selection, (-1, None, -3))
+    assert list(array[0, :2]) == [1.0, -1] and np.isnan(array[0, 2])
+    selection = parse_selection({'name': ['x', 'y'], 'dtype': 'int32'})
+    assert list(selection_array([x], selection, (-1, -2, -3))[0]) == [
+        1, -1, -2, -3]
+    for columns, sentinels in [([x], (-1, None, -3)),
+                               ([np.arange(4.0), x], (-1, -2, -3))]:
+        try:
+            selection_array(columns, selection, sentinels)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_pack_batch(capsys):
+
+    selections = [parse_selection({'name': ['a']}),
+                  parse_selection({'name': ['b', 'c'], 'dtype': 'int32'})]
+    arrays = [np.arange(3, dtype=np.float32).reshape(1, 3),
+              np.arange(10, dtype=np.int32).reshape(2, 5)]
+
+    body = gzip.decompress(compress(pack_batch(arrays, selections), 'gzip'))
+    (first, a), (second, b) = unpack_batch(body)
+
+    assert first['names'] == ['a'] and second['names'] == ['b', 'c']
+    assert second['offset'] % 8 == 0
+    assert np.array_equal(a, arrays[0]) and np.array_equal(b, arrays[1])
+
+
+def test_etag(capsys):
+
+    selections = [parse_selection({'name': ['a']})]
+    etag = make_etag(['h1'], selections, (0, 1, 2), None)
+
+    assert etag != make_etag(['h2'], selections, (0, 1, 2), None)
+    assert etag != make_etag(['h1'], selections, (0, 1, 2), 'gzip')
+    assert etag_matches(etag, 'W/"x", ' + etag)
+    assert not etag_matches(etag, None)
+
+    assert accepted_encoding('gzip, deflate') == 'gzip'
+    assert accepted_encoding('gzip;q=0') is None
@@ -0,0 +1,130 @@
+'''
+Brief : Tests for the /codex response encoding
+
+Copyright 2019 California Institute of Technology.  ALL RIGHTS RESERVED.
+U.S. Government Sponsorship acknowledged.
+'''
+import os
+import sys
+import json
+
+import numpy as np
+
+CODEX_ROOT = os.getenv('CODEX_ROOT')
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.frames import *
+
+
+def test_encode_json(capsys):
+
+    result = {'data': np.arange(4.0).reshape(2, 2), 'mean': np.float32(1.5),
+              'clusters': [0, 1]}
+    assert json.loads(encode_json(result)) == {
+        'data': [[0.0, 1.0], [2.0, 3.0]], 'mean': 1.5, 'clusters': [0, 1]}
+
+
+def test_encode_binary(capsys):
+
+    data = np.random.rand(1000, 3)
+    clusters = np.array([0, 1, 1, -1], dtype=np.int64)
+    result = {'data': data, 'clusters': clusters, 'downsample': [1.0, 2.0],
+              'y_pred': None, 'scaled': ['a'], 'name': 'x'}
+
+    message, frames = encode_binary(result)
+    message = json.loads(message)
+    assert message['frames'] == 3
+    assert message['name'] == 'x'
+    assert message['y_pred'] is None
+    assert message['scaled'] == ['a']
+    assert message['data'] == {'$frame': 0, 'dtype': 'float32', 'shape': [1000, 3]}
+    assert message['clusters']['dtype'] == 'int32'
+
+    index, array = unpack_frame(frames[0])
+    assert index == 0
+    assert np.allclose(array, data.astype(np.float32))
+    assert (len(frames[0]) - array.nbytes) % 8 == 0
+
+    index, array = unpack_frame(frames[1])
+    assert index == 1
+    assert array.tolist() == [0, 1, 1, -1]
+
+    index, array = unpack_frame(frames[2])
+    assert array.tolist() == [1.0, 2.0]
+
+    # the response itself is left alone
+    assert result['data'] is data
+
+
+def test_encode_binary_int_range(capsys):
+
+    large = np.array([0, 2**31, -2**31 - 1], dtype=np.int64)
+    unsigned = np.array([2**32 - 1], dtype=np.uint32)
+    result = {'clusters': large, 'y_pred': unsigned,
+              'downsample': np.array([-2**31, 2**31 - 1], dtype=np.int64)}
+
+    message, frames = encode_binary(result)
+    message = json.loads(message)
+    assert message['frames'] == 1
+    assert message['clusters'] == [0, 2**31, -2**31 - 1]
+    assert message['y_pred'] == [2**32 - 1]
+
+    index, array = unpack_frame(frames[0])
+    assert array.tolist() == [-2**31, 2**31 - 1]
+
+
+def test_stream_result(capsys):
+
+    assert stream_rows({}) == 0
+    assert stream_rows({'stream': True}) == CODEX_STREAM_ROWS
+    assert stream_rows({'stream': True, 'chunk_rows': 10}) == 10
+
+    result = {'routine': 'arrange', 'data': np.arange(25.0).reshape(25, 1),
+              'clusters': list(range(5)), 'name': ['x']}
+
+    parts = list(stream_result(result, 10))
+    assert [p['seq'] for p in parts] == [0, 1, 2, 3]
+    assert [p['offset'] for p in parts[:3]] == [0, 10, 20]
+    assert all(p['field'] == 'data' and p['rows'] == 25 for p in parts[:3])
+    assert parts[0]['routine'] == 'arrange'
+    assert np.array_equal(np.concatenate([p['data'] for p in parts[:3]]),
+                          result['data'])
+
+    summary = parts[-1]
+    assert summary['final'] and summary['chunks'] == 3
+    assert summary['streamed'] == ['data']
+    assert 'data' not in summary
+    assert summary['clusters'] == list(range(5))
+
+    # small responses are sent whole
+    assert list(stream_result(result, 0)) == [result]
+    assert list(stream_result(result, 100)) == [result]
+
+
+def test_row_stream(capsys):
+
+    request = {'routine': 'algorithm', 'identification': 'x', 'chunk_rows': 10}
+    stream = RowStream(stream_rows(request), request)
+    y_pred = np.arange(25.0)
+
+    # blocks a handler yields are sent as they come
+    blocks = list(row_blocks('y_pred', y_pred, 10))
+    assert len(blocks) == 3 and all(isinstance(b, RowBlock) for b in blocks)
+    first, = stream.messages(blocks[0])
+    assert first['seq'] == 0 and first['routine'] == 'algorithm'
+    assert (first['field'], first['offset'], first['rows']) == ('y_pred', 0, 25)
+    assert [m['seq'] for b in blocks[1:] for m in stream.messages(b)] == [1, 2]
+
+    # the response is split where it is still long, then summarizes every block
+    response = {'y_pred': y_pred, 'data': np.zeros((12, 2)), 'score': 1.0}
+    parts = list(stream.messages(response))
+    assert [p['seq'] for p in parts] == [3, 4, 5]
+    assert [p['field'] for p in parts[:2]] == ['data', 'data']
+    assert parts[0]['identification'] == 'x'
+    summary = parts[-1]
+    assert summary['chunks'] == 5 and summary['streamed'] == ['y_pred', 'data']
+    assert 'y_pred' not in summary and summary['score'] == 1.0
+
+    # the next response starts over
+    assert list(stream.messages({'score': 2.0})) == [{'score': 2.0}]
+    assert list(row_blocks('y_pred', y_pred, 30)) == []
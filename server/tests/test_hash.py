@@ -62,6 +62,246 @@ def test_remove_stale_data(capsys):
     hashResult = ch.hashArray("x2", x1, "feature", session=session)
     ch.remove_stale_data(session=session)
 
+def test_memory_budget(capsys):
+
+    session = 'budget'
+    ch = CodexHash(session_budget=0.01, spill_dir='')   # ~10 KB
+    for category in ["feature", "subset", "downsample", "label"]:
+        ch.resetCacheList(category, session=session)
+
+    source = ch.hashArray("source", np.arange(500.0), "feature", session=session)
+    assert source["memory"] == 4000
+
+    d1 = ch.hashArray("d1", np.arange(400.0), "downsample", session=session)
+    d2 = ch.hashArray("d2", np.arange(401.0), "downsample", session=session)
+    ch.findHashArray("name", "d1", "downsample", session=session)
+    assert ch.getMemoryUsage(session=session)["session"] == 4000 + 3200 + 3208
+
+    # over budget: the least recently used derived entry goes first
+    ch.hashArray("Merged", np.arange(300.0), "feature", session=session)
+    assert ch.findHashArray("name", "d2", "downsample", session=session) is None
+    assert ch.findHashArray("name", "d1", "downsample", session=session) is not None
+    assert ch.getMemoryUsage(session=session)["session"] <= ch.session_budget
+
+    # source features are never evicted
+    ch.hashArray("source2", np.arange(1000.0), "feature", session=session)
+    assert ch.findHashArray("name", "source", "feature", session=session) is not None
+    assert ch.findHashArray("name", "source2", "feature", session=session) is not None
+    assert len(ch.sessions[session]["downsampleList"]) == 0
+    assert ch.findHashArray("name", "Merged", "feature", session=session) is None
+    assert ch.remove_stale_data(session=session) == False
+
+def test_memory_budget_lfu(capsys):
+
+    session = 'budget_lfu'
+    ch = CodexHash(session_budget=0.01, eviction="lfu")
+    ch.resetCacheList("downsample", session=session)
+
+    ch.hashArray("d1", np.arange(400.0), "downsample", session=session)
+    ch.hashArray("d2", np.arange(401.0), "downsample", session=session)
+    for _ in range(3):
+        ch.findHashArray("name", "d1", "downsample", session=session)
+    ch.findHashArray("name", "d2", "downsample", session=session)
+
+    ch.hashArray("d3", np.arange(700.0), "downsample", session=session)
+    assert ch.findHashArray("name", "d2", "downsample", session=session) is None
+    assert ch.findHashArray("name", "d1", "downsample", session=session) is not None
+
+def test_spill_to_disk(tmpdir, monkeypatch):
+
+    # arrays other tests still hold would be shared, and never spilled
+    monkeypatch.setattr(CodexHash, "blobs", BlobStore())
+    session = 'spill'
+    ch = CodexHash(session_budget=0.01, spill_dir=str(tmpdir))
+    for category in ["feature", "subset", "downsample", "label"]:
+        ch.resetCacheList(category, session=session)
+
+    first = np.arange(400.0)
+    ch.hashArray("first", first, "feature", session=session)
+    ch.hashArray("second", first * 2, "feature", session=session)
+    ch.hashArray("d1", first, "downsample", session=session)
+
+    # derived entries are evicted before anything is spilled
+    ch.hashArray("third", first * 3, "feature", session=session)
+    assert len(ch.sessions[session]["downsampleList"]) == 0
+    assert ch.getMemoryUsage(session=session)["session"] == 9600
+
+    # then the coldest source array is spilled, leaving a stub in memory
+    ch.hashArray("fourth", first * 4, "feature", session=session)
+    stub = ch.sessions[session]["featureList"].find("name", "first")
+    assert stub["data"] is None and stub["memory"] == 0
+    assert os.path.exists(stub["spilled"])
+    assert ch.getMemoryUsage(session=session)["session"] == 9600
+
+    # and paged back in on access, spilling the next coldest
+    point = ch.findHashArray("name", "first", "feature", session=session)
+    assert np.array_equal(point["data"], first)
+    assert "spilled" not in point
+    assert ch.sessions[session]["featureList"].find("name", "second")["data"] is None
+    assert [p["name"] for p in ch.return_data(session=session)["features"]] == [
+        "first", "second", "third", "fourth"]
+
+    ch.resetCacheList("feature", session=session)
+    assert not [f for _, _, files in os.walk(str(tmpdir)) for f in files]
+
+def test_register_hd5(tmpdir):
+
+    session = 'lazy'
+    ch = CodexHash(session_budget=0.01, spill_dir='')   # ~10 KB
+    ch.resetCacheList("feature", session=session)
+
+    path = str(tmpdir.join('lazy.h5'))
+    data = np.arange(1000.0)
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('group/x', data=data, chunks=(64, ))
+
+    point = ch.registerHD5('group/x', path, 'group/x', session=session)
+    assert point["samples"] == 1000 and point["memory"] == 0
+    assert ch.registerHD5('group/x', path, 'group/x', session=session)["hash"] == point["hash"]
+    assert ch.getSentinelValues(['group/x'], session=session)["nan"] is None
+
+    # rows are read from the file without reading the dataset
+    rows, = ch.findHashSlices("name", ["group/x"], "feature", start=10, stop=500, step=3, session=session)
+    assert np.array_equal(rows["data"], data[10:500:3])
+    rows, = ch.findHashSlices("name", ["group/x"], "feature", samples=100, session=session)
+    assert np.array_equal(rows["data"], data[::10])
+    assert ch.getMemoryUsage(session=session)["session"] == 0
+
+    # the whole dataset is read on access, and dropped over budget
+    assert np.array_equal(ch.findHashArray("name", "group/x", "feature", session=session)["data"], data)
+    assert ch.getMemoryUsage(session=session)["session"] == 8000
+    ch.hashArray("other", data * 2, "feature", session=session)
+    assert ch.sessions[session]["featureList"].find("name", "group/x")["data"] is None
+    assert ch.getMemoryUsage(session=session)["session"] == 8000
+
+    # a later upload under the same name replaces the file, not the data
+    replaced = str(tmpdir.join('replaced.h5'))
+    with h5py.File(replaced, 'w') as f:
+        f.create_dataset('group/x', data=data * 3)
+    os.replace(replaced, path)
+    assert np.array_equal(ch.findHashArray("name", "group/x", "feature", session=session)["data"], data)
+    assert np.array_equal(ch.return_data(session=session)["features"][0]["data"], data)
+
+    # the hard link goes with the record
+    ch.resetCacheList("feature", session=session)
+    assert not os.listdir(str(tmpdir.join(HD5_KEEP_DIR)))
+
+def test_hash_npy_columns(tmpdir):
+
+    session = 'npy'
+    ch = CodexHash()
+    ch.resetCacheList("feature", session=session)
+
+    data = np.random.rand(1000, 3)
+    for order, matrix in [('c', data.astype(np.float32)), ('f', np.asfortranarray(data))]:
+        path = str(tmpdir.join(order + '.npy'))
+        np.save(path, matrix)
+
+        # same records as hashing each column on its own
+        records = ch.hashNpyColumns(path, 0, 3, "feature", session=session)
+        for x, record in enumerate(records):
+            expected = ch.hashArray("feature_" + str(x), matrix[:, x], "NOSAVE", session=session)
+            assert record["name"] == "feature_" + str(x)
+            assert record["hash"] == expected["hash"] and record["data"] is None
+            stored = ch.findHashArray("hash", record["hash"], "feature", session=session)["data"]
+            assert np.array_equal(stored, expected["data"])
+
+    # a Fortran ordered float64 file is kept mapped, the rest copied once
+    assert isinstance(column_major(np.load(path, mmap_mode='r'), 0, 3).base, np.memmap)
+    out = column_major(data, 1, 3, block_bytes=100)
+    assert out.flags.c_contiguous and np.array_equal(out, data[:, 1:3].T)
+
+    ch.resetCacheList("feature", session=session)
+
+def test_shared_blobs(capsys):
+
+    ch = CodexHash()
+    data = np.random.rand(1000)
+    for session in ['blob_a', 'blob_b']:
+        ch.resetCacheList("feature", session=session)
+    before = (len(CodexHash.blobs), CodexHash.blobs.nbytes)
+
+    a = ch.hashArray("x", data, "feature", session='blob_a')
+    b = ch.hashArray("y", data.copy(), "feature", session='blob_b')
+    ch.hashArray("z", data * 2, "feature", session='blob_b')
+
+    # same data under another name and session is stored once
+    assert a["hash"] != b["hash"]
+    assert a["blob"] == b["blob"]
+    assert a["data"] is b["data"]
+    assert CodexHash.blobs.refs(a["blob"]) == 2
+    assert CodexHash.blobs.nbytes - before[1] == 2 * data.nbytes
+    assert ch.getMemoryUsage(session='blob_b')["session"] == 2 * data.nbytes
+
+    ch.deleteHashName("x", "feature", session='blob_a')
+    assert CodexHash.blobs.refs(a["blob"]) == 1
+    assert np.array_equal(
+        ch.findHashArray("name", "y", "feature", session='blob_b')["data"], data)
+
+    ch.resetCacheList("feature", session='blob_b')
+    assert (len(CodexHash.blobs), CodexHash.blobs.nbytes) == before
+
+def test_shared_blob_budget(tmpdir, monkeypatch):
+
+    # a cache of its own, the global budget counts every session
+    monkeypatch.setattr(CodexHash, "sessions", {})
+    monkeypatch.setattr(CodexHash, "blobs", BlobStore())
+    ch = CodexHash(memory_budget=0.01, spill_dir=str(tmpdir))   # ~10 KB
+
+    data = np.arange(500.0)
+    shared = ch.hashArray("x", data, "feature", session='budget_a')
+    ch.hashArray("x", data, "feature", session='budget_b')
+    ch.hashArray("own", data * 3, "feature", session='budget_a')
+    assert ch.getMemoryUsage(session='budget_a')["total"] == 8000
+
+    # spilling the coldest, shared array would free nothing
+    ch.hashArray("new", data * 5, "feature", session='budget_b')
+    assert ch.getMemoryUsage(session='budget_a')["total"] == 8000
+    assert CodexHash.blobs.refs(shared["blob"]) == 2
+    for session in ['budget_a', 'budget_b']:
+        point = ch.sessions[session]["featureList"].find("name", "x")
+        assert point["data"] is not None and "spilled" not in point
+    own = ch.sessions['budget_a']["featureList"].find("name", "own")
+    assert own["data"] is None and os.path.exists(own["spilled"])
+    assert len([f for _, _, files in os.walk(str(tmpdir)) for f in files]) == 1
+
+    # dropping one of two references to a derived array frees nothing
+    ch.memory_budget = 0
+    for session in ['budget_a', 'budget_b']:
+        ch.hashArray("d", data * 7, "downsample", session=session)
+    assert ch._CodexHash__reclaim('budget_a') == 0
+    assert ch._CodexHash__reclaim('budget_b') == 4000
+
+    for session in ['budget_a', 'budget_b']:
+        ch.resetCacheList("feature", session=session)
+
+def test_hash_array(capsys):
+
+    data = np.random.rand(100_000)
+    # chunked buffer hashing matches hashing a bytes copy
+    assert hash_array(data).hexdigest() == hashlib.sha1(data.tobytes()).hexdigest()
+    assert new_hasher("blake2b").name == "blake2b"
+
+    ch = CodexHash()
+    ch.resetCacheList("feature", session='hash_array')
+    record = ch.hashArray("x", data, "feature", session='hash_array')
+    assert record["hash"] == hashlib.sha1(data.tobytes() + b"x").hexdigest()
+
+    # contiguous float64 input is stored without a copy
+    assert record["data"] is data or np.shares_memory(record["data"], data)
+
+    strided = np.arange(10)[::2]
+    record = ch.hashArray("y", strided, "feature", session='hash_array')
+    assert record["data"].flags["C_CONTIGUOUS"]
+    assert record["data"].dtype == np.float64
+    assert record["categories"] is None
+
+    # strings are stored as tokens, with the strings they stand for
+    record = ch.hashArray("z", np.array(["b", "a", "b"]), "feature", session='hash_array')
+    assert list(record["data"]) == [1.0, 0.0, 1.0]
+    stored = ch.findHashArray("name", "z", "feature", session='hash_array')
+    assert stored["categories"] == ["a", "b"]
+
 def test_hashUpdate(capsys):
 
     session = 'foo'
@@ -172,11 +412,110 @@ def test_findHashArray(capsys):
     result = ch.findHashArray('hash',hashResult_subset["hash"],"unknown_type", session=session)
 
 
+def test_hashIndex(capsys):
+
+    session = 'foo'
+    ch = CodexHash()
+    ch.resetCacheList("feature", session=session)
+
+    x1 = np.array([2,3,1,0])
+    x2 = np.array([4,5,6,7])
+    h1 = ch.hashArray("x1", x1, "feature", session=session)
+    h2 = ch.hashArray("x2", x2, "feature", session=session)
+
+    # duplicate data is not stored twice
+    ch.hashArray("x1", x1, "feature", session=session)
+    assert len(ch.sessions[session]["featureList"]) == 2
+
+    assert ch.findHashArray("hash", h2["hash"], "feature", session=session)["name"] == "x2"
+    assert ch.feature2hashList(["x2", "x1"], session=session) == [h2["hash"], h1["hash"]]
+
+    # renaming keeps the name index in sync
+    assert ch.hashUpdate("name", "x2", "x3", "feature", session=session) == True
+    assert ch.findHashArray("name", "x2", "feature", session=session) is None
+    assert ch.findHashArray("name", "x3", "feature", session=session)["hash"] == h2["hash"]
+
+    # unindexed fields fall back to a scan
+    assert ch.findHashArray("samples", 4, "feature", session=session)["name"] == "x1"
+
+    assert ch.deleteHashName("x1", "feature", session=session) == True
+    assert ch.deleteHashName("x1", "feature", session=session) == False
+    assert ch.findHashArray("hash", h1["hash"], "feature", session=session) is None
+    assert [p["name"] for p in ch.sessions[session]["featureList"]] == ["x3"]
+
+    ch.resetCacheList("feature", session=session)
+    assert ch.findHashArray("name", "x3", "feature", session=session) is None
+
+def test_findHashArrays(capsys):
+
+    session = 'foo'
+    ch = CodexHash()
+    ch.resetCacheList("feature", session=session)
+
+    h1 = ch.hashArray("x1", np.array([2,3,1,0]), "feature", session=session)
+    h2 = ch.hashArray("x2", np.array([4,5,6,7]), "feature", session=session)
+
+    result = ch.findHashArrays("name", ["x2", "missing", "x1"], "feature", session=session)
+    assert result[0]["hash"] == h2["hash"]
+    assert result[1] is None
+    assert result[2]["hash"] == h1["hash"]
+
+def test_batch(capsys):
+
+    cache = WrappedCache('foo', cache=CodexHash())
+    cache.resetCacheList("feature")
+    cache.hashArray("x1", np.array([2,3,1,0]), "feature")
+
+    batch = cache.batch()
+    assert batch.findHashArrays("name", ["x1"], "feature") == 0
+    assert batch.get_nan() == 1
+    assert len(batch) == 2
+
+    arrays, nan = batch.execute()
+    assert arrays[0]["name"] == "x1"
+    assert nan is None
+    assert batch.execute() == []
+
 def test_mergeHashResults(capsys):
 
     cache = CodexHash()
     cache.mergeHashResults(None, session=cache)
 
+def test_mergeHashView(capsys):
+
+    session = 'merge_view'
+    cache = CodexHash(session_budget=0.01, spill_dir='')
+    cache.resetCacheList("feature", session=session)
+    a = cache.hashArray("a", np.arange(100.0), "feature", session=session)
+    b = cache.hashArray("b", np.arange(100.0) * 2, "feature", session=session)
+    cache.hashArray("short", np.arange(10.0), "feature", session=session)
+
+    # columns follow the hash list order
+    merged = cache.mergeHashResults([a["hash"], b["hash"]], session=session)
+    assert np.array_equal(merged[:, 1], b["data"])
+
+    view = cache.mergeHashView([a["hash"], b["hash"]], session=session)
+    assert view["data"] is None
+    assert view["members"] == [a["hash"], b["hash"]]
+    assert cache.getMemoryUsage(session=session)["session"] == 1680
+
+    # built on first access
+    point = cache.findHashArray("hash", view["hash"], "feature", session=session)
+    assert np.array_equal(point["data"], merged)
+    assert cache.getMemoryUsage(session=session)["session"] == 1680 + 1600
+
+    # the same feature set reuses the same record
+    again = cache.mergeHashView([a["hash"], b["hash"]], session=session)
+    assert again["hash"] == view["hash"]
+    assert len(cache.sessions[session]["featureList"]) == 4
+    assert cache.mergeHashView([b["hash"], a["hash"]], session=session)["hash"] != view["hash"]
+
+    # evicting a view only drops its data
+    cache.hashArray("big", np.arange(1000.0), "feature", session=session)
+    assert cache.sessions[session]["featureList"].find("hash", view["hash"])["data"] is None
+    point = cache.findHashArray("hash", view["hash"], "feature", session=session)
+    assert np.array_equal(point["data"], merged)
+
 def test_pickle_data(capsys):
 
     cache = CodexHash()
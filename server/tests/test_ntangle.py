@@ -0,0 +1,313 @@
+'''
+Brief : Tests for the ntangle cache transport
+
+Copyright 2019 California Institute of Technology.  ALL RIGHTS RESERVED.
+U.S. Government Sponsorship acknowledged.
+'''
+import os
+import sys
+import time
+import asyncio
+import threading
+import multiprocessing
+
+import numpy as np
+
+CODEX_ROOT = os.getenv('CODEX_ROOT')
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.ntangle import shm
+from api.sub.ntangle import protocol
+from api.sub.ntangle.channel import Receiver
+from api.sub.ntangle.client import Client
+from api.sub.ntangle.client import ClientPool
+from api.sub.ntangle.server import Server
+from api.sub.ntangle.server import expose
+
+
+class Echo:
+    @expose('echo')
+    def echo(self, value, **kwargs):
+        return value
+
+    @expose('record')
+    def record(self, n, **kwargs):
+        return {'name': 'x', 'data': np.arange(n, dtype=np.float64)}
+
+
+class Slow:
+    @expose('sleep')
+    def sleep(self, seconds):
+        time.sleep(seconds)
+        return seconds
+
+    @expose('ping')
+    def ping(self):
+        print('pong')
+        return True
+
+
+def start_server(wrapped, shm_dir=None, port=42399, workers=1):
+    address = 'tcp://127.0.0.1:{}'.format(port)
+    server = Server(wrapped, logging=False, shm_dir=shm_dir)
+    thread = threading.Thread(
+        target=server.listen, args=(address, ), kwargs={'workers': workers})
+    thread.daemon = True
+    thread.start()
+    return address, thread
+
+
+def test_protocol_roundtrip(capsys):
+
+    matrix = np.arange(12, dtype=np.float32).reshape(3, 4)
+    payload = {
+        'matrix': matrix,
+        'column': matrix[:, 1],
+        'empty': np.array([]),
+        'strings': np.array(['a', 'bc']),
+        'scalar': np.float64(2.5),
+        'pair': (1, 'two'),
+        'bytes': b'raw',
+        'set': {1, 2},
+        'error': ValueError('bad'),
+        3: None,
+    }
+
+    frames = protocol.dumps(payload)
+    # the header only holds references to the array buffers
+    assert len(frames) == 5
+    assert len(frames[0]) < matrix.nbytes + 200
+
+    result = protocol.loads(frames)
+    assert np.array_equal(result['matrix'], matrix)
+    assert result['matrix'].dtype == np.float32
+    assert np.array_equal(result['column'], matrix[:, 1])
+    assert result['empty'].shape == (0, )
+    assert list(result['strings']) == ['a', 'bc']
+    assert result['scalar'] == 2.5 and isinstance(result['scalar'], np.float64)
+    assert result['pair'] == (1, 'two')
+    assert result['bytes'] == b'raw'
+    assert result['set'] == {1, 2}
+    assert isinstance(result['error'], ValueError)
+    assert result[3] is None
+
+
+def test_client_server(capsys):
+
+    address, thread = start_server(Echo(), port=42396)
+    client = Client(address, timeout=5_000)
+
+    data = np.random.rand(20_000, 3)
+    assert np.array_equal(client.echo(data), data)
+    assert client.echo((1, [2, {'three': 3}])) == (1, [2, {'three': 3}])
+
+    client._shutdown()
+    thread.join()
+
+
+def test_shm_pack_unpack(tmpdir):
+
+    small = np.arange(4)
+    large = np.arange(100_000, dtype=np.float64).reshape(50_000, 2)
+    payload = {'small': small, 'nested': [large, (large[:, 0], 'label')]}
+
+    packed, exported = shm.pack(payload, str(tmpdir))
+    assert len(exported) == 2
+    assert packed['small'] is small
+    assert isinstance(packed['nested'][0], shm.SharedArray)
+    assert isinstance(payload['nested'][0], np.ndarray)
+
+    result = shm.unpack(packed, str(tmpdir))
+    assert len(os.listdir(str(tmpdir))) == 0
+    assert np.array_equal(result['nested'][0], large)
+    assert np.array_equal(result['nested'][1][0], large[:, 0])
+    assert result['nested'][1][1] == 'label'
+    assert not result['nested'][0].flags.writeable
+
+    # a peer cannot have files outside the directory removed
+    outside = tmpdir.mkdir('outside').join('ntangle-1-x')
+    outside.write(b'\0' * 8)
+    for path in [str(outside), str(tmpdir.join('other'))]:
+        try:
+            shm.unpack(shm.SharedArray(path, '<f8', (1, )), str(tmpdir))
+            assert False
+        except ValueError:
+            pass
+    assert outside.check()
+
+
+def test_shm_cleanup(tmpdir):
+
+    directory = str(tmpdir)
+    reply = shm.export_array(np.arange(10.0), directory)
+
+    # reply segments nobody received are removed once expired
+    segments = shm.ReplySegments(ttl=60)
+    segments.add([reply])
+    assert segments.sweep() == 0 and os.path.exists(reply.path)
+    assert segments.sweep(now=time.monotonic() + 60) == 1
+    assert not os.path.exists(reply.path)
+
+    # segments of processes that are gone are removed on start
+    worker = multiprocessing.Process(target=shm.export_array,
+                                     args=(np.arange(10.0), directory))
+    worker.start()
+    worker.join()
+    mine = shm.export_array(np.arange(10.0), directory)
+    assert shm.remove_stale(directory) == 1
+    assert os.listdir(directory) == [os.path.basename(mine.path)]
+
+
+def test_shm_client_server(tmpdir):
+
+    address, thread = start_server(Echo(), shm_dir=str(tmpdir))
+    client = Client(address, timeout=5_000, shm_dir=str(tmpdir))
+
+    data = np.random.rand(20_000, 3)
+    assert np.array_equal(client.echo(data), data)
+
+    record = client.record(100_000)
+    assert record['name'] == 'x'
+    assert np.array_equal(record['data'], np.arange(100_000))
+    assert len(os.listdir(str(tmpdir))) == 0
+
+    client._shutdown()
+    thread.join()
+
+
+def test_concurrent_workers(capsys):
+
+    address, thread = start_server(Slow(), port=42398, workers=4)
+
+    slow = Client(address, timeout=5_000)
+    fast = Client(address, timeout=5_000)
+
+    sleeper = threading.Thread(target=slow.sleep, args=(1.0, ))
+    sleeper.start()
+    time.sleep(0.1)
+
+    # every call goes to an idle worker while the first is still busy
+    for _ in range(6):
+        start = time.time()
+        assert fast.ping() == True
+        assert time.time() - start < 0.5
+    assert 'pong' in capsys.readouterr().out
+
+    sleeper.join()
+    fast._shutdown()
+    thread.join()
+
+
+def test_batch(tmpdir):
+
+    address, thread = start_server(Echo(), shm_dir=str(tmpdir), port=42397)
+    client = Client(address, timeout=5_000, shm_dir=str(tmpdir))
+
+    batch = client.batch(extra=True)
+    batch.echo(1)
+    batch.echo('two')
+    batch.record(100_000)
+    one, two, record = batch.execute()
+
+    assert one == 1
+    assert two == 'two'
+    assert np.array_equal(record['data'], np.arange(100_000))
+
+    try:
+        batch.missing
+        assert False
+    except AttributeError:
+        pass
+
+    client._shutdown()
+    thread.join()
+
+
+def push_results(sender, n):
+    for i in range(n):
+        sender.put_nowait({'result': {'i': i, 'data': np.arange(i + 1.0)},
+                           'done': False})
+    sender.put_nowait({'done': True})
+
+
+def test_result_channel(tmpdir):
+
+    async def run():
+        receiver = Receiver('ipc://' + os.path.join(str(tmpdir), 'results'))
+        first, queue = receiver.open()
+        second, other = receiver.open()
+
+        # the worker exits straight after sending
+        workers = [
+            multiprocessing.Process(target=push_results, args=(first, 3)),
+            multiprocessing.Process(target=push_results, args=(second, 1))
+        ]
+        for worker in workers:
+            worker.start()
+
+        results = []
+        while True:
+            response = await asyncio.wait_for(queue.get(), 5)
+            if response['done']:
+                break
+            results.append(response['result'])
+
+        assert [r['i'] for r in results] == [0, 1, 2]
+        assert np.array_equal(results[2]['data'], [0.0, 1.0, 2.0])
+
+        assert (await asyncio.wait_for(other.get(), 5))['result']['i'] == 0
+        assert (await asyncio.wait_for(other.get(), 5))['done']
+
+        receiver.close(first)
+        receiver.close(second)
+        assert len(receiver) == 0
+
+        for worker in workers:
+            worker.join()
+        receiver.stop()
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def pool_size_in_child(pool, conn):
+    conn.send(len(pool))
+
+
+def test_client_pool(capsys):
+
+    address, thread = start_server(Slow(), port=42395, workers=2)
+    pool = ClientPool()
+
+    first = pool.acquire(address, timeout=5_000)
+    second = pool.acquire(address, timeout=5_000)
+    assert first is not second
+    assert first.ping() == True
+
+    pool.release(first)
+    pool.release(second)
+    assert len(pool) == 2
+    assert pool.acquire(address, timeout=5_000) in (first, second)
+    assert pool.created == 2 and pool.reused == 1
+
+    # a client whose call timed out is not handed out again
+    slow = pool.acquire(address, timeout=100)
+    try:
+        slow.sleep(0.5)
+        assert False
+    except IOError:
+        pass
+    pool.release(slow)
+    time.sleep(0.5)
+    assert pool.acquire(address, timeout=100) is not slow
+
+    # a forked child does not share the parent's sockets
+    parent, child = multiprocessing.Pipe()
+    worker = multiprocessing.Process(
+        target=pool_size_in_child, args=(pool, child))
+    worker.start()
+    assert parent.recv() == 0
+    worker.join()
+    assert len(pool) == 1
+
+    Client(address, timeout=5_000)._shutdown()
+    thread.join()
@@ -65,3 +65,167 @@ def test_save_subset(capsys):
 
     assert outputHash == readingHash[0][0]
 
+
+def test_streaming_csv(capsys):
+
+    with open(CODEX_ROOT + '/uploads/doctest.csv', 'rb') as f:
+        contents = f.read()
+
+    import csv
+    with open(CODEX_ROOT + '/uploads/doctest.csv') as f:
+        rows = list(csv.DictReader(f))
+
+    parser = StreamingCSV()
+    for start in range(0, len(contents), 1000):
+        parser.feed(contents[start:start + 1000])
+    columns = parser.close()
+
+    assert parser.rows == len(rows)
+    assert list(columns) == list(rows[0])
+    for name, values in columns.items():
+        expected = [row[name] for row in rows]
+        if values.dtype.kind == 'f':
+            assert np.allclose(values, np.asarray(expected, dtype=float))
+        else:
+            assert list(values) == expected
+
+    # the whole file at once reads the same columns
+    read = read_csv_columns(CODEX_ROOT + '/uploads/doctest.csv')
+    for name, values in columns.items():
+        assert values.dtype == read[name].dtype
+        assert np.array_equal(values, read[name])
+
+    # quoted newlines do not end a row, even across blocks
+    parser = StreamingCSV()
+    for chunk in [b'a,b\n1,"x\n', b'y"\n2,', b'z\n3']:
+        parser.feed(chunk)
+    columns = parser.close()
+    assert list(columns['a']) == [1.0, 2.0, 3.0]
+    assert list(columns['b'][:2]) == ['x\ny', 'z']
+    assert np.isnan(columns['b'][2])
+
+    # a quoted field spanning many blocks
+    parser = StreamingCSV()
+    for chunk in [b'a,b\n1,"x'] + [b'\ny'] * 1000 + [b'"\n2,z\n']:
+        parser.feed(chunk)
+    columns = parser.close()
+    assert columns['b'][0] == 'x' + '\ny' * 1000 and columns['b'][1] == 'z'
+
+
+MIXED_CSV = 'n,label,x\n1,0,\n2,1,\n3,10,\n4,rock,\n5,1.50,2\n6,1e3,\n'
+
+
+def test_csv_block_boundaries(tmpdir):
+
+    path = str(tmpdir.join('mixed.csv'))
+    with open(path, 'w') as f:
+        f.write(MIXED_CSV)
+
+    # the text of a column does not depend on where the blocks split
+    whole = read_csv_columns(path, chunksize=False)
+    assert list(whole['label']) == ['0', '1', '10', 'rock', '1.50', '1e3']
+    for chunksize in [1, 2, 4]:
+        columns = read_csv_columns(path, chunksize=chunksize)
+        assert list(columns) == list(whole)
+        for name in whole:
+            assert columns[name].dtype == whole[name].dtype
+            assert list(columns[name].astype(str)) == list(whole[name].astype(str))
+
+    # as does an upload parsed as it arrives, given the file to read from
+    data = MIXED_CSV.encode()
+    for path_given in [False, True]:
+        parser = StreamingCSV()
+        for start in range(0, len(data), 3):
+            parser.feed(data[start:start + 3])
+        columns = parser.close(path if path_given else None)
+        if not path_given:
+            assert columns is None
+            continue
+        for name in whole:
+            assert list(columns[name].astype(str)) == list(whole[name].astype(str))
+
+    # so are the tokens, categories and hash stored from the column
+    cache = get_cache(DOCTEST_SESSION, timeout=None)
+    stored = []
+    for columns in [whole, read_csv_columns(path, chunksize=1)]:
+        tokens, categories = string2token(columns['label'], return_categories=True)
+        hashList, _ = hash_csv_columns(columns, ['label'], "feature", cache)
+        stored.append((list(tokens), list(categories), hashList[0]))
+    assert stored[0] == stored[1]
+    assert stored[0][1] == ['0', '1', '1.50', '10', '1e3', 'rock']
+    assert cache.findHashArray("hash", stored[0][2], "feature")['categories'] == stored[0][1]
+
+def test_read_csv_columns(tmpdir):
+
+    path = str(tmpdir.join('columns.csv'))
+    with open(path, 'w') as f:
+        f.write('x,label,x\n1,a,10\n2.5,b,20\n\nnan,a,30')
+
+    # a small block size makes the arrays grow as they are read
+    columns = CSVColumns(['x', 'label', 'x'])
+    with open(path, 'rb') as f:
+        read_csv_header(f.readline())
+        for frame in read_csv_blocks(f, columns.header, chunksize=1):
+            columns.append(frame)
+    columns = columns.close()
+
+    assert list(columns) == ['x', 'label']
+    assert list(columns['x']) == [10.0, 20.0, 30.0]
+    assert list(columns['label']) == ['a', 'b', 'a']
+    assert columns['label'].dtype == object
+    assert np.array_equal(read_csv_columns(path)['x'], columns['x'])
+
+def test_read_csv_na_text(tmpdir):
+
+    path = str(tmpdir.join('na.csv'))
+    with open(path, 'w') as f:
+        f.write('region,val,code,ratio\nNA,1,007,NaN\nEU,,010,inf\nNone,3,5,0.5\nnull,4,6,1\n')
+
+    # only empty cells are missing, other text is a category of its own
+    parser = StreamingCSV()
+    with open(path, 'rb') as f:
+        parser.feed(f.read())
+    for columns in [read_csv_columns(path, chunksize=1),
+                    read_csv_columns(path, chunksize=False),
+                    parser.close(path)]:
+        assert list(columns['region']) == ['NA', 'EU', 'None', 'null']
+        assert np.array_equal(columns['val'], [1.0, np.nan, 3.0, 4.0], equal_nan=True)
+        assert list(columns['code']) == [7.0, 10.0, 5.0, 6.0]
+        # as float() reads them
+        assert np.array_equal(columns['ratio'], [np.nan, np.inf, 0.5, 1.0], equal_nan=True)
+
+    tokens, categories = string2token(columns['region'], return_categories=True)
+    assert sorted(categories) == ['EU', 'NA', 'None', 'null']
+
+def test_read_parquet_arrow(tmpdir):
+
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather
+    import pyarrow.parquet
+
+    table = pa.table({
+        'x': np.arange(10.0),
+        'n': pa.array([1, None] * 5, type=pa.int32()),
+        'label': ['a', 'b', None, 'a', 'b'] * 2
+    })
+    parquet = str(tmpdir.join('columns.parquet'))
+    pyarrow.parquet.write_table(table, parquet, row_group_size=3)
+    arrow = str(tmpdir.join('columns.arrow'))
+    pyarrow.feather.write_feather(table, arrow, compression='zstd')
+
+    cache = get_cache(DOCTEST_SESSION, timeout=None)
+    for read, path in [(codex_read_parquet, parquet), (codex_read_arrow, arrow)]:
+        hashList, featureList = read(path, ['label', 'x'], "feature", session=DOCTEST_SESSION)
+        assert featureList == ['label', 'x']
+        assert np.array_equal(cache.findHashArray("hash", hashList[1], "feature")['data'], np.arange(10.0))
+
+        hashList, featureList = read(path, None, "feature", session=DOCTEST_SESSION)
+        assert featureList == ['x', 'n', 'label']
+        n = cache.findHashArray("hash", hashList[1], "feature")['data']
+        assert list(n[::2]) == [1.0] * 5 and np.isnan(n[1::2]).all()
+
+        assert read(path, ['missing'], "feature", session=DOCTEST_SESSION) is None
+
+    # a single chunk without nulls is not copied
+    values = arrow_values(pa.chunked_array([np.arange(5.0)]))
+    assert not values.flags.owndata
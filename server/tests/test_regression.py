@@ -9,6 +9,8 @@ import os
 import pytest
 import sys
 
+import numpy as np
+
 sys.path.insert(1, os.getenv('CODEX_ROOT'))
 
 from api.sub.hash       import DOCTEST_SESSION
@@ -118,3 +120,32 @@ def test_regression(capsys, testData):
 
     result = regression(testData['inputHash'], None, testData['featureNames'], testData['hashList'], testData['regrLabelHash'], False, "TransformedTargetRegressor",  False, [{}], 'explained_variance', "grid", 3, {}, ch).run()
     assert result['message'] == 'success'
+
+def test_regression_stream(capsys, testData):
+
+    ch = get_cache(DOCTEST_SESSION, timeout=None)
+
+    regressor = regression(testData['inputHash'], None, testData['featureNames'], testData['hashList'], testData['regrLabelHash'], False, "LinearRegression", False, {}, 'r2', "direct", None, {}, ch, False)
+    stream = regressor.stream(100)
+
+    # the input rows are sent before the fit
+    first = next(stream)
+    assert (first['field'], first['offset']) == ('data', 0)
+    assert not hasattr(regressor.algorithm, 'coef_')
+
+    # and each block of predictions before the next one is made
+    blocks = [first]
+    while blocks[-1]['field'] != 'y_pred':
+        blocks.append(next(stream))
+    assert 'y_pred' not in regressor.result
+
+    *rest, result = stream
+    blocks += rest
+    assert result['message'] == 'success'
+    samples = len(result['data'])
+    for field in ['data', 'y_pred']:
+        parts = [b for b in blocks if b['field'] == field]
+        assert len(parts) == -(-samples // 100)
+        assert all(b['rows'] == samples for b in parts)
+        assert np.array_equal(np.concatenate([b[field] for b in parts]), result[field])
+    assert np.allclose(result['y_pred'], regressor.algorithm.predict(result['data']))
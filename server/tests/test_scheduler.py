@@ -0,0 +1,110 @@
+'''
+Brief : Tests for the request scheduler lanes
+
+Copyright 2019 California Institute of Technology.  ALL RIGHTS RESERVED.
+U.S. Government Sponsorship acknowledged.
+'''
+import os
+import sys
+import time
+import asyncio
+import functools
+
+CODEX_ROOT = os.getenv('CODEX_ROOT')
+sys.path.insert(1, os.getenv('CODEX_ROOT'))
+
+from api.sub.scheduler import Lane, Scheduler, Overloaded
+
+
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+async def drain(lane, timeout=10):
+    start = time.time()
+    while lane.running or lane.depth:
+        assert time.time() - start < timeout
+        await asyncio.sleep(0.05)
+
+
+def test_lane_fairness(capsys):
+
+    async def run():
+        lane = Lane('test', workers=1, session_limit=1, queue_limit=0)
+
+        tickets = [lane.submit('a', functools.partial(nap, 0.1)) for _ in range(3)]
+        tickets.append(lane.submit('b', functools.partial(nap, 0.1)))
+
+        assert lane.running == 1
+        assert lane.depth == 3
+        assert lane.metrics()['sessions'] == 2
+
+        await drain(lane)
+
+        # b does not wait behind every task of a
+        order = sorted(tickets, key=lambda t: t.started)
+        assert [t.session for t in order] == ['a', 'b', 'a', 'a']
+        assert all(t.future.result() == 0.1 for t in tickets)
+        assert lane.completed == 4
+        assert lane.duration >= 0.1
+
+        lane.close()
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_lane_overload(capsys):
+
+    async def run():
+        lane = Lane('test', workers=1, session_limit=1, queue_limit=1)
+        scheduler = Scheduler([lane], lambda request: 'test')
+
+        running = scheduler.submit({'sessionkey': 'a'}, functools.partial(nap, 0.2))
+        waiting = scheduler.submit({'sessionkey': 'b'}, functools.partial(nap, 0.2))
+
+        try:
+            scheduler.submit({'sessionkey': 'c'}, functools.partial(nap, 0.2))
+            assert False
+        except Overloaded as e:
+            assert e.lane == 'test'
+            assert e.depth == 1
+            assert e.retry_after >= 1
+
+        # cancelling a waiting task frees its place in the queue
+        assert waiting.cancel()
+        assert waiting.done()
+        assert lane.depth == 0
+        scheduler.submit({'sessionkey': 'c'}, functools.partial(nap, 0.2))
+
+        await drain(lane)
+        assert running.future.result() == 0.2
+        assert waiting.future is None
+
+        metrics = scheduler.metrics()['test']
+        assert metrics['rejected'] == 1
+        assert metrics['completed'] == 2
+        assert metrics['depth'] == 0
+
+        scheduler.close()
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_thread_lane(capsys):
+
+    async def run():
+        lane = Lane('test', workers=2, session_limit=1, queue_limit=0,
+                    threads=True)
+
+        tickets = [lane.submit(s, functools.partial(nap, 0.1)) for s in 'aab']
+        # the second task of a waits while b runs next to the first
+        assert lane.running == 2
+        assert lane.depth == 1
+
+        await drain(lane)
+        assert all(t.future.result() == 0.1 for t in tickets)
+
+        lane.close()
+
+    asyncio.new_event_loop().run_until_complete(run())
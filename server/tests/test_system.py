@@ -26,6 +26,13 @@ def test_string2token(capsys):
     result = string2token(stringArray)
     assert len(result) == 3
 
+    # tokens index the sorted category table, missing values included
+    values = np.array(["b", None, "a", np.nan, "b"], dtype=object)
+    tokens, categories = string2token(values, return_categories=True)
+    assert list(categories) == ["None", "a", "b", "nan"]
+    assert list(tokens) == [2.0, 0.0, 1.0, 3.0, 2.0]
+    assert list(string2token(np.array(["x", 1, 1.5], dtype=object))) == [2.0, 0.0, 1.0]
+
 def test_get_codex_memory_usage(capsys):
 
     memory = get_codex_memory_usage()